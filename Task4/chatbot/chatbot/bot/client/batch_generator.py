@@ -0,0 +1,265 @@
+import random
+import threading
+
+import llama_cpp
+from helpers.log import get_logger
+from llama_cpp import Llama, llama_chat_format
+from llama_cpp import _internals as internals
+
+logger = get_logger(__name__)
+
+
+def load_chat_formatter(llm: Llama) -> llama_chat_format.Jinja2ChatFormatter | None:
+    """
+    Loads the chat formatter matching the chat format used by `Llama.create_chat_completion`.
+
+    Only the chat template stored in the GGUF metadata can be rendered outside llama-cpp; a guessed chat format
+    (e.g. "llama-3" or "chatml") is used only when it matches that template exactly.
+
+    Args:
+        llm (Llama): The loaded model.
+
+    Returns:
+        Jinja2ChatFormatter | None: The chat formatter, or None if the model uses a custom chat format or handler.
+    """
+    template = llm.metadata.get("tokenizer.chat_template")
+    if template is None or llm.chat_handler is not None:
+        return None
+
+    if llm.chat_format not in (
+        "chat_template.default",
+        llama_chat_format.guess_chat_format_from_gguf_metadata(llm.metadata),
+    ):
+        return None
+
+    eos_token_id = llm.token_eos()
+    bos_token_id = llm.token_bos()
+    return llama_chat_format.Jinja2ChatFormatter(
+        template=template,
+        eos_token=llm._model.token_get_text(eos_token_id) if eos_token_id != -1 else "",
+        bos_token=llm._model.token_get_text(bos_token_id) if bos_token_id != -1 else "",
+        stop_token_ids=[eos_token_id],
+    )
+
+
+def group_sequences(lengths: list[int], max_new_tokens: int, n_ctx: int, n_seq_max: int) -> list[list[int]]:
+    """
+    Groups prompts into batches whose prompts and answers fit together in the context window.
+
+    Args:
+        lengths (list[int]): The number of tokens of each prompt.
+        max_new_tokens (int): The maximum number of new tokens generated for each prompt.
+        n_ctx (int): The size of the context window shared by the sequences of a batch.
+        n_seq_max (int): The maximum number of sequences in a batch.
+
+    Returns:
+        list[list[int]]: The indexes of the prompts of each batch, in order.
+
+    Raises:
+        ValueError: If a prompt doesn't fit in the context window.
+    """
+    groups, group, used = [], [], 0
+    for idx, length in enumerate(lengths):
+        if length >= n_ctx:
+            raise ValueError(f"Requested tokens ({length}) exceed context window of {n_ctx}")
+        needed = min(length + max_new_tokens, n_ctx)
+        if group and (len(group) == n_seq_max or used + needed > n_ctx):
+            groups.append(group)
+            group, used = [], 0
+        group.append(idx)
+        used += needed
+    if group:
+        groups.append(group)
+    return groups
+
+
+class BatchGenerator:
+    """
+    Generates answers for several independent prompts by decoding them as parallel sequences of the same llama.cpp
+    batches.
+
+    Each decoding step evaluates one token for every unfinished sequence in a single forward pass, so the weights are
+    read once per step instead of once per prompt, which is what bounds the decoding speed on CPU.
+
+    The generator owns a llama.cpp context with room for `n_seq_max` sequences. It shares the weights of the loaded
+    model, and its KV cache (`n_ctx` tokens shared by all the sequences) is only allocated on first use.
+    """
+
+    SAMPLING_PARAMS = ("temperature", "top_p", "top_k", "min_p", "stop")
+
+    def __init__(self, llm: Llama, n_seq_max: int = 4):
+        if n_seq_max < 1:
+            raise ValueError(f"n_seq_max must be a positive integer, got {n_seq_max}")
+
+        self.llm = llm
+        self.n_seq_max = n_seq_max
+        self.chat_formatter = load_chat_formatter(llm)
+        self._ctx: internals.LlamaContext | None = None
+        self._batch: internals.LlamaBatch | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_supported(self) -> bool:
+        return self.chat_formatter is not None
+
+    def _init_context(self) -> None:
+        if self._ctx is not None:
+            return
+
+        params = llama_cpp.llama_context_params.from_buffer_copy(self.llm.context_params)
+        params.n_seq_max = self.n_seq_max
+        if hasattr(params, "kv_unified"):
+            # Let the sequences share the whole context window instead of splitting it evenly.
+            params.kv_unified = True
+
+        self._ctx = internals.LlamaContext(model=self.llm._model, params=params, verbose=self.llm.verbose)
+        self._batch = internals.LlamaBatch(
+            n_tokens=params.n_batch, embd=0, n_seq_max=self.n_seq_max, verbose=self.llm.verbose
+        )
+
+    def tokenize(self, system_template: str, prompt: str) -> list[int]:
+        """
+        Formats the system template and the prompt with the chat template of the model and tokenizes them.
+        """
+        result = self.chat_formatter(
+            messages=[
+                {"role": "system", "content": system_template},
+                {"role": "user", "content": prompt},
+            ]
+        )
+        return self.llm.tokenize(result.prompt.encode("utf-8"), add_bos=not result.added_special, special=True)
+
+    def generate(
+        self,
+        prompts: list[str],
+        system_template: str,
+        max_new_tokens: int = 512,
+        temperature: float = 0.2,
+        top_p: float = 0.95,
+        top_k: int = 40,
+        min_p: float = 0.05,
+        stop: list[str] | None = None,
+    ) -> list[str]:
+        """
+        Generates an answer for each prompt.
+
+        The sampling defaults match the ones of `Llama.create_chat_completion`.
+
+        Args:
+            prompts (list[str]): The input prompts.
+            system_template (str): The system message sent before each prompt.
+            max_new_tokens (int): The maximum number of new tokens to generate for each prompt (default is 512).
+            temperature (float): The sampling temperature; 0 selects the most likely token.
+            top_p (float): The nucleus sampling probability.
+            top_k (int): The number of most likely tokens to sample from.
+            min_p (float): The minimum probability of a token, relative to the most likely one.
+            stop (list[str] | None): Strings that stop the generation of an answer when generated.
+
+        Returns:
+            list[str]: The generated answers, in the same order as the prompts.
+        """
+        if not self.is_supported:
+            raise RuntimeError("Batched generation requires the chat template stored in the GGUF metadata")
+
+        prompt_tokens = [self.tokenize(system_template, prompt) for prompt in prompts]
+        n_ctx = self.llm.n_ctx()
+        answers = [""] * len(prompts)
+
+        with self._lock:
+            self._init_context()
+            for group in group_sequences([len(t) for t in prompt_tokens], max_new_tokens, n_ctx, self.n_seq_max):
+                logger.info(f"--- Decoding {len(group)} prompts in a single batch ... ---")
+                group_tokens = [prompt_tokens[idx] for idx in group]
+                budgets = [min(max_new_tokens, n_ctx - len(tokens)) for tokens in group_tokens]
+                samplers = [self._create_sampler(temperature, top_p, top_k, min_p) for _ in group]
+                completions = self._decode_group(group_tokens, budgets, samplers, stop or [])
+                for idx, completion in zip(group, completions):
+                    answers[idx] = self._detokenize(completion, stop or [])
+
+        return answers
+
+    @staticmethod
+    def _create_sampler(temperature: float, top_p: float, top_k: int, min_p: float) -> internals.LlamaSampler:
+        sampler = internals.LlamaSampler()
+        if temperature <= 0:
+            sampler.add_greedy()
+            return sampler
+        sampler.add_top_k(top_k)
+        sampler.add_top_p(top_p, 1)
+        sampler.add_min_p(min_p, 1)
+        sampler.add_temp(temperature)
+        sampler.add_dist(random.randint(0, 2**31 - 1))
+        return sampler
+
+    def _decode_group(
+        self,
+        prompts_tokens: list[list[int]],
+        budgets: list[int],
+        samplers: list[internals.LlamaSampler],
+        stop: list[str],
+    ) -> list[list[int]]:
+        """
+        Decodes the prompts as the sequences 0..n-1 of the context and returns their completion tokens.
+        """
+        self._ctx.kv_cache_clear()
+        completions: list[list[int]] = [[] for _ in prompts_tokens]
+        active: set[int] = set()
+
+        def on_token(seq_id: int, token: int) -> None:
+            if llama_cpp.llama_vocab_is_eog(self.llm._model.vocab, token):
+                return
+            completions[seq_id].append(token)
+            if len(completions[seq_id]) >= budgets[seq_id]:
+                return
+            if stop and any(s in self._detokenize(completions[seq_id], []) for s in stop):
+                return
+            active.add(seq_id)
+
+        # Prefill: pack the prompts in as few batches as possible and sample the first token of each sequence right
+        # after the batch holding its last prompt token has been decoded.
+        items = [
+            (seq_id, pos, token, pos == len(tokens) - 1)
+            for seq_id, tokens in enumerate(prompts_tokens)
+            for pos, token in enumerate(tokens)
+        ]
+        n_batch = self.llm.n_batch
+        for start in range(0, len(items), n_batch):
+            chunk = items[start : start + n_batch]
+            self._decode(chunk)
+            for idx, (seq_id, _, _, is_last) in enumerate(chunk):
+                if is_last:
+                    on_token(seq_id, samplers[seq_id].sample(self._ctx, idx))
+
+        # Decode: one token for every unfinished sequence at each step.
+        while active:
+            chunk = [
+                (seq_id, len(prompts_tokens[seq_id]) + len(completions[seq_id]) - 1, completions[seq_id][-1], True)
+                for seq_id in sorted(active)
+            ]
+            active.clear()
+            self._decode(chunk)
+            for idx, (seq_id, _, _, _) in enumerate(chunk):
+                on_token(seq_id, samplers[seq_id].sample(self._ctx, idx))
+
+        return completions
+
+    def _decode(self, items: list[tuple[int, int, int, bool]]) -> None:
+        """
+        Decodes a batch of (sequence id, position, token, compute logits) items.
+        """
+        batch = self._batch.batch
+        batch.n_tokens = len(items)
+        for idx, (seq_id, pos, token, logits) in enumerate(items):
+            batch.token[idx] = token
+            batch.pos[idx] = pos
+            batch.seq_id[idx][0] = seq_id
+            batch.n_seq_id[idx] = 1
+            batch.logits[idx] = logits
+        self._ctx.decode(self._batch)
+
+    def _detokenize(self, tokens: list[int], stop: list[str]) -> str:
+        text = self.llm.detokenize(tokens).decode("utf-8", errors="ignore")
+        for s in stop:
+            if s in text:
+                text = text[: text.index(s)]
+        return text
@@ -0,0 +1,100 @@
+from typing import Any
+
+import llama_cpp
+import numpy as np
+import numpy.typing as npt
+from helpers.log import get_logger
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+logger = get_logger(__name__)
+
+# Default number of tokens proposed by the draft model at each step.
+DEFAULT_NUM_DRAFT_TOKENS = 4
+
+
+class SpeculativeDraftModel(LlamaDraftModel):
+    """
+    Draft model for speculative decoding, backed by a small model sharing the vocabulary of the main one
+    (e.g. Llama 3.2 1B for Llama 3.1 8B).
+
+    At each step the small model greedily proposes `num_draft_tokens` tokens; llama-cpp evaluates them with the main
+    model in a single forward pass and keeps the longest prefix matching what the main model samples, plus the token
+    it samples after it. Every accepted token saves a decoding step of the main model, which is what bounds the
+    throughput of CPU-only deployments.
+
+    The acceptance of a draft is only known when the next draft is requested: the tokens accepted are the ones found
+    again at the start of the new input, after the prefix the draft was proposed for. The last draft of each
+    completion is therefore left out of the statistics.
+    """
+
+    def __init__(self, llm: Llama, num_draft_tokens: int = DEFAULT_NUM_DRAFT_TOKENS):
+        if num_draft_tokens < 1:
+            raise ValueError(f"num_draft_tokens must be a positive integer, got {num_draft_tokens}")
+
+        self.llm = llm
+        self.num_draft_tokens = num_draft_tokens
+        self.drafted = 0
+        self.accepted = 0
+        self._last_input_ids: npt.NDArray[np.intc] | None = None
+        self._last_draft: npt.NDArray[np.intc] | None = None
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        self._update_acceptance(input_ids)
+
+        draft = []
+        # `generate` reuses the KV cache of the longest prefix shared with the previous input, so only the tokens
+        # accepted since the last draft are evaluated again.
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0):
+            if llama_cpp.llama_vocab_is_eog(self.llm._model.vocab, token):
+                break
+            draft.append(token)
+            if len(draft) == self.num_draft_tokens:
+                break
+
+        self._last_input_ids = input_ids.copy()
+        self._last_draft = np.array(draft, dtype=np.intc)
+        return self._last_draft
+
+    def _update_acceptance(self, input_ids: npt.NDArray[np.intc]) -> None:
+        if self._last_draft is None or len(self._last_draft) == 0:
+            return
+
+        prefix_len = len(self._last_input_ids)
+        if len(input_ids) <= prefix_len or not np.array_equal(input_ids[:prefix_len], self._last_input_ids):
+            # A new completion started: the outcome of the last draft is unknown, so it isn't counted.
+            return
+
+        self.drafted += len(self._last_draft)
+        continuation = input_ids[prefix_len : prefix_len + len(self._last_draft)]
+        mismatches = np.nonzero(continuation != self._last_draft[: len(continuation)])[0]
+        self.accepted += int(mismatches[0]) if len(mismatches) else len(continuation)
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the speculative decoding statistics.
+
+        Returns:
+            dict[str, int | float]: The number of drafted and accepted tokens and the acceptance rate.
+        """
+        return merge_stats([self])
+
+
+def merge_stats(draft_models: list[SpeculativeDraftModel]) -> dict[str, int | float]:
+    """
+    Returns the speculative decoding statistics of several draft models, e.g. the ones of the pooled instances of a
+    client.
+
+    Args:
+        draft_models (list[SpeculativeDraftModel]): The draft models.
+
+    Returns:
+        dict[str, int | float]: The total number of drafted and accepted tokens and the overall acceptance rate.
+    """
+    drafted = sum(draft_model.drafted for draft_model in draft_models)
+    accepted = sum(draft_model.accepted for draft_model in draft_models)
+    return {
+        "drafted": drafted,
+        "accepted": accepted,
+        "acceptance_rate": accepted / drafted if drafted else 0.0,
+    }
@@ -1,25 +1,32 @@
+import asyncio
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Iterator
 
-import requests
 from helpers.log import experimental
 from llama_cpp import CreateCompletionResponse, CreateCompletionStreamResponse, Llama
-from tqdm import tqdm
 
+from bot.client.batch_generator import BatchGenerator
+from bot.client.draft_model import DEFAULT_NUM_DRAFT_TOKENS, SpeculativeDraftModel, merge_stats
 from bot.client.prompt import (
     CTX_PROMPT_TEMPLATE,
     QA_PROMPT_TEMPLATE,
     REFINED_ANSWER_CONVERSATION_AWARENESS_PROMPT_TEMPLATE,
     REFINED_CTX_PROMPT_TEMPLATE,
     REFINED_QUESTION_CONVERSATION_AWARENESS_PROMPT_TEMPLATE,
+    SUMMARIZE_CHAT_HISTORY_PROMPT_TEMPLATE,
     TOOL_SYSTEM_TEMPLATE,
     generate_conversation_awareness_prompt,
     generate_ctx_prompt,
     generate_qa_prompt,
     generate_refined_ctx_prompt,
+    generate_summary_prompt,
 )
+from bot.client.prompt_cache import DEFAULT_PROMPT_CACHE_CAPACITY_BYTES, PromptCache
 from bot.model.base_model import ModelSettings
+from bot.model.downloader import ModelDownloader
 
 
 class LamaCppClient:
@@ -27,23 +34,109 @@ class LamaCppClient:
     Class for implementing language model client.
     """
 
-    def __init__(self, model_folder: Path, model_settings: ModelSettings):
+    def __init__(
+        self,
+        model_folder: Path,
+        model_settings: ModelSettings,
+        prompt_cache_capacity_bytes: int | None = DEFAULT_PROMPT_CACHE_CAPACITY_BYTES,
+        parallelism: int = 1,
+        max_batch_size: int = 4,
+        draft_model_settings: ModelSettings | None = None,
+        num_draft_tokens: int = DEFAULT_NUM_DRAFT_TOKENS,
+    ):
+        """
+        Initialize the client and load the model, downloading it if needed.
+
+        Args:
+            model_folder (Path): The folder where the model files are stored.
+            model_settings (ModelSettings): The settings of the model to load.
+            prompt_cache_capacity_bytes (int | None): The memory budget of the prompt cache used to reuse the KV cache
+                of shared prompt prefixes (system template and prompt template scaffold) across calls.
+                None or 0 disables the cache. Defaults to 1 GiB.
+            parallelism (int): The number of model instances used to serve the asynchronous methods concurrently.
+                The instances memory-map the same weights, so each one only adds its own KV cache, and the CPU threads
+                of `model_settings.config` are split among them. The prompt cache budget is split among them too.
+                Defaults to 1.
+            max_batch_size (int): The maximum number of prompts decoded together by `generate_answers_batch`.
+                Defaults to 4.
+            draft_model_settings (ModelSettings | None): The settings of a small model sharing the vocabulary of the
+                main one (e.g. `Llama32OneSettings` for `Llama31Settings`), used to generate with speculative decoding.
+                llama-cpp then keeps the logits of every evaluated position, which grows the memory used by the model
+                and by the prompt cache states. None disables speculative decoding. Defaults to None.
+            num_draft_tokens (int): The number of tokens proposed by the draft model at each step. Defaults to 4.
+        """
+        if parallelism < 1:
+            raise ValueError(f"parallelism must be a positive integer, got {parallelism}")
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be a positive integer, got {max_batch_size}")
+
         self.model_settings = model_settings
         self.model_folder = model_folder
         self.model_path = self.model_folder / self.model_settings.file_name
+        self.parallelism = parallelism
+        self.max_batch_size = max_batch_size
+        self.draft_model_settings = draft_model_settings
+        self.num_draft_tokens = num_draft_tokens
 
         self._auto_download()
 
         self.llm = self._load_llm()
         # self.tokenizer = self._load_tokenizer()
 
+        # The first instance serves the synchronous methods; all of them serve the asynchronous ones.
+        self._llm_pool: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="llm")
+        self.llm_instances = [self.llm] + [self._load_llm() for _ in range(parallelism - 1)]
+        prompt_caches = []
+        for llm in self.llm_instances:
+            prompt_cache = (
+                PromptCache(prompt_cache_capacity_bytes // parallelism) if prompt_cache_capacity_bytes else None
+            )
+            llm.set_cache(prompt_cache)
+            prompt_caches.append(prompt_cache)
+            self._llm_pool.put(llm)
+        self.prompt_cache = prompt_caches[0]
+        # Every instance has its own draft model.
+        self.draft_models: list[SpeculativeDraftModel] = (
+            [llm.draft_model for llm in self.llm_instances] if draft_model_settings else []
+        )
+        # Created on first use, since it allocates its own KV cache.
+        self._batch_generator: BatchGenerator | None = None
+
     def _load_llm(self) -> Any:
         """
         Method to load the language model.
         """
-        llm = Llama(model_path=str(self.model_path), **self.model_settings.config)
+        config = self._get_config(self.model_settings)
+        if self.draft_model_settings is not None:
+            config["draft_model"] = self._load_draft_model(n_ctx=config.get("n_ctx"))
+        llm = Llama(model_path=str(self.model_path), **config)
+
+        if self.draft_model_settings is not None and config["draft_model"].llm.n_vocab() != llm.n_vocab():
+            raise ValueError(
+                f"The draft model {self.draft_model_settings.file_name} doesn't share the vocabulary of "
+                f"{self.model_settings.file_name}"
+            )
         return llm
 
+    def _load_draft_model(self, n_ctx: int | None) -> SpeculativeDraftModel:
+        """
+        Method to load the draft model used for speculative decoding.
+        """
+        config = self._get_config(self.draft_model_settings)
+        if n_ctx is not None:
+            # The draft model sees the same prompts as the main one.
+            config["n_ctx"] = n_ctx
+        draft_llm = Llama(model_path=str(self.model_folder / self.draft_model_settings.file_name), **config)
+        return SpeculativeDraftModel(draft_llm, num_draft_tokens=self.num_draft_tokens)
+
+    def _get_config(self, model_settings: ModelSettings) -> dict[str, Any]:
+        config = dict(model_settings.config)
+        if self.parallelism > 1 and "n_threads" in config:
+            # Split the CPU threads among the instances, so concurrent generations don't oversubscribe the cores.
+            config["n_threads"] = max(1, config["n_threads"] // self.parallelism)
+        return config
+
     def _load_tokenizer(self) -> Any:
         """
         Method to load the tokenizer.
@@ -52,7 +145,7 @@ class LamaCppClient:
 
     def _auto_download(self) -> None:
         """
-        Downloads a model file based on the provided name and saves it to the specified path.
+        Downloads the model file, and the draft model file if any, and saves them to the model folder.
 
         Returns:
             None
@@ -60,32 +153,51 @@ class LamaCppClient:
         Raises:
             Any exceptions raised during the download process will be caught and printed, but not re-raised.
 
-        This function fetches model settings using the provided name, including the model's URL, and then downloads
-        the model file from the URL. The download is done in chunks, and a progress bar is displayed to visualize
-        the download process.
-
+        The files are fetched with parallel range requests, an interrupted download resumes from its `.part` file on
+        the next start, and each file is verified against the SHA-256 digest of its settings before being renamed
+        into the model folder, so a truncated file is never loaded.
         """
-        file_name = self.model_settings.file_name
-        url = self.model_settings.url
+        models = [self.model_settings]
+        if self.draft_model_settings is not None:
+            models.append(self.draft_model_settings)
+
+        downloader = ModelDownloader()
+        for model_settings in models:
+            file_name = model_settings.file_name
+            model_path = self.model_folder / file_name
 
-        if not os.path.exists(self.model_path):
-            # send a GET request to the URL to download the file.
-            # Stream it while downloading, since the file is large
+            if not os.path.exists(model_path):
+                try:
+                    downloader.download(model_settings.url, model_path, sha256=model_settings.sha256)
 
-            try:
-                response = requests.get(url, stream=True)
-                # open the file in binary mode and write the contents of the response
-                # in chunks.
-                with open(self.model_path, "wb") as f:
-                    for chunk in tqdm(response.iter_content(chunk_size=8912)):
-                        if chunk:
-                            f.write(chunk)
+                except Exception as e:
+                    print(f"=> Download Failed. Error: {e}")
+                    return
 
-            except Exception as e:
-                print(f"=> Download Failed. Error: {e}")
-                return
+                print(f"=> Model: {file_name} downloaded successfully 🥳")
 
-            print(f"=> Model: {file_name} downloaded successfully 🥳")
+    def draft_stats(self) -> dict[str, int | float] | None:
+        """
+        Returns the speculative decoding statistics of the draft models of all the instances.
+
+        Returns:
+            dict[str, int | float] | None: The number of drafted and accepted tokens and the acceptance rate, or None
+                without a draft model.
+        """
+        return merge_stats(self.draft_models) if self.draft_models else None
+
+    @property
+    def n_ctx(self) -> int:
+        """
+        The size of the context window of the model, in tokens.
+        """
+        return self.llm.n_ctx()
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Counts the tokens of a text with the tokenizer of the model.
+        """
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=False))
 
     def generate_answer(self, prompt: str, max_new_tokens: int = 512) -> str:
         """
@@ -98,8 +210,10 @@ class LamaCppClient:
         Returns:
             str: The generated answer.
         """
+        return self._generate_answer(self.llm, prompt, max_new_tokens)
 
-        output = self.llm.create_chat_completion(
+    def _generate_answer(self, llm: Llama, prompt: str, max_new_tokens: int) -> str:
+        output = llm.create_chat_completion(
             messages=[
                 {"role": "system", "content": self.model_settings.system_template},
                 {"role": "user", "content": f"{prompt}"},
@@ -112,10 +226,54 @@ class LamaCppClient:
 
         return answer
 
+    def _generate_answer_with_pool(self, prompt: str, max_new_tokens: int) -> str:
+        llm = self._llm_pool.get()
+        try:
+            return self._generate_answer(llm, prompt, max_new_tokens)
+        finally:
+            self._llm_pool.put(llm)
+
+    def generate_answers_batch(self, prompts: list[str], max_new_tokens: int = 512) -> list[str]:
+        """
+        Generates an answer for each of several independent prompts.
+
+        The prompts are decoded together as parallel sequences of the same llama.cpp batches, up to `max_batch_size`
+        at a time, so each decoding step reads the weights once for all of them. Models whose chat format can't be
+        rendered from the GGUF chat template (e.g. a custom `chat_format`) fall back to one `generate_answer` call per
+        prompt.
+
+        Args:
+            prompts (list[str]): The input prompts for generating the answers.
+            max_new_tokens (int): The maximum number of new tokens to generate for each prompt (default is 512).
+
+        Returns:
+            list[str]: The generated answers, in the same order as the prompts.
+        """
+        if len(prompts) > 1 and self._batch_generator is None:
+            self._batch_generator = BatchGenerator(self.llm, n_seq_max=self.max_batch_size)
+
+        if len(prompts) <= 1 or not self._batch_generator.is_supported:
+            return [self.generate_answer(prompt, max_new_tokens=max_new_tokens) for prompt in prompts]
+
+        sampling_params = {
+            key: value
+            for key, value in (self.model_settings.config_answer or {}).items()
+            if key in BatchGenerator.SAMPLING_PARAMS
+        }
+        return self._batch_generator.generate(
+            prompts,
+            system_template=self.model_settings.system_template,
+            max_new_tokens=max_new_tokens,
+            **sampling_params,
+        )
+
     async def async_generate_answer(self, prompt: str, max_new_tokens: int = 512) -> str:
         """
         Generates an answer based on the given prompt using the language model asynchronously.
 
+        The generation runs in a worker thread on one of the `parallelism` model instances, so it doesn't block the
+        event loop and up to `parallelism` answers are generated at the same time.
+
         Args:
             prompt (str): The input prompt for generating the answer.
             max_new_tokens (int): The maximum number of new tokens to generate (default is 512).
@@ -123,7 +281,8 @@ class LamaCppClient:
         Returns:
             str: The generated answer.
         """
-        return self.generate_answer(prompt, max_new_tokens)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._generate_answer_with_pool, prompt, max_new_tokens)
 
     def stream_answer(self, prompt: str, max_new_tokens: int = 512) -> str:
         """
@@ -293,3 +452,11 @@ class LamaCppClient:
             question=question,
             chat_history=chat_history,
         )
+
+    @staticmethod
+    def generate_chat_history_summary_prompt(summary: str, message: str) -> str:
+        return generate_summary_prompt(
+            template=SUMMARIZE_CHAT_HISTORY_PROMPT_TEMPLATE,
+            summary=summary,
+            message=message,
+        )
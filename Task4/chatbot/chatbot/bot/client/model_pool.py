@@ -0,0 +1,239 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from helpers.log import get_logger
+from llama_cpp import Llama
+
+from bot.client.lama_cpp_client import LamaCppClient
+from bot.model.model_registry import Model, get_model_settings
+
+logger = get_logger(__name__)
+
+# Default memory budget of the models kept loaded by the pool (16 GiB).
+DEFAULT_MODEL_POOL_CAPACITY_BYTES = 16 << 30
+
+
+def estimate_context_bytes(llm: Llama) -> int:
+    """
+    Estimates the memory allocated by a model instance besides its weights: the KV cache (f16 keys and values for
+    every layer and position of the context window) and the logits buffer.
+
+    Args:
+        llm (Llama): The loaded model.
+
+    Returns:
+        int: The estimated number of bytes.
+    """
+    metadata = llm.metadata
+    arch = metadata.get("general.architecture", "llama")
+    n_layer = int(metadata.get(f"{arch}.block_count", 0))
+    n_embd = int(metadata.get(f"{arch}.embedding_length", 0))
+    n_head = int(metadata.get(f"{arch}.attention.head_count", 1))
+    n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+    head_dim_k = int(metadata.get(f"{arch}.attention.key_length", n_embd // n_head))
+    head_dim_v = int(metadata.get(f"{arch}.attention.value_length", n_embd // n_head))
+
+    kv_cache_bytes = n_layer * llm.n_ctx() * n_head_kv * (head_dim_k + head_dim_v) * 2
+    return kv_cache_bytes + llm.scores.nbytes
+
+
+@dataclass
+class PooledModel:
+    client: LamaCppClient
+    load_time: float
+    weights_bytes: int
+    context_bytes: int
+    # The keyword arguments the client was loaded with, on top of the ones of the pool.
+    client_kwargs: dict[str, Any] = field(default_factory=dict)
+    hits: int = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        return self.weights_bytes + self.context_bytes
+
+
+class ModelPool:
+    """
+    Pool of `LamaCppClient` instances keyed by `Model`, shared across conversations.
+
+    Models are loaded on first request; llama.cpp memory-maps the GGUF weights, so pages are only read from disk when
+    touched. When loading a model would exceed the memory budget, the least recently used models are evicted first.
+    A model larger than the whole budget is still loaded, alone. Models are loaded without holding the pool lock, so
+    the sessions using other models aren't blocked, and the sessions asking for a model being loaded wait for it.
+
+    An evicted client is freed once the last conversation using it releases it, so callers should get the client
+    from the pool on each request instead of keeping it.
+
+    The resident size of a model is its weights (the GGUF files) plus the KV caches and logits buffers of its
+    instances; the prompt caches are bounded by their own capacity and not accounted for.
+    """
+
+    def __init__(
+        self,
+        model_folder: Path,
+        capacity_bytes: int = DEFAULT_MODEL_POOL_CAPACITY_BYTES,
+        **client_kwargs: Any,
+    ):
+        """
+        Initialize the pool.
+
+        Args:
+            model_folder (Path): The folder where the model files are stored.
+            capacity_bytes (int): The memory budget of the loaded models. Defaults to 16 GiB.
+            **client_kwargs: Keyword arguments passed to every `LamaCppClient` (e.g. `parallelism`).
+        """
+        if capacity_bytes < 1:
+            raise ValueError(f"capacity_bytes must be a positive integer, got {capacity_bytes}")
+
+        self.model_folder = model_folder
+        self.capacity_bytes = capacity_bytes
+        self.client_kwargs = client_kwargs
+        self.models: OrderedDict[Model, PooledModel] = OrderedDict()
+        # Futures of the models being loaded.
+        self._loading: dict[Model, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(pooled_model.resident_bytes for pooled_model in self.models.values())
+
+    def get(self, model: Model | str, **client_kwargs: Any) -> LamaCppClient:
+        """
+        Returns the client of a model, loading it if needed.
+
+        Args:
+            model (Model | str): The model, or its name in the model registry.
+            **client_kwargs: Keyword arguments passed to `LamaCppClient` if the model has to be loaded, on top of the
+                ones of the pool (e.g. a draft model sharing the vocabulary of this model).
+
+        Returns:
+            LamaCppClient: The client of the model.
+
+        Raises:
+            ValueError: If the model is already loaded with other keyword arguments.
+        """
+        model = Model(model)
+        with self._lock:
+            pooled_model = self.models.get(model)
+            future = None
+            if pooled_model is None:
+                future = self._loading.get(model)
+                owner = future is None
+                if owner:
+                    future = self._loading[model] = Future()
+
+        if future is not None and not owner:
+            # Another session is loading the model.
+            try:
+                pooled_model = future.result()
+            except CancelledError:
+                # It was interrupted, the model is loaded again.
+                return self.get(model, **client_kwargs)
+        elif future is not None:
+            try:
+                pooled_model = self._load(model, **client_kwargs)
+            except BaseException as e:
+                with self._lock:
+                    del self._loading[model]
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+                raise
+            with self._lock:
+                del self._loading[model]
+            future.set_result(pooled_model)
+
+        if client_kwargs != pooled_model.client_kwargs:
+            raise ValueError(
+                f"{model.value} is already loaded with {pooled_model.client_kwargs}, not with {client_kwargs}. "
+                "Evict it first to load it with other settings."
+            )
+
+        with self._lock:
+            # The model may have been evicted meanwhile, its client can still be used.
+            if model in self.models:
+                self.models.move_to_end(model)
+            pooled_model.hits += 1
+        return pooled_model.client
+
+    def _load(self, model: Model, **client_kwargs: Any) -> PooledModel:
+        model_settings = get_model_settings(model.value)
+        kwargs = {**self.client_kwargs, **client_kwargs}
+
+        # Make room for the weights before loading them, then for the context buffers once they are known.
+        weights_path = self.model_folder / model_settings.file_name
+        with self._lock:
+            self._evict_to_fit(os.path.getsize(weights_path) if weights_path.exists() else 0)
+
+        start_time = time.perf_counter()
+        client = LamaCppClient(model_folder=self.model_folder, model_settings=model_settings, **kwargs)
+        load_time = time.perf_counter() - start_time
+
+        weights_paths = [client.model_path]
+        context_bytes = sum(estimate_context_bytes(llm) for llm in client.llm_instances)
+        if client.draft_model_settings is not None:
+            weights_paths.append(self.model_folder / client.draft_model_settings.file_name)
+            context_bytes += sum(estimate_context_bytes(llm.draft_model.llm) for llm in client.llm_instances)
+        pooled_model = PooledModel(
+            client=client,
+            load_time=load_time,
+            weights_bytes=sum(os.path.getsize(path) for path in weights_paths),
+            context_bytes=context_bytes,
+            client_kwargs=client_kwargs,
+        )
+
+        with self._lock:
+            self._evict_to_fit(pooled_model.resident_bytes)
+            self.models[model] = pooled_model
+        logger.info(
+            f"--- Loaded {model.value} in {load_time:.2f} seconds, "
+            f"resident size {pooled_model.resident_bytes / (1 << 20):.0f} MiB ---"
+        )
+        return pooled_model
+
+    def _evict_to_fit(self, needed_bytes: int) -> None:
+        evicted = False
+        while self.models and self.resident_bytes + needed_bytes > self.capacity_bytes:
+            model, _ = self.models.popitem(last=False)
+            logger.info(f"--- Evicted {model.value} from the model pool ---")
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def evict(self, model: Model | str) -> None:
+        """
+        Removes a model from the pool.
+        """
+        with self._lock:
+            self.models.pop(Model(model), None)
+            gc.collect()
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """
+        Returns the statistics of the loaded models, from the least to the most recently used.
+
+        Returns:
+            dict[str, dict[str, int | float]]: For each model name, its load time in seconds, its resident size in
+                bytes (weights and context buffers) and the number of requests it served. Models with a draft model
+                also have the drafted and accepted tokens and the acceptance rate of all their instances.
+        """
+        with self._lock:
+            stats = {}
+            for model, pooled_model in self.models.items():
+                stats[model.value] = {
+                    "load_time": pooled_model.load_time,
+                    "resident_bytes": pooled_model.resident_bytes,
+                    "weights_bytes": pooled_model.weights_bytes,
+                    "context_bytes": pooled_model.context_bytes,
+                    "hits": pooled_model.hits,
+                    **(pooled_model.client.draft_stats() or {}),
+                }
+            return stats
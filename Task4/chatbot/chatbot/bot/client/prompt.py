@@ -64,6 +64,19 @@ question, ignoring the context provided in the Chat History.
 Please also don't reformulate the follow up question, and write just a concise answer.
 """
 
+# A string template with placeholders for summary, and message to fold an evicted message into the history summary.
+SUMMARIZE_CHAT_HISTORY_PROMPT_TEMPLATE = """Summary of the conversation so far:
+---------------------
+{summary}
+---------------------
+New lines of conversation:
+---------------------
+{message}
+---------------------
+Progressively summarize the new lines of conversation, adding onto the previous summary.
+Write just the new concise summary.
+"""
+
 
 def generate_qa_prompt(template: str, question: str) -> str:
     """
@@ -138,3 +151,20 @@ def generate_conversation_awareness_prompt(template: str, question: str, chat_hi
         question=question,
     )
     return prompt
+
+
+def generate_summary_prompt(template: str, summary: str, message: str) -> str:
+    """
+    Generates a prompt for a chat history summarization task.
+
+    Args:
+        template (str): A string template with placeholders for summary, and message.
+        summary (str): The current summary of the conversation.
+        message (str): The message to add to the summary.
+
+    Returns:
+        str: The generated prompt.
+    """
+
+    prompt = template.format(summary=summary, message=message)
+    return prompt
@@ -0,0 +1,80 @@
+from typing import Sequence
+
+from helpers.log import get_logger
+from llama_cpp import LlamaRAMCache, LlamaState
+
+logger = get_logger(__name__)
+
+# Default memory budget of the prompt cache (1 GiB).
+DEFAULT_PROMPT_CACHE_CAPACITY_BYTES = 1 << 30
+
+
+class PromptCache(LlamaRAMCache):
+    """
+    LRU cache of llama.cpp states used to reuse the KV cache of shared prompt prefixes.
+
+    Every prompt sent by `LamaCppClient` starts with the same system template followed by a prompt template scaffold
+    (e.g. "Context information is below."). After each completion llama-cpp saves the model state keyed by its
+    tokens; before the next completion the state with the longest common token prefix is restored, so only the
+    tokens after the shared prefix are evaluated again.
+
+    Unlike `LlamaRAMCache`, the memory budget also accounts for the logits copied into each state, which for models
+    with a large vocabulary can be bigger than the KV cache itself.
+    """
+
+    # NOTE: don't implement `__len__`: llama-cpp checks `if self.cache:` before saving a state, so an empty cache must
+    # still be truthy.
+
+    def __init__(self, capacity_bytes: int = DEFAULT_PROMPT_CACHE_CAPACITY_BYTES):
+        super().__init__(capacity_bytes=capacity_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def state_size(state: LlamaState) -> int:
+        """
+        Returns the number of bytes held by a saved state, including its logits.
+        """
+        return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
+    @property
+    def cache_size(self) -> int:
+        return sum(self.state_size(state) for state in self.cache_state.values())
+
+    def __getitem__(self, key: Sequence[int]) -> LlamaState:
+        try:
+            state = super().__getitem__(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return state
+
+    def __setitem__(self, key: Sequence[int], value: LlamaState) -> None:
+        if self.state_size(value) > self.capacity_bytes:
+            logger.debug(f"--- Skipping a prompt state of {self.state_size(value)} bytes, larger than the cache ---")
+            return
+        super().__setitem__(key, value)
+
+    def clear(self) -> None:
+        """
+        Removes all the saved states.
+        """
+        self.cache_state.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict[str, int | float]: The number of hits and misses, the hit rate, the number of saved states and the
+                memory they use in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "states": len(self.cache_state),
+            "size_bytes": self.cache_size,
+        }
@@ -0,0 +1,177 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+import numpy as np
+from entities.document import Document
+from helpers.log import get_logger
+
+from bot.memory.embedder import Embedder
+
+logger = get_logger(__name__)
+
+
+def chunk_id(document: Document) -> str:
+    """
+    Returns a stable id of a retrieved chunk, derived from its source and content.
+    """
+    source = str(document.metadata.get("source", ""))
+    return hashlib.sha1(f"{source}\n{document.page_content}".encode("utf-8")).hexdigest()
+
+
+def replay_stream(text: str) -> Iterator[dict[str, Any]]:
+    """
+    Replays a text as a stream of chat completion chunks, one word at a time, like `start_answer_iterator_streamer`.
+    """
+    for piece in re.findall(r"\s*\S+|\s+", text):
+        yield {"choices": [{"delta": {"content": piece}}]}
+
+
+@dataclass
+class CachedAnswer:
+    context_key: tuple
+    embedding: np.ndarray
+    answer: str
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Semantic cache of the answers generated from retrieved contents.
+
+    An answer is reused when the same chunks are retrieved, with the same model, strategy and token budget, for a
+    question whose embedding has a cosine similarity of at least `threshold` with the cached question. Entries expire
+    after `ttl` seconds and the least recently used ones are evicted beyond `max_size` entries.
+    """
+
+    def __init__(self, embedding: Embedder, threshold: float = 0.95, ttl: float = 3600.0, max_size: int = 256):
+        """
+        Initialize the cache.
+
+        Args:
+            embedding (Embedder): The embedder of the questions.
+            threshold (float): The minimum cosine similarity between two questions to reuse an answer.
+                Defaults to 0.95.
+            ttl (float): The number of seconds an answer is reused. Defaults to one hour.
+            max_size (int): The maximum number of cached answers. Defaults to 256.
+        """
+        if max_size < 1:
+            raise ValueError(f"max_size must be a positive integer, got {max_size}")
+
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        # A miss is followed by storing the answer to the same question, so its embedding is kept.
+        self._last_embedding: tuple[str, np.ndarray] | None = None
+
+    def _embed(self, question: str) -> np.ndarray:
+        last_embedding = self._last_embedding
+        if last_embedding is not None and last_embedding[0] == question:
+            return last_embedding[1]
+        embedding = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1.0
+        self._last_embedding = (question, embedding)
+        return embedding
+
+    @staticmethod
+    def context_key(retrieved_contents: list[Document], **params: Any) -> tuple:
+        """
+        Returns the key of the context an answer was generated from: the retrieved chunk ids and the generation
+        parameters (e.g. the model and the synthesis strategy).
+        """
+        return tuple(chunk_id(document) for document in retrieved_contents), tuple(sorted(params.items()))
+
+    def lookup(self, question: str, context_key: tuple) -> str | None:
+        """
+        Returns the cached answer of a similar question with the same context, if any.
+
+        Args:
+            question (str): The refined question.
+            context_key (tuple): The key returned by `context_key`.
+
+        Returns:
+            str | None: The cached answer, or None on a miss.
+        """
+        embedding = self._embed(question)
+        with self._lock:
+            self._remove_expired()
+            best_id, best_similarity = None, self.threshold
+            for entry_id, entry in self.entries.items():
+                if entry.context_key != context_key:
+                    continue
+                similarity = float(entry.embedding @ embedding)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(best_id)
+            logger.info(f"--- Answer cache hit with similarity {best_similarity:.3f} ---")
+            return self.entries[best_id].answer
+
+    def store(self, question: str, context_key: tuple, answer: str) -> None:
+        """
+        Caches the answer to a question.
+
+        Args:
+            question (str): The refined question.
+            context_key (tuple): The key returned by `context_key`.
+            answer (str): The final text of the answer.
+        """
+        entry = CachedAnswer(context_key, self._embed(question), answer, time.monotonic())
+        with self._lock:
+            self.entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def record_stream(self, question: str, context_key: tuple, streamer: Iterator[dict[str, Any]]):
+        """
+        Yields the chunks of an answer stream and caches the final text once the stream is exhausted.
+        """
+        answer = ""
+        for token in streamer:
+            answer += token["choices"][0]["delta"].get("content", "")
+            yield token
+        if answer:
+            self.store(question, context_key, answer)
+
+    def _remove_expired(self) -> None:
+        now = time.monotonic()
+        for entry_id in [entry_id for entry_id, entry in self.entries.items() if now - entry.created_at > self.ttl]:
+            del self.entries[entry_id]
+
+    def clear(self) -> None:
+        """
+        Removes all the cached answers.
+        """
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict[str, int | float]: The number of hits and misses, the hit rate and the number of cached answers.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "answers": len(self.entries),
+        }
@@ -1,16 +1,88 @@
-class ChatHistory(list):
-    def __init__(self, messages: list | None = None, total_length: int = -1):
-        """Initialise the queue with a fixed total length.
+from collections import deque
+from typing import Callable, Iterator
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Approximates the number of tokens of a text, assuming about four characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int, token_counter: Callable[[str], int]) -> str:
+    """
+    Returns the longest beginning of a text with at most `max_tokens` tokens, found by bisecting its length.
+    """
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+class ChatHistory:
+    def __init__(
+        self,
+        messages: list | None = None,
+        total_length: int = -1,
+        max_tokens: int | None = None,
+        token_counter: Callable[[str], int] = approximate_token_count,
+        summarizer: Callable[[str, str], str] | None = None,
+    ):
+        """Initialise the queue with a fixed total length and an optional token budget.
+
+        The oldest messages are evicted in O(1) when a new message exceeds the total length or the token budget.
+        The token count of each message is computed once, on append, and the rendered history is kept up to date
+        incrementally, so building a prompt doesn't join the whole history again. The last message is always kept,
+        truncated if it exceeds the token budget alone, and the summary is truncated to the tokens left.
 
         Args:
             messages (list | None): A list of initial messages
             total_length (int): The maximum number of messages the chat history can hold.
+            max_tokens (int | None): The maximum number of tokens of the rendered history, e.g. a fraction of the
+                context window of the model (`LamaCppClient.n_ctx`). None disables the budget.
+            token_counter (Callable[[str], int]): Counts the tokens of a text, e.g. `LamaCppClient.count_tokens`.
+                Defaults to an approximation of four characters per token.
+            summarizer (Callable[[str, str], str] | None): Folds an evicted message into the running summary of the
+                older turns, which is rendered before the messages; e.g. `summarize_chat_history` bound to a client.
+                None drops the evicted messages.
         """
-        if messages is None:
-            messages = []
-
-        super().__init__(messages)
         self.total_length = total_length
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+        self.summarizer = summarizer
+
+        self._messages: deque[str] = deque()
+        self._token_counts: deque[int] = deque()
+        self._messages_tokens = 0
+        self._messages_text = ""
+        self._summary = ""
+        self._summary_tokens = 0
+
+        for msg in messages or []:
+            self.append(msg)
+
+    @property
+    def summary(self) -> str:
+        """
+        The summary of the evicted messages, empty if they were dropped.
+        """
+        return self._summary
+
+    @summary.setter
+    def summary(self, summary: str) -> None:
+        self._summary = summary
+        self._summary_tokens = self.token_counter(summary) if summary else 0
+
+    @property
+    def num_tokens(self) -> int:
+        """
+        The number of tokens of the rendered history.
+        """
+        return self._summary_tokens + self._messages_tokens
 
     def append(self, msg: str):
         """
@@ -19,16 +91,78 @@ class ChatHistory(list):
         Args:
             msg (str): The message to be added to the chat history.
         """
-        if len(self) == self.total_length:
-            self.pop(0)
-        super().append(msg)
+        num_tokens = self.token_counter(msg)
+        self._messages.append(msg)
+        self._token_counts.append(num_tokens)
+        self._messages_tokens += num_tokens
+        self._messages_text = f"{self._messages_text}\n{msg}" if len(self._messages) > 1 else msg
+
+        while len(self._messages) > 1 and (
+            len(self._messages) > self.total_length >= 0
+            or (self.max_tokens is not None and self.num_tokens > self.max_tokens)
+        ):
+            self._evict()
+
+        if self.max_tokens is not None and self.num_tokens > self.max_tokens:
+            self._truncate()
+
+    def _evict(self) -> None:
+        msg = self._messages.popleft()
+        self._messages_tokens -= self._token_counts.popleft()
+        self._messages_text = self._messages_text[len(msg) + 1 :]
+
+        if self.summarizer is not None:
+            self.summary = self.summarizer(self.summary, msg)
+
+    def _truncate(self) -> None:
+        msg = self._messages[-1]
+        if self._token_counts[-1] > self.max_tokens:
+            truncated_msg = truncate_to_tokens(msg, self.max_tokens, self.token_counter)
+            num_tokens = self.token_counter(truncated_msg) if truncated_msg else 0
+            self._messages[-1] = truncated_msg
+            self._messages_tokens += num_tokens - self._token_counts[-1]
+            self._token_counts[-1] = num_tokens
+            self._messages_text = self._messages_text[: len(self._messages_text) - len(msg)] + truncated_msg
+
+        summary_budget = self.max_tokens - self._messages_tokens
+        if self._summary_tokens > summary_budget:
+            self.summary = truncate_to_tokens(self.summary, summary_budget, self.token_counter)
+
+    def clear(self) -> None:
+        """
+        Remove all the messages and the summary.
+        """
+        self._messages.clear()
+        self._token_counts.clear()
+        self._messages_tokens = 0
+        self._messages_text = ""
+        self.summary = ""
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: int) -> str:
+        return self._messages[index]
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (ChatHistory, list)):
+            return NotImplemented
+        return list(self._messages) == list(other)
+
+    def __repr__(self) -> str:
+        return f"ChatHistory({list(self._messages)!r})"
 
     def __str__(self):
         """
         Get the chat history as a single string.
 
         Returns:
-            str: The chat history concatenated into a single string, with each message separated by a newline.
+            str: The summary of the evicted messages, if any, followed by the chat history, with each message
+                separated by a newline.
         """
-        chat_history = "\n".join([msg for msg in self])
-        return chat_history
+        if self.summary:
+            return f"summary: {self.summary}\n{self._messages_text}"
+        return self._messages_text
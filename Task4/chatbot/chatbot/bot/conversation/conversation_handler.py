@@ -1,4 +1,5 @@
 import re
+import time
 from asyncio import get_event_loop
 from typing import Any
 
@@ -7,13 +8,21 @@ from entities.document import Document
 from helpers.log import get_logger
 
 from bot.client.lama_cpp_client import LamaCppClient
+from bot.conversation.answer_cache import AnswerCache, replay_stream
 from bot.conversation.chat_history import ChatHistory
 from bot.conversation.ctx_strategy import AsyncTreeSummarizationStrategy, BaseSynthesisStrategy
+from bot.conversation.question_rewriter import QuestionRewriter, RewriteMode
 
 logger = get_logger(__name__)
 
 
-def refine_question(llm: LamaCppClient, question: str, chat_history: ChatHistory, max_new_tokens: int = 128) -> str:
+def refine_question(
+    llm: LamaCppClient,
+    question: str,
+    chat_history: ChatHistory,
+    max_new_tokens: int = 128,
+    question_rewriter: QuestionRewriter | None = None,
+) -> tuple[str, RewriteMode | None]:
     """
     Refines the given question based on the chat history.
 
@@ -24,10 +33,21 @@ def refine_question(llm: LamaCppClient, question: str, chat_history: ChatHistory
         history as tuples of questions and answers.
         max_new_tokens (int, optional): The maximum number of tokens to generate in the answer.
             Defaults to 128.
+        question_rewriter (QuestionRewriter | None, optional): The rewriter used to skip the LLM call when the
+            question is clearly standalone or clearly a follow-up. Defaults to None.
 
     Returns:
-        str: The refined question.
+        tuple[str, RewriteMode | None]: The refined question and the mode it was rewritten in, to be passed to
+            `QuestionRewriter.record_retrieval`; the mode is None without a rewriter.
     """
+    start_time = time.perf_counter()
+
+    if question_rewriter is not None:
+        mode, refined_question = question_rewriter.rewrite(question, chat_history)
+        if mode is not RewriteMode.LLM:
+            question_rewriter.record_latency(mode, time.perf_counter() - start_time)
+            logger.info(f"--- Refined Question: {refined_question} ---")
+            return refined_question, mode
 
     if chat_history:
         logger.info("--- Refining the question based on the chat history... ---")
@@ -47,9 +67,13 @@ def refine_question(llm: LamaCppClient, question: str, chat_history: ChatHistory
 
         logger.info(f"--- Refined Question: {refined_question} ---")
 
-        return refined_question
+        if question_rewriter is not None:
+            question_rewriter.record_latency(RewriteMode.LLM, time.perf_counter() - start_time)
+            return refined_question, RewriteMode.LLM
+
+        return refined_question, None
     else:
-        return question
+        return question, None
 
 
 def answer(llm: LamaCppClient, question: str, chat_history: ChatHistory, max_new_tokens: int = 512) -> Any:
@@ -101,6 +125,7 @@ def answer_with_context(
     chat_history: ChatHistory,
     retrieved_contents: list[Document],
     max_new_tokens: int = 512,
+    answer_cache: AnswerCache | None = None,
 ):
     """
     Generates an answer to the given question using a context synthesis strategy and retrieved contents.
@@ -114,6 +139,8 @@ def answer_with_context(
         history as tuples of questions and answers.
         retrieved_contents (list[Document]): A list of documents retrieved for context.
         max_new_tokens (int, optional): The maximum number of tokens to generate in the answer. Defaults to 512.
+        answer_cache (AnswerCache | None, optional): The cache of the answers generated from retrieved contents.
+            On a hit the cached answer is replayed as a stream and no prompt is generated. Defaults to None.
 
     Returns:
         tuple: A tuple containing the answer streamer and formatted prompts.
@@ -121,6 +148,22 @@ def answer_with_context(
     if not retrieved_contents:
         return answer(llm, question, chat_history, max_new_tokens=max_new_tokens), []
 
+    if answer_cache is not None:
+        context_key = answer_cache.context_key(
+            retrieved_contents,
+            model=llm.model_settings.file_name,
+            strategy=type(ctx_synthesis_strategy).__name__,
+            max_new_tokens=max_new_tokens,
+        )
+        cached_answer = answer_cache.lookup(question, context_key)
+        if cached_answer is not None:
+            return replay_stream(cached_answer), []
+
+        streamer, fmt_prompts = answer_with_context(
+            llm, ctx_synthesis_strategy, question, chat_history, retrieved_contents, max_new_tokens
+        )
+        return answer_cache.record_stream(question, context_key, streamer), fmt_prompts
+
     if isinstance(ctx_synthesis_strategy, AsyncTreeSummarizationStrategy):
         loop = get_event_loop()
         streamer, fmt_prompts = loop.run_until_complete(
@@ -133,6 +176,29 @@ def answer_with_context(
     return streamer, fmt_prompts
 
 
+def summarize_chat_history(llm: LamaCppClient, summary: str, message: str, max_new_tokens: int = 128) -> str:
+    """
+    Folds a message evicted from the chat history into the running summary of the older turns.
+
+    Args:
+        llm (LlmClient): The language model client for conversation-related tasks.
+        summary (str): The current summary, empty if no message was evicted before.
+        message (str): The evicted message, containing a question and an answer.
+        max_new_tokens (int, optional): The maximum number of tokens of the new summary. Defaults to 128.
+
+    Returns:
+        str: The new summary.
+    """
+    prompt = llm.generate_chat_history_summary_prompt(summary=summary, message=message)
+    new_summary = llm.generate_answer(prompt, max_new_tokens=max_new_tokens)
+
+    if llm.model_settings.reasoning:
+        new_summary = extract_content_after_reasoning(new_summary, llm.model_settings.reasoning_stop_tag)
+
+    logger.info(f"--- Chat history summary: {new_summary} ---")
+    return new_summary.strip() or summary
+
+
 def extract_content_after_reasoning(text: str, reasoning_stop_tag: str) -> str:
     """
     Extracts and strips the text that follows the `reasoning_stop_tag` tag.
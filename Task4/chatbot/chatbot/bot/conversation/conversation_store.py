@@ -0,0 +1,235 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from helpers.log import get_logger
+
+from bot.conversation.chat_history import ChatHistory
+from bot.memory.embedder import Embedder
+
+logger = get_logger(__name__)
+
+# Turns are saved as "question: <question>, answer: <answer>".
+TURN = re.compile(r"question: (.*?), answer: (.*)", flags=re.DOTALL)
+
+
+class ConversationStore:
+    """
+    Persistent store of the conversations, one per session.
+
+    Every turn of a session is saved in a SQLite database, so conversations survive restarts and aren't shared
+    between the users of the same process. The chat histories of the most recently used sessions are kept in memory,
+    each bounded like a `ChatHistory`; the least recently used ones are dropped from memory beyond `max_sessions` and
+    reloaded from the database on their next turn.
+
+    When an embedder is given, each turn is also embedded (episodic memory), so the older turns related to a question
+    can be recalled by similarity and added to the prompt instead of resending the whole conversation.
+    """
+
+    def __init__(
+        self,
+        db_path: Path | str,
+        max_sessions: int = 64,
+        embedding: Embedder | None = None,
+        **chat_history_kwargs: Any,
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            db_path (Path | str): The path of the SQLite database, created if needed; ":memory:" keeps it in memory.
+            max_sessions (int): The maximum number of chat histories kept in memory. Defaults to 64.
+            embedding (Embedder | None): The embedder of the turns, used to recall the older ones. None disables the
+                episodic memory.
+            **chat_history_kwargs: Keyword arguments passed to every `ChatHistory` (e.g. `total_length`, `max_tokens`).
+        """
+        if max_sessions < 1:
+            raise ValueError(f"max_sessions must be a positive integer, got {max_sessions}")
+
+        self.max_sessions = max_sessions
+        self.embedding = embedding
+        self.chat_history_kwargs = chat_history_kwargs
+        self.sessions: OrderedDict[str, ChatHistory] = OrderedDict()
+        self._lock = threading.RLock()
+
+        if str(db_path) != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # Streamlit runs each session in its own thread, the connection is shared behind the lock.
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT NOT NULL, turn INTEGER NOT NULL, message TEXT NOT NULL, embedding BLOB, "
+                "created_at REAL NOT NULL, PRIMARY KEY (session_id, turn))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS summaries (session_id TEXT PRIMARY KEY, summary TEXT NOT NULL)"
+            )
+
+    def get(self, session_id: str) -> ChatHistory:
+        """
+        Returns the chat history of a session, loading its last turns from the database if needed.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            ChatHistory: The chat history of the session.
+        """
+        with self._lock:
+            chat_history = self.sessions.get(session_id)
+            if chat_history is None:
+                chat_history = self._load(session_id)
+                self.sessions[session_id] = chat_history
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            return chat_history
+
+    def _load(self, session_id: str) -> ChatHistory:
+        chat_history = ChatHistory(**self.chat_history_kwargs)
+        row = self._connection.execute("SELECT summary FROM summaries WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None:
+            chat_history.summary = row[0]
+
+        # The summarizer only applies to the turns evicted from now on, the loaded summary covers the older ones.
+        summarizer, chat_history.summarizer = chat_history.summarizer, None
+        limit = chat_history.total_length if chat_history.total_length >= 0 else -1
+        rows = self._connection.execute(
+            "SELECT message FROM turns WHERE session_id = ? ORDER BY turn DESC LIMIT ?", (session_id, limit)
+        ).fetchall()
+        for (message,) in reversed(rows):
+            chat_history.append(message)
+        chat_history.summarizer = summarizer
+        return chat_history
+
+    def append(self, session_id: str, message: str) -> None:
+        """
+        Appends a message that contains a question and an answer to the conversation of a session.
+
+        Args:
+            session_id (str): The id of the session.
+            message (str): The message to be added to the conversation.
+        """
+        embedding = self._embed(message) if self.embedding is not None else None
+        with self._lock:
+            chat_history = self.get(session_id)
+            summary = chat_history.summary
+            chat_history.append(message)
+            with self._connection:
+                self._connection.execute(
+                    "INSERT INTO turns (session_id, turn, message, embedding, created_at) "
+                    "VALUES (?, (SELECT COALESCE(MAX(turn) + 1, 0) FROM turns WHERE session_id = ?), ?, ?, ?)",
+                    (session_id, session_id, message, embedding, time.time()),
+                )
+                if chat_history.summary != summary:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO summaries (session_id, summary) VALUES (?, ?)",
+                        (session_id, chat_history.summary),
+                    )
+
+    def turns(self, session_id: str) -> list[tuple[str, str]]:
+        """
+        Returns all the turns of the conversation of a session, e.g. to display it again when the page is reloaded.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            list[tuple[str, str]]: The question and the answer of every turn, in chronological order.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT message FROM turns WHERE session_id = ? ORDER BY turn", (session_id,)
+            ).fetchall()
+        turns = []
+        for (message,) in rows:
+            match = TURN.fullmatch(message)
+            turns.append((match.group(1), match.group(2)) if match else ("", message))
+        return turns
+
+    def _embed(self, text: str) -> bytes:
+        embedding = np.asarray(self.embedding.embed_query(text), dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1.0
+        return embedding.tobytes()
+
+    def recall(self, session_id: str, query: str, k: int = 2, threshold: float = 0.3) -> list[str]:
+        """
+        Recalls the older turns of a session most related to a query, leaving out the ones in the chat history.
+
+        Args:
+            session_id (str): The id of the session.
+            query (str): The query, usually the question of the user.
+            k (int): The maximum number of turns to recall. Defaults to 2.
+            threshold (float): The minimum cosine similarity between a turn and the query. Defaults to 0.3.
+
+        Returns:
+            list[str]: The recalled turns, in chronological order.
+        """
+        if self.embedding is None or k < 1:
+            return []
+
+        with self._lock:
+            num_recent = len(self.get(session_id))
+            rows = self._connection.execute(
+                "SELECT turn, message, embedding FROM turns WHERE session_id = ? AND embedding IS NOT NULL "
+                "ORDER BY turn DESC LIMIT -1 OFFSET ?",
+                (session_id, num_recent),
+            ).fetchall()
+        if not rows:
+            return []
+
+        query_embedding = np.frombuffer(self._embed(query), dtype=np.float32)
+        embeddings = np.stack([np.frombuffer(embedding, dtype=np.float32) for _, _, embedding in rows])
+        similarities = embeddings @ query_embedding
+        best = [i for i in np.argsort(-similarities)[:k] if similarities[i] >= threshold]
+        logger.info(f"--- Recalled {len(best)} turns out of {len(rows)} older turns ---")
+        return [message for _, message in sorted((rows[i][0], rows[i][1]) for i in best)]
+
+    def prompt_history(self, session_id: str, question: str, k: int = 2) -> ChatHistory:
+        """
+        Returns the history to put in the prompt of a question: the older turns related to the question followed by
+        the chat history of the session, within the same bounds.
+
+        Args:
+            session_id (str): The id of the session.
+            question (str): The question of the user.
+            k (int): The maximum number of older turns to recall. Defaults to 2.
+
+        Returns:
+            ChatHistory: The chat history of the session itself if no turn is recalled, a copy otherwise.
+        """
+        chat_history = self.get(session_id)
+        recalled = self.recall(session_id, question, k=k)
+        if not recalled:
+            return chat_history
+
+        # The recalled turns come first, so they are the first ones evicted when the token budget is exceeded.
+        prompt_history = ChatHistory(max_tokens=chat_history.max_tokens, token_counter=chat_history.token_counter)
+        prompt_history.summary = chat_history.summary
+        for message in [*recalled, *chat_history]:
+            prompt_history.append(message)
+        return prompt_history
+
+    def clear(self, session_id: str) -> None:
+        """
+        Removes the conversation of a session, from memory and from the database.
+        """
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            with self._connection:
+                self._connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._connection.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+    def close(self) -> None:
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._connection.close()
@@ -135,16 +135,14 @@ class TreeSummarizationStrategy(BaseSynthesisStrategy):
         Returns:
             Any: A response generator.
         """
-        fmt_prompts = []
-        node_responses = []
+        fmt_prompts = [
+            self.llm.generate_ctx_prompt(question=question, context=content.page_content)
+            for content in retrieved_contents
+        ]
 
-        for idx, content in enumerate(retrieved_contents, start=1):
-            context = content.page_content
-            logger.info(f"--- Generating a response for the chunk {idx} ... ---")
-            fmt_qa_prompt = self.llm.generate_ctx_prompt(question=question, context=context)
-            node_response = self.llm.generate_answer(fmt_qa_prompt, max_new_tokens=max_new_tokens)
-            node_responses.append(node_response)
-            fmt_prompts.append(fmt_qa_prompt)
+        # The chunk answers are independent of each other, so they are decoded together.
+        logger.info(f"--- Generating a response for {len(fmt_prompts)} chunks ... ---")
+        node_responses = self.llm.generate_answers_batch(fmt_prompts, max_new_tokens=max_new_tokens)
 
         response = self.combine_results(
             [str(r) for r in node_responses],
@@ -178,7 +176,6 @@ class TreeSummarizationStrategy(BaseSynthesisStrategy):
             Any: A response generator.
         """
         fmt_prompts = []
-        new_texts = []
         for idx in range(0, len(texts), num_children):
             text_batch = texts[idx : idx + num_children]
             context = "\n\n".join([t for t in text_batch])
@@ -193,10 +190,9 @@ class TreeSummarizationStrategy(BaseSynthesisStrategy):
             return combined_response_stream
         else:
             logger.info(f"--- Combining {len(fmt_prompts)} responses ... ---")
-            for fmt_qa_prompt in fmt_prompts:
-                combined_response = self.llm.generate_answer(fmt_qa_prompt, max_new_tokens=max_new_tokens)
-                new_texts.append(str(combined_response))
-                cur_prompt_list.append(fmt_qa_prompt)
+            combined_responses = self.llm.generate_answers_batch(fmt_prompts, max_new_tokens=max_new_tokens)
+            new_texts = [str(r) for r in combined_responses]
+            cur_prompt_list.extend(fmt_prompts)
             return self.combine_results(
                 new_texts,
                 question,
@@ -208,6 +204,10 @@ class TreeSummarizationStrategy(BaseSynthesisStrategy):
 class AsyncTreeSummarizationStrategy(BaseSynthesisStrategy):
     """
     Asynchronous version of TreeSummarizationStrategy.
+
+    The responses of each level of the tree are generated concurrently on the model instances of the client (see
+    `LamaCppClient.parallelism`), so with enough instances summarizing k chunks takes about ceil(log k) + 1 LLM
+    latencies instead of k.
     """
 
     def __init__(self, llm: LamaCppClient):
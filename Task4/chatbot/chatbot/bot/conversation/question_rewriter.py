@@ -0,0 +1,155 @@
+import re
+import threading
+from enum import Enum
+
+import numpy as np
+from helpers.log import get_logger
+
+from bot.conversation.chat_history import ChatHistory
+from bot.memory.embedder import Embedder
+
+logger = get_logger(__name__)
+
+# Words referring to something said before, e.g. "Who wrote it?".
+FOLLOW_UP_MARKERS = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|his|one|ones|more|else|also|too|same|"
+    r"above|previous|former|latter)\b",
+    flags=re.IGNORECASE,
+)
+# Openers continuing the previous turn, e.g. "And the second one?".
+FOLLOW_UP_OPENERS = re.compile(
+    r"^\s*(and|but|so|then|ok|okay|what about|how about|why not|why)\b",
+    flags=re.IGNORECASE,
+)
+HISTORY_QUESTION = re.compile(r"question: (.*?), answer:", flags=re.DOTALL)
+
+
+class RewriteMode(Enum):
+    STANDALONE = "standalone"
+    FUSION = "fusion"
+    LLM = "llm"
+
+
+def follow_up_score(question: str) -> float:
+    """
+    Scores how likely a question is a follow-up that can't be understood without the chat history.
+
+    Args:
+        question (str): The question.
+
+    Returns:
+        float: A score between 0 (standalone) and 1 (follow-up).
+    """
+    words = re.findall(r"\w+", question)
+    score = 0.0
+    if FOLLOW_UP_MARKERS.search(question):
+        score += 0.5
+    if FOLLOW_UP_OPENERS.search(question):
+        score += 0.3
+    if len(words) <= 4:
+        score += 0.3
+    elif len(words) >= 10:
+        score -= 0.2
+    return min(max(score, 0.0), 1.0)
+
+
+class QuestionRewriter:
+    """
+    Rewrites follow-up questions for retrieval without generating any token when the intent is clear.
+
+    A heuristic scores how likely the question depends on the chat history:
+    - below `standalone_below` the question is used as is;
+    - from `follow_up_above` it is fused with the past question most related to it (by embedding similarity,
+      ties going to the most recent turn), e.g. "Who wrote it?" becomes "What is the Social Code? Who wrote it?";
+    - in between the heuristic is uncertain and the slow LLM rewrite of `refine_question` is used.
+
+    The latency of each mode and how often its questions retrieve some content are logged. The rewriter is shared by
+    the sessions of the app, so the mode of a question is returned to the caller instead of being kept here, and the
+    metrics are updated under a lock.
+    """
+
+    def __init__(self, embedding: Embedder, standalone_below: float = 0.25, follow_up_above: float = 0.5):
+        """
+        Initialize the rewriter.
+
+        Args:
+            embedding (Embedder): The embedder used to relate the question to the past questions.
+            standalone_below (float): The follow-up score under which a question is standalone. Defaults to 0.25.
+            follow_up_above (float): The follow-up score from which a question is fused with the history.
+                Defaults to 0.5.
+        """
+        self.embedding = embedding
+        self.standalone_below = standalone_below
+        self.follow_up_above = follow_up_above
+        self.metrics = {mode: {"count": 0, "latency": 0.0, "retrieval_hits": 0} for mode in RewriteMode}
+        self._lock = threading.Lock()
+
+    def rewrite(self, question: str, chat_history: ChatHistory) -> tuple[RewriteMode, str | None]:
+        """
+        Rewrites a question without the LLM, if possible.
+
+        Args:
+            question (str): The question.
+            chat_history (ChatHistory): The chat history.
+
+        Returns:
+            tuple[RewriteMode, str | None]: The rewrite mode and the rewritten question, which is None when the mode
+                is `RewriteMode.LLM`.
+        """
+        score = follow_up_score(question)
+        past_questions = [self._extract_question(msg) for msg in chat_history]
+
+        if score < self.standalone_below or not past_questions:
+            return RewriteMode.STANDALONE, question
+        if score < self.follow_up_above:
+            return RewriteMode.LLM, None
+        return RewriteMode.FUSION, f"{self._most_related(question, past_questions)} {question}"
+
+    @staticmethod
+    def _extract_question(msg: str) -> str:
+        match = HISTORY_QUESTION.search(msg)
+        return match.group(1).strip() if match else msg[:256]
+
+    def _most_related(self, question: str, past_questions: list[str]) -> str:
+        if len(past_questions) == 1:
+            return past_questions[0]
+        embeddings = np.asarray(self.embedding.embed_documents([question, *past_questions]), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        similarities = embeddings[1:] @ embeddings[0]
+        # `argmax` returns the first maximum, so search from the most recent turn.
+        return past_questions[len(past_questions) - 1 - int(np.argmax(similarities[::-1]))]
+
+    def record_latency(self, mode: RewriteMode, latency: float) -> None:
+        """
+        Records the time taken to rewrite a question.
+        """
+        with self._lock:
+            self.metrics[mode]["count"] += 1
+            self.metrics[mode]["latency"] += latency
+        logger.info(f"--- Question rewritten in {mode.value} mode in {latency * 1000:.1f} ms ---")
+
+    def record_retrieval(self, mode: RewriteMode, hit: bool) -> None:
+        """
+        Records whether a question rewritten in the given mode retrieved some content.
+        """
+        with self._lock:
+            self.metrics[mode]["retrieval_hits"] += int(hit)
+        logger.info(f"--- Question rewriting metrics: {self.stats()} ---")
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """
+        Returns the statistics of each rewrite mode.
+
+        Returns:
+            dict[str, dict[str, int | float]]: For each mode, the number of rewritten questions, their mean latency
+                in seconds and the fraction of them that retrieved some content.
+        """
+        with self._lock:
+            return {
+                mode.value: {
+                    "count": metrics["count"],
+                    "mean_latency": metrics["latency"] / metrics["count"] if metrics["count"] else 0.0,
+                    "retrieval_hit_rate": metrics["retrieval_hits"] / metrics["count"] if metrics["count"] else 0.0,
+                }
+                for mode, metrics in self.metrics.items()
+            }
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from entities.document import Document
+
+from bot.conversation.chat_history import approximate_token_count
+
+
+@dataclass
+class RetrievalReport:
+    """
+    How many chunks a query fetched from the index and how many ended up in the context.
+    """
+
+    fetched: int = 0
+    above_threshold: int = 0
+    within_gap: int = 0
+    merged: int = 0
+    used: int = 0
+    context_tokens: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.fetched} chunks fetched, {self.above_threshold} above the threshold, {self.within_gap} within the "
+            f"score gap, {self.merged} after merging, {self.used} used ({self.context_tokens} tokens)"
+        )
+
+
+def filter_by_score_gap(
+    docs_and_scores: list[tuple[Document, float]], relative_gap: float
+) -> list[tuple[Document, float]]:
+    """
+    Drops the chunks whose relevance score is too far below the best one.
+
+    Args:
+        docs_and_scores (list[tuple[Document, float]]): The chunks and their relevance scores, sorted from the most
+            relevant.
+        relative_gap (float): The maximum drop, relative to the best score, e.g. 0.25 keeps the chunks scoring at
+            least 75% of the best one; 1 keeps all of them.
+
+    Returns:
+        list[tuple[Document, float]]: The chunks close enough to the best one.
+    """
+    if not docs_and_scores:
+        return []
+    min_score = docs_and_scores[0][1] * (1 - relative_gap)
+    return [(doc, score) for doc, score in docs_and_scores if score >= min_score]
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    # Consecutive chunks of the splitter share up to `chunk_overlap` characters.
+    for size in range(min(len(first), len(second)) // 2, 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def merge_adjacent_chunks(docs_and_scores: list[tuple[Document, float]]) -> list[tuple[Document, float]]:
+    """
+    Merges the chunks of the same source that follow each other in the source into a single chunk, so a
+    synthesis strategy reads them in one prompt.
+
+    Chunks are adjacent when one starts before the other ends, according to the `start_index` metadata added by the
+    splitter; chunks without it are kept as they are. A merged chunk takes the best score of its parts and the
+    metadata of its first part.
+
+    Args:
+        docs_and_scores (list[tuple[Document, float]]): The chunks and their relevance scores, sorted from the most
+            relevant.
+
+    Returns:
+        list[tuple[Document, float]]: The merged chunks, sorted from the most relevant.
+    """
+    by_position = sorted(
+        (item for item in docs_and_scores if "start_index" in item[0].metadata),
+        key=lambda item: (str(item[0].metadata.get("source", "")), item[0].metadata["start_index"]),
+    )
+    merged: list[tuple[Document, float]] = [item for item in docs_and_scores if "start_index" not in item[0].metadata]
+
+    for doc, score in by_position:
+        if merged and "start_index" in merged[-1][0].metadata:
+            last_doc, last_score = merged[-1]
+            last_end = last_doc.metadata["start_index"] + len(last_doc.page_content)
+            if (
+                last_doc.metadata.get("source") == doc.metadata.get("source")
+                and doc.metadata["start_index"] <= last_end
+            ):
+                merged_doc = Document(
+                    page_content=_join_overlapping(last_doc.page_content, doc.page_content),
+                    metadata=last_doc.metadata,
+                )
+                merged[-1] = (merged_doc, max(last_score, score))
+                continue
+        merged.append((doc, score))
+
+    return sorted(merged, key=lambda item: item[1], reverse=True)
+
+
+def cap_context_tokens(
+    docs_and_scores: list[tuple[Document, float]],
+    max_tokens: int,
+    token_counter: Callable[[str], int] = approximate_token_count,
+) -> tuple[list[tuple[Document, float]], int]:
+    """
+    Keeps the most relevant chunks within a token budget; the most relevant chunk is always kept.
+
+    Args:
+        docs_and_scores (list[tuple[Document, float]]): The chunks and their relevance scores, sorted from the most
+            relevant.
+        max_tokens (int): The maximum number of tokens of the kept chunks.
+        token_counter (Callable[[str], int]): Counts the tokens of a text, e.g. `LamaCppClient.count_tokens`.
+            Defaults to an approximation of four characters per token.
+
+    Returns:
+        tuple[list[tuple[Document, float]], int]: The kept chunks and their number of tokens.
+    """
+    kept, num_tokens = [], 0
+    for doc, score in docs_and_scores:
+        doc_tokens = token_counter(doc.page_content)
+        if kept and num_tokens + doc_tokens > max_tokens:
+            break
+        kept.append((doc, score))
+        num_tokens += doc_tokens
+    return kept, num_tokens
@@ -1,11 +1,18 @@
 import logging
+import shutil
 import uuid
+from itertools import islice
+from pathlib import Path
 from typing import Any, Callable, Iterable
 
 import chromadb
 import chromadb.config
+import numpy as np
+from bot.conversation.chat_history import approximate_token_count
 from bot.memory.embedder import Embedder
+from bot.memory.retrieval import RetrievalReport, cap_context_tokens, filter_by_score_gap, merge_adjacent_chunks
 from bot.memory.vector_database.distance_metric import DistanceMetric, get_relevance_score_fn
+from bot.memory.vector_database.quantized_index import QuantizationType, QuantizedIndex
 from chromadb.utils.batch_utils import create_batches
 from cleantext import clean
 from entities.document import Document
@@ -13,6 +20,36 @@ from entities.document import Document
 logger = logging.getLogger(__name__)
 
 
+def hnsw_collection_metadata(
+    distance_metric: DistanceMetric = DistanceMetric.L2,
+    m: int | None = None,
+    ef_construction: int | None = None,
+    ef_search: int | None = None,
+) -> dict[str, str | int]:
+    """
+    Returns the metadata configuring the HNSW index of a new Chroma collection.
+
+    These settings are fixed when the collection is created; an existing collection keeps its own.
+
+    Args:
+        distance_metric (DistanceMetric): The distance between embeddings. Defaults to L2, the default of Chroma.
+        m (int | None): The number of neighbours of each node of the graph; higher improves the recall at the cost of
+            memory. None keeps the default of Chroma (16).
+        ef_construction (int | None): The size of the candidate list when inserting; higher improves the graph at the
+            cost of indexing time. None keeps the default of Chroma (100).
+        ef_search (int | None): The size of the candidate list when querying; higher improves the recall at the cost
+            of latency. None keeps the default of Chroma (10).
+
+    Returns:
+        dict[str, str | int]: The collection metadata.
+    """
+    metadata: dict[str, str | int] = {"hnsw:space": distance_metric.value}
+    for key, value in (("hnsw:M", m), ("hnsw:construction_ef", ef_construction), ("hnsw:search_ef", ef_search)):
+        if value is not None:
+            metadata[key] = value
+    return metadata
+
+
 class Chroma:
     def __init__(
         self,
@@ -23,6 +60,21 @@ class Chroma:
         collection_metadata: dict | None = None,
         is_persistent: bool = True,
     ) -> None:
+        """
+        Opens a collection, creating it if needed.
+
+        Args:
+            client (chromadb.Client): The Chroma client. Defaults to a client persisting to `persist_directory`.
+            embedding (Embedder | None): The embedder of the texts and queries.
+            persist_directory (str | None): The directory of the database.
+            collection_name (str): The name of the collection. Defaults to "default".
+            collection_metadata (dict | None): The metadata of a new collection, e.g. from `hnsw_collection_metadata`
+                to choose the distance metric and tune the HNSW index.
+            is_persistent (bool): Whether the database is persisted. Defaults to True.
+
+        The quantized index saved with the collection by `build_quantized_index`, if any, is loaded and then used by
+        the searches without filters.
+        """
         client_settings = chromadb.config.Settings(is_persistent=is_persistent)
         client_settings.persist_directory = persist_directory
 
@@ -39,10 +91,84 @@ class Chroma:
             metadata=collection_metadata,
         )
 
+        self.quantized_index_directory = (
+            Path(persist_directory) / f"{collection_name}_quantized" if persist_directory else None
+        )
+        self.quantized_index = None
+        if self.quantized_index_directory is not None and QuantizedIndex.exists(self.quantized_index_directory):
+            self.quantized_index = QuantizedIndex.load(self.quantized_index_directory)
+
     @property
     def embeddings(self) -> Embedder | None:
         return self.embedding
 
+    @property
+    def distance_metric(self) -> DistanceMetric:
+        """
+        The distance between embeddings of the collection, from its `hnsw:space` metadata.
+        """
+        metadata = self.collection.metadata
+        if metadata and "hnsw:space" in metadata:
+            return DistanceMetric(metadata["hnsw:space"])
+        return DistanceMetric.L2
+
+    def build_quantized_index(
+        self,
+        quantization: QuantizationType,
+        num_subvectors: int = 8,
+        rerank_factor: int = 4,
+        batch_size: int = 10000,
+    ) -> QuantizedIndex:
+        """
+        Compresses the embeddings of the collection into a quantized index, saved next to the collection.
+
+        The searches without filters then score the compressed vectors and re-rank the best candidates with the full
+        vectors memory-mapped from disk, instead of querying the HNSW index. The embeddings are compressed batch by
+        batch while paging through the collection. Texts added afterwards are only found once the index is built
+        again.
+
+        Args:
+            quantization (QuantizationType): The compression of the vectors.
+            num_subvectors (int): The number of sub-vectors of product quantization; it must divide the dimension.
+                Defaults to 8.
+            rerank_factor (int): The number of candidates re-ranked per result. Defaults to 4.
+            batch_size (int): The number of embeddings read from the collection at once. Defaults to 10000.
+
+        Returns:
+            QuantizedIndex: The quantized index.
+        """
+        num_vectors = self.collection.count()
+        if not num_vectors:
+            raise ValueError("The collection is empty, there is nothing to quantize")
+
+        def batches() -> Iterable[tuple[list[str], np.ndarray]]:
+            # The collection is paged through, so only one batch of its embeddings is in memory at once.
+            for offset in range(0, num_vectors, batch_size):
+                batch = self.collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+                yield batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32)
+
+        quantized_index = QuantizedIndex(
+            quantization, self.distance_metric, num_subvectors=num_subvectors, rerank_factor=rerank_factor
+        )
+        if self.quantized_index_directory is not None:
+            self.remove_quantized_index()
+            self.quantized_index_directory.mkdir(parents=True)
+            quantized_index.build_from_batches(num_vectors, batches(), self.quantized_index_directory / "vectors.npy")
+            quantized_index.save(self.quantized_index_directory)
+        else:
+            quantized_index.build_from_batches(num_vectors, batches())
+
+        self.quantized_index = quantized_index
+        return quantized_index
+
+    def remove_quantized_index(self) -> None:
+        """
+        Removes the quantized index, so the searches query the HNSW index of the collection again.
+        """
+        self.quantized_index = None
+        if self.quantized_index_directory is not None and self.quantized_index_directory.exists():
+            shutil.rmtree(self.quantized_index_directory)
+
     def __query_collection(
         self,
         query_texts: list[str] | None = None,
@@ -186,19 +312,35 @@ class Chroma:
                 ids=batch[0],
             )
 
-    def from_chunks(self, chunks: list) -> None:
+    def from_chunks(self, chunks: Iterable[Document], batch_size: int = 256) -> int:
         """
-        Adds a batch of documents to the Chroma collection.
+        Adds documents to the Chroma collection in fixed-size batches.
+
+        The chunks are consumed lazily, so when a generator is passed only `batch_size` documents (and their
+        embeddings) are held in memory at any time.
 
         Args:
-            chunks (list): List of Document objects to add to the collection.
+            chunks (Iterable[Document]): Document objects to add to the collection.
+            batch_size (int, optional): The number of documents to clean, embed and store at once. Defaults to 256.
+
+        Returns:
+            int: The number of documents added to the collection.
         """
-        texts = [clean(doc.page_content, no_emoji=True) for doc in chunks]
-        metadatas = [doc.metadata for doc in chunks]
-        self.from_texts(
-            texts=texts,
-            metadatas=metadatas,
-        )
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be a positive integer, got {batch_size}")
+
+        num_of_chunks = 0
+        chunks = iter(chunks)
+        while batch := list(islice(chunks, batch_size)):
+            texts = [clean(doc.page_content, no_emoji=True) for doc in batch]
+            metadatas = [doc.metadata for doc in batch]
+            self.from_texts(
+                texts=texts,
+                metadatas=metadatas,
+            )
+            num_of_chunks += len(batch)
+            logger.debug(f"Added {num_of_chunks} chunks to the collection so far")
+        return num_of_chunks
 
     def similarity_search_with_threshold(
         self,
@@ -237,6 +379,12 @@ class Chroma:
 
             docs_and_scores = sorted(docs_and_scores, key=lambda x: x[1], reverse=True)
 
+        return self.__to_contents_and_sources(docs_and_scores)
+
+    @staticmethod
+    def __to_contents_and_sources(
+        docs_and_scores: list[tuple[Document, float]],
+    ) -> tuple[list[Document], list[dict[str, Any]]]:
         retrieved_contents = [doc[0] for doc in docs_and_scores]
         sources = []
         for doc, score in docs_and_scores:
@@ -250,6 +398,63 @@ class Chroma:
 
         return retrieved_contents, sources
 
+    def adaptive_similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        threshold: float = 0.2,
+        relative_gap: float = 0.25,
+        max_context_tokens: int | None = None,
+        token_counter: Callable[[str], int] = approximate_token_count,
+    ) -> tuple[list[Document], list[dict[str, Any]], RetrievalReport]:
+        """
+        Performs similarity search on the given query, keeping only the chunks worth a call to the LLM.
+
+        Up to `k` chunks are fetched; the ones below the relevance `threshold` or too far below the best score are
+        dropped, the chunks that follow each other in the same source are merged into one, and the most relevant
+        chunks are kept within `max_context_tokens`. The synthesis strategies make one LLM call per chunk, so fewer,
+        larger chunks mean fewer calls.
+
+        Args:
+            query (str): The query string.
+            k (int): The maximum number of chunks to fetch. Defaults to 4.
+            threshold (float): The minimum relevance score of a chunk. Defaults to 0.2.
+            relative_gap (float): The maximum drop of the relevance score relative to the best chunk, e.g. 0.25 keeps
+                the chunks scoring at least 75% of the best one; 1 disables it. Defaults to 0.25.
+            max_context_tokens (int | None): The maximum number of tokens of the kept chunks. None disables it.
+            token_counter (Callable[[str], int]): Counts the tokens of a chunk, e.g. `LamaCppClient.count_tokens`.
+                Defaults to an approximation of four characters per token.
+
+        Returns:
+            tuple[list[Document], list[dict[str, Any]], RetrievalReport]: The matched documents, their sources and
+                the number of chunks fetched and used.
+        """
+        docs_and_scores = self.similarity_search_with_relevance_scores(query, k)
+        report = RetrievalReport(fetched=len(docs_and_scores))
+
+        docs_and_scores = sorted(
+            [doc for doc in docs_and_scores if doc[1] > threshold], key=lambda x: x[1], reverse=True
+        )
+        report.above_threshold = len(docs_and_scores)
+        docs_and_scores = filter_by_score_gap(docs_and_scores, relative_gap)
+        report.within_gap = len(docs_and_scores)
+        docs_and_scores = merge_adjacent_chunks(docs_and_scores)
+        report.merged = len(docs_and_scores)
+        if max_context_tokens is not None:
+            docs_and_scores, report.context_tokens = cap_context_tokens(
+                docs_and_scores, max_context_tokens, token_counter
+            )
+        else:
+            report.context_tokens = sum(token_counter(doc.page_content) for doc, _ in docs_and_scores)
+        report.used = len(docs_and_scores)
+
+        if not docs_and_scores:
+            logger.warning(f"No relevant docs were retrieved using the relevance score threshold {threshold}")
+        logger.info(f"--- Retrieval: {report} ---")
+
+        retrieved_contents, sources = self.__to_contents_and_sources(docs_and_scores)
+        return retrieved_contents, sources, report
+
     def similarity_search(self, query: str, k: int = 4, filter: dict[str, str] | None = None) -> list[Document]:
         """
         Run similarity search with Chroma.
@@ -287,6 +492,9 @@ class Chroma:
             the query text and cosine distance in float for each.
             Lower score represents more similarity.
         """
+        if self.quantized_index is not None and self.embedding is not None and not filter and not where_document:
+            return self.__quantized_search(self.embedding.embed_query(query), k)
+
         if self.embedding is None:
             results = self.__query_collection(
                 query_texts=[query],
@@ -311,18 +519,24 @@ class Chroma:
             )
         ]
 
+    def __quantized_search(self, query_embedding: list[float], k: int) -> list[tuple[Document, float]]:
+        ids_and_distances = self.quantized_index.search(query_embedding, k)
+        if not ids_and_distances:
+            return []
+
+        records = self.collection.get(ids=[id for id, _ in ids_and_distances], include=["documents", "metadatas"])
+        documents = {
+            id: Document(page_content=text, metadata=metadata or {})
+            for id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"])
+        }
+        # The texts deleted from the collection since the index was built are skipped.
+        return [(documents[id], distance) for id, distance in ids_and_distances if id in documents]
+
     def __select_relevance_score_fn(self) -> Callable[[float], float]:
         """
         The 'correct' relevance function may differ depending on the distance/similarity metric used by the VectorStore.
         """
-
-        distance = DistanceMetric.L2
-        distance_key = "hnsw:space"
-        metadata = self.collection.metadata
-
-        if metadata and distance_key in metadata:
-            distance = metadata[distance_key]
-        return get_relevance_score_fn(distance)
+        return get_relevance_score_fn(self.distance_metric)
 
     def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
         """
@@ -0,0 +1,347 @@
+import json
+from enum import Enum
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from bot.memory.vector_database.distance_metric import DistanceMetric
+
+
+class QuantizationType(Enum):
+    INT8 = "int8"
+    PQ = "pq"
+
+
+def kmeans(vectors: np.ndarray, num_centroids: int, num_iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Clusters vectors with Lloyd's algorithm.
+
+    Args:
+        vectors (np.ndarray): The vectors, of shape (n, d).
+        num_centroids (int): The number of clusters, at most n.
+        num_iterations (int): The number of iterations. Defaults to 20.
+        seed (int): The seed of the initial centroids. Defaults to 0.
+
+    Returns:
+        np.ndarray: The centroids, of shape (num_centroids, d).
+    """
+    vectors = np.ascontiguousarray(vectors)
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=num_centroids, replace=False)].copy()
+    for _ in range(num_iterations):
+        # The squared norms of the vectors don't change the nearest centroid.
+        distances = (centroids**2).sum(axis=1) - 2 * vectors @ centroids.T
+        assignments = distances.argmin(axis=1)
+        counts = np.bincount(assignments, minlength=num_centroids)
+        sums = np.stack(
+            [np.bincount(assignments, weights=vectors[:, j], minlength=num_centroids) for j in range(vectors.shape[1])],
+            axis=1,
+        )
+        # An empty cluster keeps its centroid.
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+
+class QuantizedIndex:
+    """
+    Vector index keeping compressed vectors in memory and the full float32 vectors on disk.
+
+    The vectors are compressed either with int8 scalar quantization (one byte per dimension, 4x smaller) or with
+    product quantization (one byte per sub-vector, e.g. 48x smaller for 384 dimensions and 8 sub-vectors). A query is
+    scored against every compressed vector, then the `rerank_factor * k` best candidates are re-ranked with their exact
+    vectors, read from a memory-mapped file, so only the pages of the candidates are loaded.
+
+    The distances match the ones of Chroma for the same metric: squared L2, 1 - inner product, or cosine distance.
+    """
+
+    BLOCK_SIZE = 65536
+    MAX_TRAINING_VECTORS = 65536
+
+    def __init__(
+        self,
+        quantization: QuantizationType = QuantizationType.INT8,
+        distance_metric: DistanceMetric = DistanceMetric.COSINE,
+        num_subvectors: int = 8,
+        num_centroids: int = 256,
+        rerank_factor: int = 4,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            quantization (QuantizationType): The compression of the vectors. Defaults to int8.
+            distance_metric (DistanceMetric): The distance between vectors. Defaults to cosine.
+            num_subvectors (int): The number of sub-vectors of product quantization; it must divide the dimension.
+                Defaults to 8.
+            num_centroids (int): The number of centroids of each sub-vector, at most 256. Defaults to 256.
+            rerank_factor (int): The number of candidates re-ranked per result. Defaults to 4.
+        """
+        if not 1 <= num_centroids <= 256:
+            raise ValueError(f"num_centroids must be between 1 and 256, got {num_centroids}")
+
+        self.quantization = quantization
+        self.distance_metric = distance_metric
+        self.num_subvectors = num_subvectors
+        self.num_centroids = num_centroids
+        self.rerank_factor = rerank_factor
+
+        self.ids: list[str] = []
+        self.codes: np.ndarray | None = None
+        self.vectors: np.ndarray | None = None
+        # int8: the offset and scale of each dimension; PQ: the centroids of each sub-vector.
+        self.offset: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        self.codebooks: np.ndarray | None = None
+        self.approximate_norms: np.ndarray | None = None
+
+    def build(self, ids: list[str], embeddings: np.ndarray | list[list[float]], vectors_path: Path | None = None):
+        """
+        Trains the quantizer on the embeddings and compresses them.
+
+        Args:
+            ids (list[str]): The ids of the embeddings.
+            embeddings (np.ndarray | list[list[float]]): The embeddings, of shape (n, d).
+            vectors_path (Path | None): The file where the full vectors used for re-ranking are memory-mapped.
+                None keeps them in memory.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.build_from_batches(len(embeddings), [(ids, embeddings)], vectors_path)
+
+    def build_from_batches(
+        self,
+        num_vectors: int,
+        batches: Iterable[tuple[list[str], np.ndarray | list[list[float]]]],
+        vectors_path: Path | None = None,
+    ):
+        """
+        Trains the quantizer and compresses embeddings read batch by batch, e.g. paging through a collection.
+
+        Every batch is written to the full vectors and only the training sample is kept; the vectors are then
+        compressed block by block, so the float vectors are never all in memory when they are memory-mapped.
+
+        Args:
+            num_vectors (int): The total number of embeddings of the batches.
+            batches (Iterable[tuple[list[str], np.ndarray | list[list[float]]]]): The ids and embeddings of every
+                batch.
+            vectors_path (Path | None): The file where the full vectors used for re-ranking are memory-mapped.
+                None keeps them in memory.
+        """
+        # The vectors the PQ codebooks are trained on, chosen before reading them.
+        rng = np.random.default_rng(0)
+        sample_indices = np.sort(rng.choice(num_vectors, min(num_vectors, self.MAX_TRAINING_VECTORS), False))
+
+        self.ids = []
+        self.vectors = None
+        samples, minimum, maximum = [], None, None
+        for ids, embeddings in batches:
+            vectors = self._prepare(np.asarray(embeddings, dtype=np.float32))
+            if len(ids) != len(vectors):
+                raise ValueError(f"Got {len(ids)} ids for {len(vectors)} embeddings")
+            if not len(vectors):
+                continue
+            start, end = len(self.ids), len(self.ids) + len(vectors)
+            if end > num_vectors:
+                raise ValueError(f"Got more than {num_vectors} embeddings")
+
+            if self.vectors is None:
+                dimension = vectors.shape[1]
+                if self.quantization == QuantizationType.PQ and dimension % self.num_subvectors:
+                    raise ValueError(f"num_subvectors ({self.num_subvectors}) must divide the dimension ({dimension})")
+                shape = (num_vectors, dimension)
+                if vectors_path is not None:
+                    self.vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=shape)
+                else:
+                    self.vectors = np.empty(shape, dtype=np.float32)
+            self.vectors[start:end] = vectors
+            self.ids.extend(ids)
+
+            samples.append(vectors[sample_indices[(sample_indices >= start) & (sample_indices < end)] - start])
+            minimum = vectors.min(axis=0) if minimum is None else np.minimum(minimum, vectors.min(axis=0))
+            maximum = vectors.max(axis=0) if maximum is None else np.maximum(maximum, vectors.max(axis=0))
+
+        if len(self.ids) != num_vectors:
+            raise ValueError(f"Got {len(self.ids)} embeddings, expected {num_vectors}")
+        if vectors_path is not None:
+            self.vectors.flush()
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+
+        if self.quantization == QuantizationType.INT8:
+            self.offset = minimum
+            self.scale = np.maximum(maximum - self.offset, 1e-12) / 255
+        else:
+            sample = np.concatenate(samples).reshape(len(sample_indices), self.num_subvectors, -1)
+            num_centroids = min(self.num_centroids, len(sample))
+            self.codebooks = np.stack([kmeans(sample[:, i], num_centroids, seed=i) for i in range(self.num_subvectors)])
+
+        blocks = [
+            (start, min(start + self.BLOCK_SIZE, num_vectors)) for start in range(0, num_vectors, self.BLOCK_SIZE)
+        ]
+        self.codes = np.concatenate([self._encode(np.asarray(self.vectors[start:end])) for start, end in blocks])
+        if self.distance_metric == DistanceMetric.L2:
+            self.approximate_norms = np.concatenate(
+                [(self._decode(np.arange(start, end)) ** 2).sum(axis=1) for start, end in blocks]
+            )
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        if self.distance_metric == DistanceMetric.COSINE:
+            return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True).clip(min=1e-12)
+        return vectors
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.quantization == QuantizationType.INT8:
+            return np.rint((vectors - self.offset) / self.scale).astype(np.uint8)
+        subvectors = vectors.reshape(len(vectors), self.num_subvectors, -1)
+        return np.stack(
+            [self._assign(subvectors[:, i], self.codebooks[i]) for i in range(self.num_subvectors)], axis=1
+        ).astype(np.uint8)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return (-2 * np.ascontiguousarray(vectors) @ centroids.T + (centroids**2).sum(axis=1)).argmin(axis=1)
+
+    def _decode(self, indices: np.ndarray) -> np.ndarray:
+        if self.quantization == QuantizationType.INT8:
+            return self.codes[indices] * self.scale + self.offset
+        return np.concatenate([self.codebooks[i][self.codes[indices, i]] for i in range(self.num_subvectors)], axis=-1)
+
+    def _approximate_inner_products(self, query: np.ndarray) -> np.ndarray:
+        # The codes are scored in blocks, so the float temporaries stay small however many vectors are indexed.
+        blocks = [self.codes[start : start + self.BLOCK_SIZE] for start in range(0, len(self.codes), self.BLOCK_SIZE)]
+        if self.quantization == QuantizationType.INT8:
+            # (code * scale + offset) . q = code . (q * scale) + offset . q, without decoding the vectors.
+            weights = query * self.scale
+            bias = float(self.offset @ query)
+            return np.concatenate([block @ weights + bias for block in blocks])
+        # Asymmetric distance computation: one table of inner products per sub-vector.
+        tables = np.einsum("scd,sd->sc", self.codebooks, query.reshape(self.num_subvectors, -1))
+        subvector_indices = np.arange(self.num_subvectors)
+        return np.concatenate([tables[subvector_indices, block].sum(axis=1) for block in blocks])
+
+    def _distances(self, query: np.ndarray, inner_products: np.ndarray, norms: np.ndarray | None) -> np.ndarray:
+        if self.distance_metric == DistanceMetric.L2:
+            return float(query @ query) - 2 * inner_products + norms
+        return 1.0 - inner_products
+
+    def search(self, query_embedding: list[float] | np.ndarray, k: int = 4, rerank: bool = True):
+        """
+        Finds the nearest neighbours of a query.
+
+        Args:
+            query_embedding (list[float] | np.ndarray): The embedding of the query.
+            k (int): The number of neighbours. Defaults to 4.
+            rerank (bool): Whether to re-rank the candidates with their exact vectors. Defaults to True.
+
+        Returns:
+            list[tuple[str, float]]: The ids of the neighbours and their distances, from the nearest.
+        """
+        if self.codes is None or not self.ids:
+            return []
+
+        query = self._prepare(np.asarray(query_embedding, dtype=np.float32))
+        distances = self._distances(query, self._approximate_inner_products(query), self.approximate_norms)
+
+        num_candidates = min(len(self.ids), k * self.rerank_factor if rerank else k)
+        candidates = np.argpartition(distances, num_candidates - 1)[:num_candidates]
+        if rerank:
+            # Sorted indices read the memory-mapped vectors sequentially.
+            candidates = np.sort(candidates)
+            vectors = np.asarray(self.vectors[candidates])
+            norms = (vectors**2).sum(axis=1) if self.distance_metric == DistanceMetric.L2 else None
+            candidate_distances = self._distances(query, vectors @ query, norms)
+        else:
+            candidate_distances = distances[candidates]
+
+        order = np.argsort(candidate_distances)[:k]
+        return [(self.ids[candidates[i]], float(candidate_distances[i])) for i in order]
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        """
+        Checks whether an index was saved in a directory.
+
+        Args:
+            directory (Path): The directory of the index.
+
+        Returns:
+            bool: True if the index was saved there.
+        """
+        return (Path(directory) / "settings.json").exists()
+
+    def save(self, directory: Path):
+        """
+        Saves the index: the settings, the ids and the compressed vectors, and the full vectors in `vectors.npy`.
+
+        The full vectors are memory-mapped from `directory` afterwards, so building the index with
+        `vectors_path=directory / "vectors.npy"` avoids writing them twice.
+
+        Args:
+            directory (Path): The directory of the index, created if needed.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        vectors_path = directory / "vectors.npy"
+        # Vectors memory-mapped from the same file can't be written over it.
+        mapped = isinstance(self.vectors, np.memmap) and Path(self.vectors.filename).resolve() == vectors_path.resolve()
+        if not mapped:
+            np.save(vectors_path, np.asarray(self.vectors, dtype=np.float32))
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+
+        arrays = {
+            "ids": np.asarray(self.ids, dtype=str),
+            "codes": self.codes,
+            "offset": self.offset,
+            "scale": self.scale,
+            "codebooks": self.codebooks,
+            "approximate_norms": self.approximate_norms,
+        }
+        np.savez(directory / "codes.npz", **{name: array for name, array in arrays.items() if array is not None})
+
+        # The settings are written last: an index is only found once it's fully saved.
+        settings = {
+            "quantization": self.quantization.value,
+            "distance_metric": self.distance_metric.value,
+            "num_subvectors": self.num_subvectors,
+            "num_centroids": self.num_centroids,
+            "rerank_factor": self.rerank_factor,
+        }
+        (directory / "settings.json").write_text(json.dumps(settings))
+
+    @classmethod
+    def load(cls, directory: Path) -> "QuantizedIndex":
+        """
+        Loads an index saved with `save`, memory-mapping its full vectors.
+
+        Args:
+            directory (Path): The directory of the index.
+
+        Returns:
+            QuantizedIndex: The index.
+        """
+        directory = Path(directory)
+        settings = json.loads((directory / "settings.json").read_text())
+        index = cls(
+            QuantizationType(settings["quantization"]),
+            DistanceMetric(settings["distance_metric"]),
+            num_subvectors=settings["num_subvectors"],
+            num_centroids=settings["num_centroids"],
+            rerank_factor=settings["rerank_factor"],
+        )
+
+        with np.load(directory / "codes.npz") as arrays:
+            index.ids = arrays["ids"].tolist()
+            for name in ("codes", "offset", "scale", "codebooks", "approximate_norms"):
+                setattr(index, name, arrays[name] if name in arrays else None)
+        index.vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+        return index
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        The number of bytes of the compressed vectors and the quantizer kept in memory.
+        """
+        arrays = [self.codes, self.offset, self.scale, self.codebooks, self.approximate_norms]
+        if isinstance(self.vectors, np.ndarray) and not isinstance(self.vectors, np.memmap):
+            arrays.append(self.vectors)
+        return sum(array.nbytes for array in arrays if array is not None)
@@ -7,6 +7,9 @@ from bot.client.prompt import SYSTEM_TEMPLATE
 class ModelSettings(ABC):
     url: str
     file_name: str
+    # SHA-256 digest of the GGUF file, as listed on its Hugging Face page; if None, downloads are verified against the
+    # digest Hugging Face reports in the X-Linked-Etag header of LFS files.
+    sha256: str | None = None
     system_template: str = SYSTEM_TEMPLATE
     config: dict[str, Any]
     config_answer: dict[str, Any] | None
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from helpers.log import get_logger
+from tqdm import tqdm
+
+logger = get_logger(__name__)
+
+
+class ChecksumError(Exception):
+    """
+    Raised when the SHA-256 digest of a downloaded file doesn't match the expected one.
+    """
+
+
+def compute_sha256(file_path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 digest of a file.
+
+    Args:
+        file_path (Path): The path of the file.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_linked_sha256(response: requests.Response) -> str | None:
+    """
+    Returns the SHA-256 digest that Hugging Face reports for a file stored with Git LFS.
+
+    The `X-Linked-Etag` header of the response (or of a redirect leading to it) is the SHA-256 of the LFS object.
+
+    Args:
+        response (requests.Response): The response to the HEAD request of the file.
+
+    Returns:
+        str | None: The hexadecimal digest, or None if no response has one.
+    """
+    for r in [*response.history, response]:
+        etag = r.headers.get("X-Linked-Etag", "").removeprefix("W/").strip('"').lower()
+        if re.fullmatch(r"[0-9a-f]{64}", etag):
+            return etag
+    return None
+
+
+class ModelDownloader:
+    """
+    Downloads large files with parallel HTTP range requests, resuming interrupted downloads.
+
+    The file is written to `<destination>.part`, next to a `<destination>.part.json` file recording how many bytes of
+    each segment have been written. An interrupted download resumes from there, the complete file is verified against
+    its SHA-256 digest, and only then renamed to its destination, so a partial file is never left at the destination.
+    Servers that don't support range requests are downloaded in a single stream, without resume.
+    """
+
+    def __init__(
+        self,
+        num_segments: int = 4,
+        chunk_size: int = 1 << 20,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        show_progress: bool = True,
+    ):
+        """
+        Initialize the downloader.
+
+        Args:
+            num_segments (int): The number of segments fetched in parallel. Defaults to 4.
+            chunk_size (int): The number of bytes read from the network at a time. Defaults to 1 MiB.
+            timeout (float): The connect and read timeout of each request, in seconds. Defaults to 30.
+            max_retries (int): The number of times a failed segment is resumed before giving up. Defaults to 3.
+            show_progress (bool): Whether to display a progress bar. Defaults to True.
+        """
+        if num_segments < 1:
+            raise ValueError(f"num_segments must be a positive integer, got {num_segments}")
+
+        self.num_segments = num_segments
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.show_progress = show_progress
+
+    def download(self, url: str, destination: Path, sha256: str | None = None) -> Path:
+        """
+        Downloads a file, unless it already exists.
+
+        Args:
+            url (str): The URL of the file.
+            destination (Path): The path where the file is saved.
+            sha256 (str | None): The expected SHA-256 digest of the file. If None, the digest reported by Hugging Face
+                for LFS files is used, and the verification is skipped without one.
+
+        Returns:
+            Path: The destination path.
+
+        Raises:
+            ChecksumError: If the digest of the downloaded file doesn't match `sha256`; the partial files are removed.
+            requests.RequestException: If the download fails after `max_retries` attempts; it can be resumed later.
+        """
+        destination = Path(destination)
+        if destination.exists():
+            return destination
+
+        part_path = destination.with_name(destination.name + ".part")
+        progress_path = destination.with_name(destination.name + ".part.json")
+
+        response = requests.head(url, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length", 0))
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        sha256 = sha256 or get_linked_sha256(response)
+
+        with tqdm(
+            total=size or None, unit="B", unit_scale=True, desc=destination.name, disable=not self.show_progress
+        ) as pbar:
+            if size and accepts_ranges:
+                self._download_segments(response.url, part_path, progress_path, size, pbar)
+            else:
+                self._download_stream(response.url, part_path, pbar)
+
+        if sha256 is not None:
+            actual_sha256 = compute_sha256(part_path)
+            if actual_sha256 != sha256.lower():
+                part_path.unlink()
+                progress_path.unlink(missing_ok=True)
+                raise ChecksumError(f"SHA-256 of {destination.name} is {actual_sha256}, expected {sha256}")
+        else:
+            logger.warning(f"--- No SHA-256 digest for {destination.name}, skipping the verification ---")
+
+        os.replace(part_path, destination)
+        progress_path.unlink(missing_ok=True)
+        return destination
+
+    def _download_stream(self, url: str, part_path: Path, pbar: tqdm) -> None:
+        with requests.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    pbar.update(len(chunk))
+
+    def _download_segments(self, url: str, part_path: Path, progress_path: Path, size: int, pbar: tqdm) -> None:
+        segment_size = -(-size // self.num_segments)
+        segments = [(start, min(start + segment_size, size)) for start in range(0, size, segment_size)]
+
+        progress = self._load_progress(progress_path, size, segments)
+        if progress is None or not part_path.exists():
+            progress = {"size": size, "segments": [[start, end, 0] for start, end in segments]}
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        else:
+            logger.info(f"--- Resuming the download of {part_path.name} ---")
+        pbar.update(sum(written for _, _, written in progress["segments"]))
+
+        lock = threading.Lock()
+
+        def save_progress() -> None:
+            with lock:
+                progress_path.write_text(json.dumps(progress))
+
+        def download_segment(segment: list[int]) -> None:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._download_segment(url, part_path, segment, pbar, save_progress)
+                    return
+                except requests.RequestException as e:
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning(f"--- Resuming segment {segment[0]}-{segment[1]} after error: {e} ---")
+
+        with ThreadPoolExecutor(max_workers=self.num_segments, thread_name_prefix="download") as executor:
+            for future in [executor.submit(download_segment, segment) for segment in progress["segments"]]:
+                future.result()
+
+    def _download_segment(self, url: str, part_path: Path, segment: list[int], pbar: tqdm, save_progress) -> None:
+        start, end, written = segment
+        if start + written >= end:
+            return
+
+        headers = {"Range": f"bytes={start + written}-{end - 1}"}
+        with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.RequestException(f"Range request not honored (status {response.status_code})")
+            with open(part_path, "r+b") as f:
+                f.seek(start + written)
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    chunk = chunk[: end - start - segment[2]]
+                    f.write(chunk)
+                    # Record the progress only once the bytes are written, so a resume never skips any.
+                    f.flush()
+                    segment[2] += len(chunk)
+                    save_progress()
+                    pbar.update(len(chunk))
+
+        if start + segment[2] < end:
+            raise requests.RequestException(f"Segment {start}-{end} ended after {segment[2]} bytes")
+
+    @staticmethod
+    def _load_progress(progress_path: Path, size: int, segments: list[tuple[int, int]]) -> dict | None:
+        if not progress_path.exists():
+            return None
+        try:
+            progress = json.loads(progress_path.read_text())
+        except json.JSONDecodeError:
+            return None
+        if progress.get("size") != size or [(s, e) for s, e, _ in progress.get("segments", [])] != segments:
+            return None
+        return progress
@@ -1,12 +1,13 @@
 import argparse
 import sys
 import time
+import uuid
 from pathlib import Path
 
 import streamlit as st
 from bot.client.lama_cpp_client import LamaCppClient
-from bot.conversation.chat_history import ChatHistory
 from bot.conversation.conversation_handler import answer, extract_content_after_reasoning
+from bot.conversation.conversation_store import ConversationStore
 from bot.model.model_registry import get_model_settings, get_models
 from helpers.log import get_logger
 
@@ -27,9 +28,27 @@ def load_llm(model_name: str, model_folder: Path) -> LamaCppClient:
 
 
 @st.cache_resource()
-def init_chat_history(total_length: int = 2) -> ChatHistory:
-    chat_history = ChatHistory(total_length=total_length)
-    return chat_history
+def load_conversation_store(
+    db_path: Path, total_length: int = 2, _llm: LamaCppClient | None = None
+) -> ConversationStore:
+    """
+    Loads the store of the conversations of all the sessions.
+    """
+    if _llm is None:
+        return ConversationStore(db_path, total_length=total_length)
+    # Keep each history within a quarter of the context window of the model.
+    return ConversationStore(
+        db_path, total_length=total_length, max_tokens=_llm.n_ctx // 4, token_counter=_llm.count_tokens
+    )
+
+
+def get_session_id() -> str:
+    """
+    Returns the id of the conversation of the session, kept in the URL so that reloading the page resumes it.
+    """
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    return st.query_params["session"]
 
 
 def init_page(root_folder: Path) -> None:
@@ -54,14 +73,21 @@ def init_welcome_message() -> None:
         st.write("How can I help you today?")
 
 
-def reset_chat_history(chat_history: ChatHistory) -> None:
+def reset_chat_history(conversation_store: ConversationStore, session_id: str) -> None:
     """
-    Initializes the chat history, allowing users to clear the conversation.
+    Initializes the chat history from the stored conversation, allowing users to clear the conversation.
     """
     clear_button = st.sidebar.button("🗑️ Clear Conversation", key="clear")
-    if clear_button or "messages" not in st.session_state:
+    if "messages" not in st.session_state:
+        # A reloaded page displays the conversation saved in the store again.
+        st.session_state.messages = [
+            message
+            for question, answer in conversation_store.turns(session_id)
+            for message in [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        ]
+    if clear_button:
         st.session_state.messages = []
-        chat_history.clear()
+        conversation_store.clear(session_id)
 
 
 def display_messages_from_history():
@@ -81,8 +107,10 @@ def main(parameters) -> None:
 
     init_page(root_folder)
     llm = load_llm(model, model_folder)
-    chat_history = init_chat_history(2)
-    reset_chat_history(chat_history)
+    session_id = get_session_id()
+    conversation_store = load_conversation_store(root_folder / "conversations" / "chatbot.db", 2, _llm=llm)
+    reset_chat_history(conversation_store, session_id)
+    chat_history = conversation_store.get(session_id)
     init_welcome_message()
     display_messages_from_history()
 
@@ -114,7 +142,7 @@ def main(parameters) -> None:
 
         message_placeholder.markdown(final_answer)
         # Add assistant response to chat history
-        chat_history.append(f"question: {user_input}, answer: {final_answer}")
+        conversation_store.append(session_id, f"question: {user_input}, answer: {final_answer}")
         st.session_state.messages.append({"role": "assistant", "content": final_answer})
 
         took = time.time() - start_time
@@ -4,9 +4,12 @@ import time
 from pathlib import Path
 
 from bot.client.lama_cpp_client import LamaCppClient
+from bot.client.model_pool import ModelPool
+from bot.conversation.answer_cache import AnswerCache
 from bot.conversation.chat_history import ChatHistory
-from bot.conversation.conversation_handler import answer_with_context, refine_question
+from bot.conversation.conversation_handler import answer_with_context, refine_question, summarize_chat_history
 from bot.conversation.ctx_strategy import get_ctx_synthesis_strategies, get_ctx_synthesis_strategy
+from bot.conversation.question_rewriter import QuestionRewriter
 from bot.memory.embedder import Embedder
 from bot.memory.vector_database.chroma import Chroma
 from bot.model.model_registry import Model, get_model_settings, get_models
@@ -54,11 +57,20 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--k",
         type=int,
-        help="Number of chunks to return from the similarity search. Defaults to 2.",
+        help="The maximum number of chunks fetched by the similarity search. Defaults to 2.",
         required=False,
         default=2,
     )
 
+    parser.add_argument(
+        "--relative-score-gap",
+        type=float,
+        help="Chunks scoring more than this fraction below the best chunk are dropped before generating the answer; "
+        "1 keeps all the chunks above the threshold. Defaults to 0.25.",
+        required=False,
+        default=0.25,
+    )
+
     parser.add_argument(
         "--max-new-tokens",
         type=int,
@@ -67,19 +79,82 @@ def get_args() -> argparse.Namespace:
         default=512,
     )
 
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        help="The number of model instances generating answers concurrently with the async-tree-summarization "
+        "strategy. Defaults to 1.",
+        required=False,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--max-resident-gb",
+        type=float,
+        help="The memory budget, in GiB, of the models kept loaded; the least recently used models are evicted "
+        "to stay within it. Defaults to 16.",
+        required=False,
+        default=16,
+    )
+
+    parser.add_argument(
+        "--draft-model",
+        type=str,
+        choices=model_list,
+        help="Small model sharing the vocabulary of --model, used to generate with speculative decoding "
+        "(e.g. llama-3.2:1b for llama-3.1). Disabled by default.",
+        required=False,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num-draft-tokens",
+        type=int,
+        help="The number of tokens proposed by the draft model at each step. Defaults to 4.",
+        required=False,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--answer-cache-ttl",
+        type=float,
+        help="The number of seconds an answer is replayed for a similar question with the same retrieved chunks; "
+        "0 disables the answer cache. Defaults to 3600.",
+        required=False,
+        default=3600,
+    )
+
+    parser.add_argument(
+        "--question-rewriting",
+        type=str,
+        choices=["fast", "llm"],
+        help="How follow-up questions are rewritten before retrieval: 'fast' uses heuristics and the chat history "
+        "embeddings, falling back to the LLM only when uncertain; 'llm' always asks the LLM. Defaults to fast.",
+        required=False,
+        default="fast",
+    )
+
+    parser.add_argument(
+        "--summarize-history",
+        action="store_true",
+        help="Summarize the messages evicted from the chat history with the LLM instead of dropping them.",
+    )
+
     return parser.parse_args()
 
 
-def loop(llm, chat_history, synthesis_strategy, index, parameters) -> None:
+def loop(model_pool, chat_history, index, answer_cache, question_rewriter, parameters) -> None:
     custom_fig = Figlet(font="graffiti")
     console = Console(color_system="windows")
     console.print(custom_fig.renderText("ChatBot"))
     console.print(
         "[bold magenta]Hi! 👋, I'm your friendly chatbot 🦜 here to assist you. "
         "\nHow can I help you today? [/bold "
-        "magenta]Type 'exit' to stop."
+        "magenta]Type 'exit' to stop, '/model <name>' to switch model."
     )
 
+    model_name = parameters.model
+
     while True:
         console.print("[bold green]Please enter your question:[/bold green]")
         question = read_input()
@@ -87,16 +162,47 @@ def loop(llm, chat_history, synthesis_strategy, index, parameters) -> None:
         if question.lower() == "exit":
             break
 
+        if question.startswith("/model"):
+            new_model_name = question.removeprefix("/model").strip()
+            if new_model_name in get_models():
+                model_name = new_model_name
+            else:
+                console.print(f"[bold red]Supported models: {', '.join(get_models())}[/bold red]")
+            for name, stats in model_pool.stats().items():
+                message = (
+                    f"{name}: loaded in {stats['load_time']:.2f} s, "
+                    f"{stats['resident_bytes'] / (1 << 30):.2f} GiB resident, {stats['hits']} requests"
+                )
+                if "acceptance_rate" in stats:
+                    message += f", {stats['acceptance_rate']:.0%} of {stats['drafted']} drafted tokens accepted"
+                console.print(message)
+            continue
+
+        llm = get_llm_client(model_pool, model_name, parameters)
+        synthesis_strategy = get_ctx_synthesis_strategy(parameters.synthesis_strategy, llm=llm)
+
         logger.info(f"--- Question: {question}, Chat_history: {chat_history} ---")
 
         start_time = time.time()
-        refined_question = refine_question(llm, question, chat_history)
+        refined_question, rewrite_mode = refine_question(
+            llm, question, chat_history, question_rewriter=question_rewriter
+        )
 
-        retrieved_contents, sources = index.similarity_search_with_threshold(query=refined_question, k=parameters.k)
+        # Half of the context window is left for the prompt template, the chat history and the answer.
+        retrieved_contents, sources, report = index.adaptive_similarity_search(
+            query=refined_question,
+            k=parameters.k,
+            relative_gap=parameters.relative_score_gap,
+            max_context_tokens=llm.n_ctx // 2,
+            token_counter=llm.count_tokens,
+        )
+        if rewrite_mode is not None:
+            question_rewriter.record_retrieval(rewrite_mode, hit=bool(retrieved_contents))
 
         console.print("\n[bold magenta]Sources:[/bold magenta]")
         for source in sources:
             console.print(Markdown(prettify_source(source)))
+        console.print(f"[dim]{report}[/dim]")
 
         console.print("\n[bold magenta]Answer:[/bold magenta]")
 
@@ -107,6 +213,7 @@ def loop(llm, chat_history, synthesis_strategy, index, parameters) -> None:
             chat_history=chat_history,
             retrieved_contents=retrieved_contents,
             max_new_tokens=parameters.max_new_tokens,
+            answer_cache=answer_cache,
         )
         answer = ""
         for token in streamer:
@@ -127,22 +234,50 @@ def loop(llm, chat_history, synthesis_strategy, index, parameters) -> None:
             console.print("[bold red]Something went wrong![/bold red]")
 
 
-def main(parameters):
-    model_settings = get_model_settings(parameters.model)
+def get_llm_client(model_pool: ModelPool, model_name: str, parameters) -> LamaCppClient:
+    draft_kwargs = {}
+    # The draft model shares the vocabulary of the model selected on the command line only.
+    if parameters.draft_model and model_name == parameters.model:
+        draft_kwargs = {
+            "draft_model_settings": get_model_settings(parameters.draft_model),
+            "num_draft_tokens": parameters.num_draft_tokens,
+        }
+    return model_pool.get(model_name, **draft_kwargs)
+
 
+def main(parameters):
     root_folder = Path(__file__).resolve().parent.parent.parent
     model_folder = root_folder / "models"
     vector_store_path = root_folder / "vector_store" / "docs_index"
 
-    llm = LamaCppClient(model_folder=model_folder, model_settings=model_settings)
+    model_pool = ModelPool(
+        model_folder=model_folder,
+        capacity_bytes=int(parameters.max_resident_gb * (1 << 30)),
+        parallelism=parameters.parallelism,
+    )
+    # Load the model before the first question.
+    llm = get_llm_client(model_pool, parameters.model, parameters)
+
+    summarizer = None
+    if parameters.summarize_history:
+
+        def summarizer(summary: str, message: str) -> str:
+            return summarize_chat_history(get_llm_client(model_pool, parameters.model, parameters), summary, message)
 
-    synthesis_strategy = get_ctx_synthesis_strategy(parameters.synthesis_strategy, llm=llm)
-    chat_history = ChatHistory(total_length=2)
+    # Keep the history within a quarter of the context window, leaving room for the retrieved contents.
+    chat_history = ChatHistory(
+        total_length=2, max_tokens=llm.n_ctx // 4, token_counter=llm.count_tokens, summarizer=summarizer
+    )
 
     embedding = Embedder()
     index = Chroma(persist_directory=str(vector_store_path), embedding=embedding)
+    answer_cache = (
+        AnswerCache(embedding=embedding, ttl=parameters.answer_cache_ttl) if parameters.answer_cache_ttl > 0 else None
+    )
+
+    question_rewriter = QuestionRewriter(embedding=embedding) if parameters.question_rewriting == "fast" else None
 
-    loop(llm, chat_history, synthesis_strategy, index, parameters)
+    loop(model_pool, chat_history, index, answer_cache, question_rewriter, parameters)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import concurrent.futures
+from collections import deque
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
 from entities.document import Document
 from helpers.log import get_logger
@@ -45,28 +46,49 @@ class DirectoryLoader:
 
     def load(self) -> list[Document]:
         """Load documents."""
+        return list(self.iter_load())
+
+    def iter_load(self) -> Iterator[Document]:
+        """
+        Lazily load documents, yielding them one at a time.
+
+        Only the documents that are currently being partitioned are held in memory: with multithreading enabled at
+        most `max_concurrency` files are in flight at any time, and their documents are yielded in file order.
+
+        Yields:
+            Document: The next loaded document.
+        """
         if not self.path.exists():
             raise FileNotFoundError(f"Directory not found: '{self.path}'")
         if not self.path.is_dir():
             raise ValueError(f"Expected directory, got file: '{self.path}'")
 
-        docs: list[Document] = []
         items = list(self.path.rglob(self.glob) if self.recursive else self.path.glob(self.glob))
 
         pbar = None
         if self.show_progress:
             pbar = tqdm(total=len(items))
 
-        if self.use_multithreading:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
-                executor.map(lambda item: self.load_file(item, docs, pbar), items)
-        else:
-            for i in items:
-                self.load_file(i, docs, pbar)
-
-        if pbar:
-            pbar.close()
-
+        try:
+            if self.use_multithreading:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    futures = deque()
+                    for item in items:
+                        futures.append(executor.submit(self._load_file_docs, item, pbar))
+                        if len(futures) >= self.max_concurrency:
+                            yield from futures.popleft().result()
+                    while futures:
+                        yield from futures.popleft().result()
+            else:
+                for item in items:
+                    yield from self._load_file_docs(item, pbar)
+        finally:
+            if pbar:
+                pbar.close()
+
+    def _load_file_docs(self, doc_path: Path, pbar: Any | None) -> list[Document]:
+        docs: list[Document] = []
+        self.load_file(doc_path, docs, pbar)
         return docs
 
     def load_file(self, doc_path: Path, docs: list[Document], pbar: Any | None) -> None:
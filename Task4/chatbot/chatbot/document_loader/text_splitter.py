@@ -26,7 +26,7 @@ import copy
 import logging
 import re
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Iterable
+from typing import Any, Callable, Iterable, Iterator
 
 from entities.document import Document
 
@@ -81,24 +81,39 @@ class TextSplitter(ABC):
         """Create documents from a list of texts."""
         _metadatas = metadatas or [{}] * len(texts)
         documents = []
-        for i, text in enumerate(texts):
-            index = -1
-            for chunk in self.split_text(text):
-                metadata = copy.deepcopy(_metadatas[i])
-                if self._add_start_index:
-                    index = text.find(chunk, index + 1)
-                    metadata["start_index"] = index
-                new_doc = Document(page_content=chunk, metadata=metadata)
-                documents.append(new_doc)
+        for text, metadata in zip(texts, _metadatas):
+            documents.extend(self._iter_create_documents(text, metadata))
         return documents
 
     def split_documents(self, documents: Iterable[Document]) -> list[Document]:
         """Split documents."""
-        texts, metadatas = [], []
+        return list(self.iter_split(documents))
+
+    def iter_split(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        Lazily split documents, yielding the chunks of one document at a time.
+
+        Unlike `split_documents`, the input iterable is consumed on demand, so only the document being split and
+        its chunks are held in memory.
+
+        Args:
+            documents (Iterable[Document]): The documents to split.
+
+        Yields:
+            Document: The next chunk.
+        """
         for doc in documents:
-            texts.append(doc.page_content)
-            metadatas.append(doc.metadata)
-        return self.create_documents(texts, metadatas=metadatas)
+            yield from self._iter_create_documents(doc.page_content, doc.metadata)
+
+    def _iter_create_documents(self, text: str, metadata: dict) -> Iterator[Document]:
+        """Split a single text and yield a document for each chunk."""
+        index = -1
+        for chunk in self.split_text(text):
+            chunk_metadata = copy.deepcopy(metadata)
+            if self._add_start_index:
+                index = text.find(chunk, index + 1)
+                chunk_metadata["start_index"] = index
+            yield Document(page_content=chunk, metadata=chunk_metadata)
 
     def _join_docs(self, docs: list[str], separator: str) -> str | None:
         """
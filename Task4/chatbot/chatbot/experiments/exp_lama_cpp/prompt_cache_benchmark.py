@@ -0,0 +1,103 @@
+"""
+Benchmarks the time-to-first-token of the prompts sent during a RAG conversation turn with and without the prompt
+cache of `LamaCppClient`.
+
+A turn alternates between the conversation-awareness prompt, the context prompt (once per chunk) and the refine
+prompt, so without the cache llama.cpp re-evaluates the shared system template and prompt scaffold on every switch.
+
+Usage:
+    python experiments/exp_lama_cpp/prompt_cache_benchmark.py --model llama-3.2:1b --turns 3
+"""
+
+import argparse
+import gc
+import statistics
+import time
+from pathlib import Path
+
+from bot.client.lama_cpp_client import LamaCppClient
+from bot.model.model_registry import Model, get_model_settings, get_models
+
+CHAT_HISTORY = (
+    "question: What is the Blendle Social Code?, answer: It is a set of guidelines that describes how people at "
+    "Blendle work together."
+)
+QUESTION = "Who wrote it?"
+CHUNKS = [
+    "The Blendle Social Code was written by the founders together with the first employees of the company.",
+    "The Social Code is reviewed every year and anyone at Blendle can propose a change with a pull request.",
+    "Blendle values autonomy: teams decide how to reach their goals and are accountable for the results.",
+    "New employees read the Social Code during their first week and discuss it with their buddy.",
+]
+
+
+def measure_time_to_first_token(llm: LamaCppClient, prompt: str) -> float:
+    start_time = time.perf_counter()
+    stream = llm.start_answer_iterator_streamer(prompt, max_new_tokens=8)
+    next(iter(stream))
+    took = time.perf_counter() - start_time
+    # Drain the stream so llama-cpp saves the state at the end of the completion.
+    for _ in stream:
+        pass
+    return took
+
+
+def build_turn_prompts(llm: LamaCppClient) -> list[str]:
+    prompts = [llm.generate_refined_question_conversation_awareness_prompt(QUESTION, CHAT_HISTORY)]
+    prompts += [llm.generate_ctx_prompt(question=QUESTION, context=chunk) for chunk in CHUNKS]
+    prompts += [
+        llm.generate_refined_ctx_prompt(question=QUESTION, context=chunk, existing_answer="The founders.")
+        for chunk in CHUNKS
+    ]
+    return prompts
+
+
+def run(model_folder: Path, model_name: str, turns: int, prompt_cache_capacity_bytes: int | None) -> list[float]:
+    llm = LamaCppClient(model_folder, get_model_settings(model_name), prompt_cache_capacity_bytes)
+    prompts = build_turn_prompts(llm)
+
+    # Warm up the model, so the first measured call doesn't pay for the memory mapping of the weights.
+    measure_time_to_first_token(llm, prompts[0])
+
+    timings = []
+    for _ in range(turns):
+        for prompt in prompts:
+            timings.append(measure_time_to_first_token(llm, prompt))
+
+    if llm.prompt_cache is not None:
+        print(f"Prompt cache stats: {llm.prompt_cache.stats()}")
+
+    del llm
+    gc.collect()
+    return timings
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Prompt cache benchmark")
+    parser.add_argument(
+        "--model",
+        type=str,
+        choices=get_models(),
+        help=f"Model to be used. Defaults to {Model.LLAMA_3_2_one.value}.",
+        default=Model.LLAMA_3_2_one.value,
+    )
+    parser.add_argument("--turns", type=int, help="Number of simulated conversation turns. Defaults to 3.", default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    root_folder = Path(__file__).resolve().parent.parent.parent.parent
+    model_folder = root_folder / "models"
+    Path(model_folder).mkdir(parents=True, exist_ok=True)
+
+    results = {
+        "without prompt cache": run(model_folder, args.model, args.turns, prompt_cache_capacity_bytes=None),
+        "with prompt cache": run(model_folder, args.model, args.turns, prompt_cache_capacity_bytes=1 << 30),
+    }
+
+    for name, timings in results.items():
+        print(
+            f"--- {name}: median time-to-first-token {statistics.median(timings) * 1000:.1f} ms, "
+            f"total {sum(timings):.2f} s over {len(timings)} calls ---"
+        )
@@ -0,0 +1,162 @@
+"""
+Benchmarks the recall and latency of the approximate nearest-neighbour indexes over the chunks of the `docs/` corpus:
+Chroma HNSW with several `M`/`ef_construction`/`ef_search` settings, and the int8 and product-quantized indexes with
+and without exact re-ranking.
+
+The queries are the beginnings of randomly picked chunks, and the ground truth is an exact search over all the
+embeddings. `--replicas` adds jittered copies of the embeddings to see how the indexes behave on a larger corpus.
+
+Usage:
+    python experiments/exp_vector_database/ann_benchmark.py --distance-metric cosine --k 4 --replicas 10
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from bot.memory.embedder import Embedder
+from bot.memory.vector_database.chroma import Chroma, hnsw_collection_metadata
+from bot.memory.vector_database.distance_metric import DistanceMetric
+from bot.memory.vector_database.quantized_index import QuantizationType, QuantizedIndex
+from memory_builder import iter_load_documents, iter_split_chunks
+
+HNSW_SETTINGS = [
+    # (M, ef_construction, ef_search)
+    (16, 100, 10),
+    (16, 100, 50),
+    (32, 200, 50),
+    (32, 200, 100),
+]
+
+
+def exact_search(embeddings: np.ndarray, queries: np.ndarray, distance_metric: DistanceMetric, k: int) -> np.ndarray:
+    if distance_metric == DistanceMetric.COSINE:
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    if distance_metric == DistanceMetric.L2:
+        distances = (queries**2).sum(axis=1, keepdims=True) - 2 * queries @ embeddings.T + (embeddings**2).sum(axis=1)
+    else:
+        distances = -queries @ embeddings.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def recall(results: list[list[int]], ground_truth: np.ndarray) -> float:
+    return statistics.mean(len(set(result) & set(truth)) / len(truth) for result, truth in zip(results, ground_truth))
+
+
+def benchmark_hnsw(
+    embeddings: np.ndarray, queries: np.ndarray, ground_truth: np.ndarray, distance_metric: DistanceMetric, k: int
+) -> None:
+    ids = [str(i) for i in range(len(embeddings))]
+    for m, ef_construction, ef_search in HNSW_SETTINGS:
+        chroma = Chroma(
+            collection_name=f"benchmark-{uuid.uuid4().hex}",
+            collection_metadata=hnsw_collection_metadata(distance_metric, m, ef_construction, ef_search),
+            is_persistent=False,
+        )
+        start_time = time.perf_counter()
+        for start in range(0, len(ids), 1024):
+            chroma.collection.add(ids=ids[start : start + 1024], embeddings=embeddings[start : start + 1024].tolist())
+        build_time = time.perf_counter() - start_time
+
+        results, latencies = [], []
+        for query in queries:
+            start_time = time.perf_counter()
+            result = chroma.collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+            latencies.append(time.perf_counter() - start_time)
+            results.append([int(id) for id in result["ids"][0]])
+
+        print(
+            f"hnsw M={m:<3} ef_construction={ef_construction:<4} ef_search={ef_search:<4} "
+            f"recall@{k}={recall(results, ground_truth):.3f} "
+            f"latency={statistics.median(latencies) * 1000:.2f} ms build={build_time:.1f} s"
+        )
+        chroma.client.delete_collection(chroma.collection.name)
+
+
+def benchmark_quantized(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    ground_truth: np.ndarray,
+    distance_metric: DistanceMetric,
+    k: int,
+    num_subvectors: int,
+) -> None:
+    ids = [str(i) for i in range(len(embeddings))]
+    for quantization in QuantizationType:
+        index = QuantizedIndex(quantization, distance_metric, num_subvectors=num_subvectors)
+        with tempfile.TemporaryDirectory() as folder:
+            start_time = time.perf_counter()
+            index.build(ids, embeddings, vectors_path=Path(folder) / "vectors.npy")
+            build_time = time.perf_counter() - start_time
+
+            for rerank in (False, True):
+                results, latencies = [], []
+                for query in queries:
+                    start_time = time.perf_counter()
+                    result = index.search(query, k=k, rerank=rerank)
+                    latencies.append(time.perf_counter() - start_time)
+                    results.append([int(id) for id, _ in result])
+
+                print(
+                    f"{quantization.value:<4} rerank={str(rerank):<5} "
+                    f"recall@{k}={recall(results, ground_truth):.3f} "
+                    f"latency={statistics.median(latencies) * 1000:.2f} ms build={build_time:.1f} s "
+                    f"memory={index.memory_bytes / (1 << 20):.1f} MiB"
+                )
+            # Release the memory-mapped vectors before the folder is removed.
+            index.vectors = None
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Approximate nearest-neighbour benchmark")
+    parser.add_argument(
+        "--distance-metric",
+        type=str,
+        choices=[metric.value for metric in DistanceMetric],
+        help="The distance between embeddings. Defaults to cosine.",
+        default=DistanceMetric.COSINE.value,
+    )
+    parser.add_argument("--k", type=int, help="The number of neighbours. Defaults to 4.", default=4)
+    parser.add_argument("--num-queries", type=int, help="The number of queries. Defaults to 100.", default=100)
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        help="The number of jittered copies of the corpus embeddings added to the index. Defaults to 0.",
+        default=0,
+    )
+    parser.add_argument(
+        "--num-subvectors",
+        type=int,
+        help="The number of sub-vectors of product quantization. Defaults to 48.",
+        default=48,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    root_folder = Path(__file__).resolve().parent.parent.parent.parent
+    distance_metric = DistanceMetric(args.distance_metric)
+
+    chunks = [chunk.page_content for chunk in iter_split_chunks(iter_load_documents(root_folder / "docs"))]
+    embedder = Embedder()
+    embeddings = np.asarray(embedder.embed_documents(chunks), dtype=np.float32)
+
+    rng = np.random.default_rng(0)
+    if args.replicas:
+        noise = embeddings.std() * 0.1
+        copies = [embeddings + rng.normal(scale=noise, size=embeddings.shape) for _ in range(args.replicas)]
+        embeddings = np.concatenate([embeddings, *copies]).astype(np.float32)
+
+    query_chunks = rng.choice(len(chunks), size=min(args.num_queries, len(chunks)), replace=False)
+    queries = np.asarray(embedder.embed_documents([chunks[i][:100] for i in query_chunks]), dtype=np.float32)
+    ground_truth = exact_search(embeddings, queries, distance_metric, args.k)
+
+    print(f"{len(embeddings)} vectors of {embeddings.shape[1]} dimensions ({embeddings.nbytes / (1 << 20):.1f} MiB)")
+    benchmark_hnsw(embeddings, queries, ground_truth, distance_metric, args.k)
+    benchmark_quantized(embeddings, queries, ground_truth, distance_metric, args.k, args.num_subvectors)
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 import chromadb
+from bot.conversation.conversation_store import ConversationStore
 from bot.memory.embedder import Embedder
 from bot.memory.vector_database.chroma import Chroma
 from helpers.prettier import prettify_source
@@ -44,3 +45,11 @@ if __name__ == "__main__":
         # where_document={"$contains":"search_string"}  # optional filter
     )
     print(results)
+
+    # The episodic memory of the apps: past turns of a session are recalled by embedding instead of being resent.
+    conversation_store = ConversationStore(":memory:", embedding=embedding, total_length=1)
+    conversation_store.append("session", "question: What is the Blendle Social Code?, answer: A set of principles.")
+    conversation_store.append("session", "question: Where is Blendle based?, answer: In Utrecht.")
+    conversation_store.append("session", "question: How many people work there?, answer: About sixty.")
+    print(conversation_store.recall("session", "Who wrote the Social Code?"))
+    print(conversation_store.prompt_history("session", "Who wrote the Social Code?"))
@@ -1,9 +1,12 @@
 import argparse
 import sys
 from pathlib import Path
+from typing import Iterable, Iterator
 
 from bot.memory.embedder import Embedder
-from bot.memory.vector_database.chroma import Chroma
+from bot.memory.vector_database.chroma import Chroma, hnsw_collection_metadata
+from bot.memory.vector_database.distance_metric import DistanceMetric
+from bot.memory.vector_database.quantized_index import QuantizationType
 from document_loader.format import Format
 from document_loader.loader import DirectoryLoader
 from document_loader.text_splitter import create_recursive_text_splitter
@@ -13,22 +16,47 @@ from helpers.log import get_logger
 logger = get_logger(__name__)
 
 
-def load_documents(docs_path: Path) -> list[Document]:
+def get_loader(docs_path: Path) -> DirectoryLoader:
     """
-    Loads Markdown documents from the specified path.
+    Creates the loader for the Markdown documents in the specified path.
 
     Args:
         docs_path (Path): The path to the documents.
 
     Returns:
-        List[Document]: A list of loaded documents.
+        DirectoryLoader: The directory loader.
     """
-    loader = DirectoryLoader(
+    return DirectoryLoader(
         path=docs_path,
         glob="**/*.md",
         show_progress=True,
     )
-    return loader.load()
+
+
+def load_documents(docs_path: Path) -> list[Document]:
+    """
+    Loads Markdown documents from the specified path.
+
+    Args:
+        docs_path (Path): The path to the documents.
+
+    Returns:
+        List[Document]: A list of loaded documents.
+    """
+    return get_loader(docs_path).load()
+
+
+def iter_load_documents(docs_path: Path) -> Iterator[Document]:
+    """
+    Lazily loads Markdown documents from the specified path.
+
+    Args:
+        docs_path (Path): The path to the documents.
+
+    Yields:
+        Document: The next loaded document.
+    """
+    return get_loader(docs_path).iter_load()
 
 
 def split_chunks(sources: list, chunk_size: int = 512, chunk_overlap: int = 25) -> list:
@@ -43,28 +71,77 @@ def split_chunks(sources: list, chunk_size: int = 512, chunk_overlap: int = 25)
     Returns:
         List: A list of smaller chunks obtained from the input sources.
     """
-    chunks = []
+    return list(iter_split_chunks(sources, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+
+
+def iter_split_chunks(
+    sources: Iterable[Document], chunk_size: int = 512, chunk_overlap: int = 25
+) -> Iterator[Document]:
+    """
+    Lazily splits sources into smaller chunks.
+
+    Args:
+        sources (Iterable[Document]): The sources to be split into chunks, consumed on demand.
+        chunk_size (int, optional): The maximum size of each chunk. Defaults to 512.
+        chunk_overlap (int, optional): The amount of overlap between consecutive chunks. Defaults to 25.
+
+    Yields:
+        Document: The next chunk obtained from the input sources.
+    """
+    # The start index lets the retrieval merge the chunks that follow each other in a source.
     splitter = create_recursive_text_splitter(
-        format=Format.MARKDOWN.value, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        format=Format.MARKDOWN.value, chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
     )
-    for chunk in splitter.split_documents(sources):
-        chunks.append(chunk)
-    return chunks
-
+    return splitter.iter_split(sources)
+
+
+def build_memory_index(
+    docs_path: Path,
+    vector_store_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    batch_size: int = 256,
+    collection_metadata: dict | None = None,
+    quantization: QuantizationType | None = None,
+    num_subvectors: int = 8,
+):
+    """
+    Builds the memory index by streaming the documents through the loader, the splitter and the vector database.
 
-def build_memory_index(docs_path: Path, vector_store_path: str, chunk_size: int, chunk_overlap: int):
-    logger.info(f"Loading documents from: {docs_path}")
-    sources = load_documents(docs_path)
-    logger.info(f"Number of loaded documents: {len(sources)}")
+    Documents are loaded, split and embedded lazily, so the peak memory is bounded by `batch_size` and not by the
+    size of the corpus.
 
-    logger.info("Chunking documents...")
-    chunks = split_chunks(sources, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    logger.info(f"Number of generated chunks: {len(chunks)}")
+    Args:
+        docs_path (Path): The path to the documents.
+        vector_store_path (str): The path to the vector store.
+        chunk_size (int): The maximum size of each chunk.
+        chunk_overlap (int): The amount of overlap between consecutive chunks.
+        batch_size (int, optional): The number of chunks embedded and stored at once. Defaults to 256.
+        collection_metadata (dict | None, optional): The distance metric and HNSW settings of the collection, from
+            `hnsw_collection_metadata`. Defaults to None, the settings of Chroma.
+        quantization (QuantizationType | None, optional): The compression of the vectors of a quantized index built
+            over the collection, which the chatbots then search instead of the HNSW index. Defaults to None, no
+            quantized index.
+        num_subvectors (int, optional): The number of sub-vectors of product quantization. Defaults to 8.
+    """
+    logger.info(f"Loading and chunking documents from: {docs_path}")
+    sources = iter_load_documents(docs_path)
+    chunks = iter_split_chunks(sources, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
     logger.info("Creating memory index...")
     embedding = Embedder()
-    vector_database = Chroma(persist_directory=str(vector_store_path), embedding=embedding)
-    vector_database.from_chunks(chunks)
+    vector_database = Chroma(
+        persist_directory=str(vector_store_path), embedding=embedding, collection_metadata=collection_metadata
+    )
+    num_of_chunks = vector_database.from_chunks(chunks, batch_size=batch_size)
+    logger.info(f"Number of generated chunks: {num_of_chunks}")
+    if quantization is not None:
+        logger.info(f"Creating {quantization.value} quantized index...")
+        quantized_index = vector_database.build_quantized_index(quantization, num_subvectors=num_subvectors)
+        logger.info(f"Quantized index kept in memory: {quantized_index.memory_bytes / (1 << 20):.1f} MiB")
+    else:
+        # A quantized index of a previous build would miss the new chunks.
+        vector_database.remove_quantized_index()
     logger.info("Memory Index has been created successfully!")
 
 
@@ -84,6 +161,58 @@ def get_args() -> argparse.Namespace:
         required=False,
         default=25,
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="The number of chunks embedded and stored at once. Defaults to 256.",
+        required=False,
+        default=256,
+    )
+    parser.add_argument(
+        "--distance-metric",
+        type=str,
+        choices=[metric.value for metric in DistanceMetric],
+        help="The distance between embeddings used by the index. Defaults to l2.",
+        required=False,
+        default=DistanceMetric.L2.value,
+    )
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        help="The number of neighbours of each node of the HNSW graph. Defaults to the Chroma default (16).",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--hnsw-ef-construction",
+        type=int,
+        help="The size of the HNSW candidate list when indexing. Defaults to the Chroma default (100).",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--hnsw-ef-search",
+        type=int,
+        help="The size of the HNSW candidate list when querying. Defaults to the Chroma default (10).",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--quantization",
+        type=str,
+        choices=[quantization.value for quantization in QuantizationType],
+        help="Build a quantized index keeping int8 or product-quantized vectors in memory, searched instead of the "
+        "HNSW index. Defaults to none.",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--num-subvectors",
+        type=int,
+        help="The number of sub-vectors of product quantization; it must divide the embedding size. Defaults to 8.",
+        required=False,
+        default=8,
+    )
 
     return parser.parse_args()
 
@@ -98,6 +227,15 @@ def main(parameters):
         str(vector_store_path),
         parameters.chunk_size,
         parameters.chunk_overlap,
+        parameters.batch_size,
+        hnsw_collection_metadata(
+            DistanceMetric(parameters.distance_metric),
+            m=parameters.hnsw_m,
+            ef_construction=parameters.hnsw_ef_construction,
+            ef_search=parameters.hnsw_ef_search,
+        ),
+        QuantizationType(parameters.quantization) if parameters.quantization else None,
+        parameters.num_subvectors,
     )
 
 
@@ -1,17 +1,21 @@
 import argparse
 import sys
 import time
+import uuid
 from pathlib import Path
 
 import streamlit as st
 from bot.client.lama_cpp_client import LamaCppClient
-from bot.conversation.chat_history import ChatHistory
+from bot.client.model_pool import ModelPool
+from bot.conversation.answer_cache import AnswerCache
 from bot.conversation.conversation_handler import answer_with_context, extract_content_after_reasoning, refine_question
+from bot.conversation.conversation_store import ConversationStore
 from bot.conversation.ctx_strategy import (
     BaseSynthesisStrategy,
     get_ctx_synthesis_strategies,
     get_ctx_synthesis_strategy,
 )
+from bot.conversation.question_rewriter import QuestionRewriter
 from bot.memory.embedder import Embedder
 from bot.memory.vector_database.chroma import Chroma
 from bot.model.model_registry import get_model_settings, get_models
@@ -24,22 +28,48 @@ st.set_page_config(page_title="RAG Chatbot", page_icon="💬", initial_sidebar_s
 
 
 @st.cache_resource()
-def load_llm_client(model_folder: Path, model_name: str) -> LamaCppClient:
-    model_settings = get_model_settings(model_name)
-    llm = LamaCppClient(model_folder=model_folder, model_settings=model_settings)
+def load_model_pool(model_folder: Path, capacity_bytes: int, parallelism: int = 1) -> ModelPool:
+    """
+    Loads the pool of models shared by all the sessions of the application.
+    """
+    return ModelPool(model_folder=model_folder, capacity_bytes=capacity_bytes, parallelism=parallelism)
 
-    return llm
+
+def load_llm_client(
+    model_pool: ModelPool,
+    model_name: str,
+    draft_model_name: str | None = None,
+    num_draft_tokens: int = 4,
+) -> LamaCppClient:
+    draft_kwargs = {}
+    if draft_model_name:
+        draft_kwargs = {
+            "draft_model_settings": get_model_settings(draft_model_name),
+            "num_draft_tokens": num_draft_tokens,
+        }
+    return model_pool.get(model_name, **draft_kwargs)
 
 
 @st.cache_resource()
-def init_chat_history(total_length: int = 2) -> ChatHistory:
-    chat_history = ChatHistory(total_length=total_length)
-    return chat_history
+def load_conversation_store(db_path: Path, total_length: int, _index: Chroma) -> ConversationStore:
+    """
+    Loads the store of the conversations of all the sessions, embedding the turns like the index to recall them.
+    """
+    return ConversationStore(db_path, embedding=_index.embedding, total_length=total_length)
 
 
-@st.cache_resource()
-def load_ctx_synthesis_strategy(ctx_synthesis_strategy_name: str, _llm: LamaCppClient) -> BaseSynthesisStrategy:
-    ctx_synthesis_strategy = get_ctx_synthesis_strategy(ctx_synthesis_strategy_name, llm=_llm)
+def get_session_id() -> str:
+    """
+    Returns the id of the conversation of the session, kept in the URL so that reloading the page resumes it.
+    """
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    return st.query_params["session"]
+
+
+def load_ctx_synthesis_strategy(ctx_synthesis_strategy_name: str, llm: LamaCppClient) -> BaseSynthesisStrategy:
+    # Not cached: the strategy is bound to the client of the selected model, which can change between runs.
+    ctx_synthesis_strategy = get_ctx_synthesis_strategy(ctx_synthesis_strategy_name, llm=llm)
     return ctx_synthesis_strategy
 
 
@@ -60,6 +90,22 @@ def load_index(vector_store_path: Path) -> Chroma:
     return index
 
 
+@st.cache_resource()
+def load_answer_cache(ttl: float, _index: Chroma) -> AnswerCache | None:
+    """
+    Loads the cache of the answers shared by all the sessions, embedding the questions like the index.
+    """
+    return AnswerCache(embedding=_index.embedding, ttl=ttl) if ttl > 0 else None
+
+
+@st.cache_resource()
+def load_question_rewriter(question_rewriting: str, _index: Chroma) -> QuestionRewriter | None:
+    """
+    Loads the rewriter of the follow-up questions, embedding the questions like the index.
+    """
+    return QuestionRewriter(embedding=_index.embedding) if question_rewriting == "fast" else None
+
+
 def init_page(root_folder: Path) -> None:
     """
     Initializes the page configuration for the application.
@@ -88,14 +134,21 @@ def init_welcome_message() -> None:
         st.write("How can I help you today?")
 
 
-def reset_chat_history(chat_history: ChatHistory) -> None:
+def reset_chat_history(conversation_store: ConversationStore, session_id: str) -> None:
     """
-    Initializes the chat history, allowing users to clear the conversation.
+    Initializes the chat history from the stored conversation, allowing users to clear the conversation.
     """
     clear_button = st.sidebar.button("🗑️ Clear Conversation", key="clear")
-    if clear_button or "messages" not in st.session_state:
+    if "messages" not in st.session_state:
+        # A reloaded page displays the conversation saved in the store again.
+        st.session_state.messages = [
+            message
+            for question, answer in conversation_store.turns(session_id)
+            for message in [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        ]
+    if clear_button:
         st.session_state.messages = []
-        chat_history.clear()
+        conversation_store.clear(session_id)
 
 
 def display_messages_from_history():
@@ -117,18 +170,41 @@ def main(parameters) -> None:
     root_folder = Path(__file__).resolve().parent.parent
     model_folder = root_folder / "models"
     vector_store_path = root_folder / "vector_store" / "docs_index"
+    conversations_path = root_folder / "conversations" / "rag_chatbot.db"
     Path(model_folder).parent.mkdir(parents=True, exist_ok=True)
 
-    model_name = parameters.model
     synthesis_strategy_name = parameters.synthesis_strategy
     max_new_tokens = parameters.max_new_tokens
 
     init_page(root_folder)
-    llm = load_llm_client(model_folder, model_name)
-    chat_history = init_chat_history(2)
-    ctx_synthesis_strategy = load_ctx_synthesis_strategy(synthesis_strategy_name, _llm=llm)
+    model_list = get_models()
+    model_name = st.sidebar.selectbox("Model", model_list, index=model_list.index(parameters.model))
+    model_pool = load_model_pool(model_folder, int(parameters.max_resident_gb * (1 << 30)), parameters.parallelism)
+    # The draft model shares the vocabulary of the model selected on the command line only.
+    llm = load_llm_client(
+        model_pool,
+        model_name,
+        parameters.draft_model if model_name == parameters.model else None,
+        parameters.num_draft_tokens,
+    )
+    for name, stats in model_pool.stats().items():
+        caption = (
+            f"{name}: loaded in {stats['load_time']:.1f} s, {stats['resident_bytes'] / (1 << 30):.2f} GiB resident"
+        )
+        if "acceptance_rate" in stats:
+            caption += f", {stats['acceptance_rate']:.0%} of {stats['drafted']} drafted tokens accepted"
+        st.sidebar.caption(caption)
     index = load_index(vector_store_path)
-    reset_chat_history(chat_history)
+    session_id = get_session_id()
+    conversation_store = load_conversation_store(conversations_path, 2, _index=index)
+    reset_chat_history(conversation_store, session_id)
+    chat_history = conversation_store.get(session_id)
+    # Keep the history within a quarter of the context window of the selected model, leaving room for the retrieved
+    # contents; the tokens are approximated since the history is shared across models.
+    chat_history.max_tokens = llm.n_ctx // 4
+    ctx_synthesis_strategy = load_ctx_synthesis_strategy(synthesis_strategy_name, llm=llm)
+    answer_cache = load_answer_cache(parameters.answer_cache_ttl, _index=index)
+    question_rewriter = load_question_rewriter(parameters.question_rewriting, _index=index)
     init_welcome_message()
     display_messages_from_history()
 
@@ -148,12 +224,26 @@ def main(parameters) -> None:
             with st.spinner(
                 text="Refining the question and Retrieving the docs – hang tight! This should take seconds."
             ):
-                refined_user_input = refine_question(
-                    llm, user_input, chat_history=chat_history, max_new_tokens=max_new_tokens
+                # The older turns related to the question are recalled instead of resending the whole conversation.
+                chat_history = conversation_store.prompt_history(session_id, user_input)
+                refined_user_input, rewrite_mode = refine_question(
+                    llm,
+                    user_input,
+                    chat_history=chat_history,
+                    max_new_tokens=max_new_tokens,
+                    question_rewriter=question_rewriter,
                 )
-                retrieved_contents, sources = index.similarity_search_with_threshold(
-                    query=refined_user_input, k=parameters.k
+                # Half of the context window is left for the prompt template, the chat history and the answer.
+                retrieved_contents, sources, report = index.adaptive_similarity_search(
+                    query=refined_user_input,
+                    k=parameters.k,
+                    relative_gap=parameters.relative_score_gap,
+                    max_context_tokens=llm.n_ctx // 2,
+                    token_counter=llm.count_tokens,
                 )
+                st.caption(str(report).capitalize())
+                if rewrite_mode is not None:
+                    question_rewriter.record_retrieval(rewrite_mode, hit=bool(retrieved_contents))
                 if retrieved_contents:
                     full_response += "Here are the retrieved text chunks with a content preview: \n\n"
                     message_placeholder.markdown(full_response)
@@ -176,7 +266,13 @@ def main(parameters) -> None:
             full_response = ""
             with st.spinner(text="Refining the context and Generating the answer for each text chunk – hang tight! "):
                 streamer, _ = answer_with_context(
-                    llm, ctx_synthesis_strategy, user_input, chat_history, retrieved_contents, max_new_tokens
+                    llm,
+                    ctx_synthesis_strategy,
+                    refined_user_input,
+                    chat_history,
+                    retrieved_contents,
+                    max_new_tokens,
+                    answer_cache=answer_cache,
                 )
                 for token in streamer:
                     full_response += llm.parse_token(token)
@@ -189,7 +285,7 @@ def main(parameters) -> None:
                 else:
                     answer = full_response
 
-                chat_history.append(f"question: {user_input}, answer: {answer}")
+                conversation_store.append(session_id, f"question: {user_input}, answer: {answer}")
 
                 message_placeholder.markdown(answer)
 
@@ -233,11 +329,20 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--k",
         type=int,
-        help="Number of chunks to return from the similarity search. Defaults to 2.",
+        help="The maximum number of chunks fetched by the similarity search. Defaults to 2.",
         required=False,
         default=2,
     )
 
+    parser.add_argument(
+        "--relative-score-gap",
+        type=float,
+        help="Chunks scoring more than this fraction below the best chunk are dropped before generating the answer; "
+        "1 keeps all the chunks above the threshold. Defaults to 0.25.",
+        required=False,
+        default=0.25,
+    )
+
     parser.add_argument(
         "--max-new-tokens",
         type=int,
@@ -246,6 +351,61 @@ def get_args() -> argparse.Namespace:
         default=512,
     )
 
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        help="The number of model instances generating answers concurrently with the async-tree-summarization "
+        "strategy. Defaults to 1.",
+        required=False,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--max-resident-gb",
+        type=float,
+        help="The memory budget, in GiB, of the models kept loaded; the least recently used models are evicted "
+        "to stay within it. Defaults to 16.",
+        required=False,
+        default=16,
+    )
+
+    parser.add_argument(
+        "--draft-model",
+        type=str,
+        choices=model_list,
+        help="Small model sharing the vocabulary of --model, used to generate with speculative decoding "
+        "(e.g. llama-3.2:1b for llama-3.1). Disabled by default.",
+        required=False,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num-draft-tokens",
+        type=int,
+        help="The number of tokens proposed by the draft model at each step. Defaults to 4.",
+        required=False,
+        default=4,
+    )
+
+    parser.add_argument(
+        "--answer-cache-ttl",
+        type=float,
+        help="The number of seconds an answer is replayed for a similar question with the same retrieved chunks; "
+        "0 disables the answer cache. Defaults to 3600.",
+        required=False,
+        default=3600,
+    )
+
+    parser.add_argument(
+        "--question-rewriting",
+        type=str,
+        choices=["fast", "llm"],
+        help="How follow-up questions are rewritten before retrieval: 'fast' uses heuristics and the chat history "
+        "embeddings, falling back to the LLM only when uncertain; 'llm' always asks the LLM. Defaults to fast.",
+        required=False,
+        default="fast",
+    )
+
     return parser.parse_args()
 
 
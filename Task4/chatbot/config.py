@@ -5,6 +5,13 @@ import glob
 
 data_dir = "data"
 thumbnail_dir = join(data_dir, "thumbnails")
+# Sharded IVF-PQ index, memory-mapped by the app when it exists (see data_handling/sharded_index.py)
+index_dir = join(data_dir, "index_ivfpq")
+# Query encoder of the app: "cpu", "cuda", "int8" or "auto" (cuda if available, int8 otherwise), see encoder.py.
+# int8 is faster on CPU but its embeddings drift slightly from the ones of the index, run encoder.py to check them
+encoder_backend = "cpu"
+# Torch threads of the CPU encoders, None for up to 4
+encoder_threads = None
 testing = False
 
 # If the directorys doesn't exist, create it
@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import argparse
+import time
+from os.path import join
+
+import faiss
+import numpy as np
+import psutil
+
+from config import data_dir, index_dir
+from data_handling.sharded_index import ShardedIndex
+
+
+def resident_memory():
+    return psutil.Process().memory_info().rss
+
+
+def recall_at_k(labels, ground_truth):
+    return np.mean([len(set(result) & set(truth)) / len(truth) for result, truth in zip(labels, ground_truth)])
+
+
+def timed_search(index, queries, k):
+    # One query at a time, like the app
+    latencies, scores, labels = [], [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        query_scores, query_labels = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start_time)
+        scores.append(query_scores[0])
+        labels.append(query_labels[0])
+    return np.array(scores), np.array(labels), np.array(latencies) * 1000
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the sharded index against the flat index")
+    parser.add_argument("--k", type=int, default=10, help="Number of results. Defaults to 10")
+    parser.add_argument("--num-queries", type=int, default=200, help="Number of queries. Defaults to 200")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="Values of nprobe to test")
+    parser.add_argument("--rerank-factor", type=int, default=4, help="Candidates re-ranked per result, 1 disables it")
+    parser.add_argument("--test", action="store_true", help="Use the test indexes")
+    return parser.parse_args()
+
+
+# The queries are papers of the corpus with a little noise, the ground truth is the search of the flat index
+if __name__ == "__main__":
+    args = get_args()
+    suffix = "_test" if args.test else ""
+
+    # The sharded index is loaded first so the memory of the flat index isn't counted in it
+    memory = resident_memory()
+    sharded_index = ShardedIndex.load(index_dir + suffix, rerank_factor=args.rerank_factor)
+    sharded_memory = resident_memory() - memory
+    print(
+        f"[+] Loaded {len(sharded_index.shards)} shards with {sharded_index.ntotal} vectors "
+        f"({sharded_memory / 2**20:.0f} MiB resident, the inverted lists are paged in by the queries)"
+    )
+
+    memory = resident_memory()
+    flat_index = faiss.read_index(join(data_dir, f"index{suffix}.faiss"))
+    flat_memory = resident_memory() - memory
+    print(f"[+] Loaded flat index with {flat_index.ntotal} vectors ({flat_memory / 2**20:.0f} MiB resident)")
+
+    rng = np.random.default_rng(0)
+    positions = rng.choice(flat_index.ntotal, min(args.num_queries, flat_index.ntotal), replace=False)
+    queries = np.vstack([flat_index.reconstruct(int(position)) for position in positions])
+    queries = (queries + rng.normal(scale=0.01, size=queries.shape)).astype("float32")
+
+    _, ground_truth, flat_latencies = timed_search(flat_index, queries, args.k)
+    print(
+        f"flat       recall@{args.k}=1.000 latency p50={np.median(flat_latencies):.2f} ms "
+        f"p99={np.percentile(flat_latencies, 99):.2f} ms"
+    )
+
+    for nprobe in args.nprobe:
+        sharded_index.set_nprobe(nprobe)
+        _, labels, latencies = timed_search(sharded_index, queries, args.k)
+        print(
+            f"nprobe={nprobe:<4} recall@{args.k}={recall_at_k(labels, ground_truth):.3f} "
+            f"latency p50={np.median(latencies):.2f} ms p99={np.percentile(latencies, 99):.2f} ms"
+        )
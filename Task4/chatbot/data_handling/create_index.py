@@ -1,70 +1,185 @@
-import sys
 import os
+import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
-from os.path import join
-from config import data_dir
-from sentence_transformers import SentenceTransformer
-import pandas as pd
-from tqdm import tqdm
-import faiss
+import argparse
 import gc
 import pickle
+import threading
+import time
+from os.path import join
+from queue import Queue
+
+import faiss
 import numpy as np
+from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
+
+from config import data_dir
+from data_handling.id_table import IdTable
+from data_handling.metadata_store import build_metadata_store
+from data_handling.papers import load_papers, papers_path
+
 
 # Faiss
 class FaissIdx:
     def __init__(self, dim=768, use_gpu=True):
         for key, value in locals().items():
             setattr(self, key, value)
+        # CPU-only hosts (and faiss-cpu) have no GPU resources
+        self.use_gpu = use_gpu and hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
         # Maintaining the document data
         # Load Model
         self.model = SentenceTransformer("all-mpnet-base-v2")
 
-        # Initialize the index
-        self.index = faiss.IndexFlatIP(dim)
+        # Initialize the index, the integer id of a paper is its row in the id table
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
 
         # Inicialize ids
-        self.ids = []
+        self.id_table = IdTable(join(data_dir, "ids.bin"))
+        # Ids added to the index since the last checkpoint
+        self.pending_ids = []
+        # Error of the thread adding the embeddings to the index
+        self.writer_error = None
 
         # Use GPU
         if self.use_gpu:
-            self.use_gpu()
-        res = faiss.StandardGpuResources()
-        self.index = faiss.index_cpu_to_gpu(res, 0, self.index)
-
+            self.switch_to_gpu()
 
-    def add_doc(self, data):
-        batch_size = 64
-        save_every = 10
+    def add_doc(self, data, batch_size=64, save_every=10, num_workers=1):
+        # The documents are embedded in chunks of save_every batches, and the index is saved after each chunk
+        chunk_size = batch_size * save_every
 
         print(f"[+] Adding {len(data)} documents to index")
 
-        # document_text is all the data that wasen't already added (present on self.ids)
-        document_data = data[~data["id"].isin(self.ids)]["text"].values
-        print(f"[INFO] {len(data) - len(document_data)} were already added, adding the remaining {len(document_data)} ({round(len(document_data)/len(data)*100, 2)}%)")
-        ids_data = data[~data["id"].isin(self.ids)]["id"]
+        # document_text is all the data that wasen't already added (present on the id table)
+        new = ~self.id_table.contains(data["id"].values)
+        document_data = data[new]["text"].values
+        print(
+            f"[INFO] {len(data) - len(document_data)} were already added, adding the remaining {len(document_data)} "
+            f"({round(len(document_data) / len(data) * 100, 2)}%)"
+        )
+        ids_data = data[new]["id"].values
         del data
         gc.collect()
 
-        for i in tqdm(range(0, len(document_data), batch_size), desc="Adding documents to index", unit="batch"):
-            # Add embeddings
-            self.index.add(self.model.encode(document_data[i : i + batch_size]))
+        # Encoding processes
+        pool = None
+        if num_workers > 1:
+            # Split the threads (OMP_NUM_THREADS if set, all the cores otherwise) between the worker processes, so
+            # they don't compete for the cores. The workers read the variable when they start
+            omp_num_threads = os.environ.get("OMP_NUM_THREADS")
+            threads = int(omp_num_threads or os.cpu_count())
+            os.environ["OMP_NUM_THREADS"] = str(max(1, threads // num_workers))
+            try:
+                pool = self.model.start_multi_process_pool(["cpu"] * num_workers)
+            finally:
+                if omp_num_threads is None:
+                    del os.environ["OMP_NUM_THREADS"]
+                else:
+                    os.environ["OMP_NUM_THREADS"] = omp_num_threads
+
+        # Adding to the index and saving run on a thread, while the next chunk is encoded
+        queue = Queue(maxsize=2)
+        self.writer_error = None
+        writer = threading.Thread(target=self.write_embeddings, args=(queue,))
+        writer.start()
+
+        start_time = time.time()
+        progress = tqdm(total=len(document_data), desc="Adding documents to index", unit="doc")
+        try:
+            for i in range(0, len(document_data), chunk_size):
+                if self.writer_error is not None:
+                    break
+                embeddings = self.encode(document_data[i : i + chunk_size], batch_size, pool)
+                queue.put((embeddings, ids_data[i : i + chunk_size]))
+
+                progress.update(len(embeddings))
+                progress.set_postfix(docs_per_second=f"{progress.n / (time.time() - start_time):.1f}")
+        finally:
+            queue.put(None)
+            writer.join()
+            progress.close()
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
+
+        if self.writer_error is not None:
+            raise self.writer_error
+
+        elapsed = time.time() - start_time
+        print(
+            f"[+] Added {len(document_data)} documents in {elapsed:.0f} seconds "
+            f"({len(document_data) / max(elapsed, 1e-9):.1f} documents/s)"
+        )
+
+    def replace_doc(self, data, batch_size=64):
+        # The documents already in the index (e.g. updated papers) are embedded again and their vectors overwritten
+        # in place, so they keep their labels and the flat index stays in the order of the id table
+        labels = self.id_table.labels(data["id"].values)
+        document_data = data["text"].values[labels >= 0]
+        labels = labels[labels >= 0]
+        if not len(labels):
+            return
 
-            # Add ids
-            self.ids.extend(ids_data.values[i : i + batch_size])
+        print(f"[+] Replacing {len(labels)} documents in index")
+        embeddings = self.encode(document_data, batch_size)
 
-            # Save index every save_every batches
-            if i % (batch_size * save_every) == 0 and i != 0:
-                self.save_index(data_dir)
+        self.switch_to_cpu()
+        # Position of every label in the flat index
+        id_map = faiss.vector_to_array(self.index.id_map)
+        order = np.argsort(id_map)
+        positions = order[np.searchsorted(id_map, labels, sorter=order)]
+
+        flat_index = faiss.downcast_index(self.index.index)
+        vectors = faiss.rev_swig_ptr(flat_index.get_xb(), flat_index.ntotal * flat_index.d)
+        vectors = vectors.reshape(flat_index.ntotal, flat_index.d)
+        vectors[positions] = embeddings
 
-        # Save index
         self.save_index(data_dir)
 
+    def encode(self, texts, batch_size, pool=None):
+        # Sort the texts by length, so every batch has texts of similar lengths and little padding
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        texts = [texts[i] for i in order]
+
+        if pool is not None:
+            # Every task of a worker is one batch of the sorted texts
+            embeddings = self.model.encode_multi_process(texts, pool, batch_size=batch_size, chunk_size=batch_size)
+        else:
+            embeddings = self.model.encode(texts, batch_size=batch_size)
+
+        # Back to the order of the documents, so the labels follow the order of the csv
+        return np.asarray(embeddings, dtype="float32")[np.argsort(order)]
+
+    def write_embeddings(self, queue):
+        while (item := queue.get()) is not None:
+            # After an error, the chunks are only consumed so the encoding loop doesn't block
+            if self.writer_error is not None:
+                continue
+            try:
+                embeddings, ids = item
+
+                # Add embeddings, labeled with their future rows in the id table
+                first_label = len(self.id_table) + len(self.pending_ids)
+                self.index.add_with_ids(embeddings, np.arange(first_label, first_label + len(ids)))
+
+                # Add ids
+                self.pending_ids.extend(ids)
+
+                # Save index
+                self.save_index(data_dir)
+            except Exception as e:
+                self.writer_error = e
+
     def load_index(self, index_path):
+        self.id_table = IdTable(join(index_path, "ids.bin"))
+        self.pending_ids = []
+
         if not os.path.exists(join(index_path, "index.faiss")):
             print(f"[+] Index not found on {index_path} folder.")
+            # Ids of a checkpoint whose index was never written
+            self.id_table.truncate(0)
             return
 
         print("[+] Loading index...")
@@ -75,29 +190,48 @@ class FaissIdx:
         # Load Index
         self.index = faiss.read_index(join(index_path, "index.faiss"))
 
-        # Load Ids
-        with open(join(index_path, "ids.pkl"), "rb") as f:
-            self.ids = pickle.load(f)
+        # Convert an index and ids.pkl from before the id table (e.g. from download_checkpoint.py)
+        if not isinstance(self.index, faiss.IndexIDMap2):
+            self.convert_index(index_path)
 
-        if len(self.ids) != self.index.ntotal:
-            print(f"[!] Number of ids ({len(self.ids)}) doesn't match number of documents in index ({self.index.ntotal})")
+        if len(self.id_table) != self.index.ntotal:
+            print(
+                f"[!] Number of ids ({len(self.id_table)}) doesn't match number of documents in index "
+                f"({self.index.ntotal})"
+            )
             self.resolve_incosistency()
 
-        print(f"[+] Index loaded successfully - Loaded {len(self.ids)} documents")
+        print(f"[+] Index loaded successfully - Loaded {len(self.id_table)} documents")
 
         # Convert index back to gpu
         if self.use_gpu:
             self.switch_to_gpu()
 
+    def convert_index(self, index_path, batch_size=100_000):
+        print("[+] Converting index and ids.pkl to IndexIDMap2 and id table")
+        with open(join(index_path, "ids.pkl"), "rb") as f:
+            ids = pickle.load(f)
+
+        flat_index = self.index
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(flat_index.d))
+        for i in range(0, flat_index.ntotal, batch_size):
+            vectors = flat_index.reconstruct_n(i, min(batch_size, flat_index.ntotal - i))
+            self.index.add_with_ids(vectors, np.arange(i, i + len(vectors)))
+
+        self.id_table.truncate(0)
+        self.pending_ids = list(ids)
+        self.save_index(index_path)
+
     def save_index(self, index_path):
         self.switch_to_cpu()
 
-        # Save Index
-        faiss.write_index(self.index, join(index_path, "index.faiss"))
+        # Append the new ids first: if the index isn't written, the extra ids are truncated on load
+        self.id_table.append(self.pending_ids)
+        self.pending_ids = []
 
-        # Save Ids
-        with open(join(index_path, "ids.pkl"), "wb") as f:
-            pickle.dump(self.ids, f)
+        # Save Index, replacing the previous one only once it's fully written
+        faiss.write_index(self.index, join(index_path, "index.faiss.tmp"))
+        os.replace(join(index_path, "index.faiss.tmp"), join(index_path, "index.faiss"))
 
         if self.use_gpu:
             self.switch_to_gpu()
@@ -107,20 +241,22 @@ class FaissIdx:
         self.index = faiss.index_cpu_to_gpu(res, 0, self.index)
 
     def switch_to_cpu(self):
-        self.index = faiss.index_gpu_to_cpu(index.index)
+        if self.use_gpu:
+            self.index = faiss.index_gpu_to_cpu(self.index)
 
     def resolve_incosistency(self):
         print("[+] Resolving inconsistency..")
         n_index = self.index.ntotal
-        n_ids = len(self.ids)
+        n_ids = len(self.id_table)
 
+        # The labels are the rows of the id table, so the documents of both up to the shortest one match
         if n_index > n_ids:
             print(f"[+] Removing {n_index - n_ids} documents from index")
-            removed = self.index.remove_ids(np.arange(n_ids, n_index))
+            removed = self.index.remove_ids(faiss.IDSelectorRange(n_ids, n_index))
             assert removed == n_index - n_ids
         elif n_index < n_ids:
-            print(f"[+] Removing {n_ids - n_index} ids from ids list")
-            self.ids = self.ids[:n_index]
+            print(f"[+] Removing {n_ids - n_index} ids from id table")
+            self.id_table.truncate(n_index)
         else:
             print("[+] No inconsistency found")
 
@@ -128,15 +264,26 @@ class FaissIdx:
         self.save_index(data_dir)
 
 
-# This will create the index given the arxiv_processed.csv file
+# This will create the index given the arxiv_processed.parquet (or .csv) file
 # If the index already exists, it will be loaded and any new documents present on the csv will be added to the index
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates the FAISS index by embedding all the papers")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Encoding processes, sharing the cores. Each one loads the model, so more use more memory. Defaults to 2",
+    )
+    parser.add_argument("--batch-size", type=int, default=64, help="Documents encoded at once. Defaults to 64")
+    parser.add_argument("--save-every", type=int, default=10, help="Batches between checkpoints. Defaults to 10")
+    args = parser.parse_args()
+
     # Load data
     print("[+] Loading data")
-    if not os.path.exists(join(data_dir, "arxiv_processed.csv")):
-        print(f"[!] File {join(data_dir, 'arxiv_processed.csv')} not found. Please download the data first")
+    if not os.path.exists(papers_path()) and not os.path.exists(papers_path(extension="csv")):
+        print(f"[!] File {papers_path()} not found. Please download the data first")
         exit()
-    data = pd.read_csv(join(data_dir, "arxiv_processed.csv"), dtype=str)
+    data = load_papers(["id", "title", "abstract"])
     print(f"[+] Loaded {len(data)} documents")
 
     # Initialize Faiss Index
@@ -152,7 +299,10 @@ if __name__ == "__main__":
     gc.collect()
 
     # Add documents to index
-    index.add_doc(data)
+    index.add_doc(data, batch_size=args.batch_size, save_every=args.save_every, num_workers=args.workers)
 
     # Save index
     index.save_index(data_dir)
+
+    # Rebuild the metadata store of the app, in the order of the index
+    build_metadata_store()
@@ -0,0 +1,72 @@
+import os
+from os.path import exists
+
+import numpy as np
+
+
+class IdTable:
+    """Append-only table of arXiv ids, memory-mapped from a file of fixed-width records.
+
+    The row of an id in the table is its integer id in the faiss index (IndexIDMap2), so the id of a search result
+    is self.ids[label]. Appending only writes the new records, and a partially written checkpoint is undone by
+    truncating the file to a whole number of records.
+    """
+
+    dtype = np.dtype("S32")
+
+    def __init__(self, path):
+        self.path = path
+        if not exists(path):
+            open(path, "wb").close()
+        # The partial record of an interrupted checkpoint is removed, so the next records are appended after the
+        # whole ones
+        size = os.path.getsize(path)
+        if size % self.dtype.itemsize:
+            os.truncate(path, size - size % self.dtype.itemsize)
+        self._map()
+
+    def _map(self):
+        n = os.path.getsize(self.path) // self.dtype.itemsize
+        # np.memmap can't map an empty file
+        self.ids = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(n,)) if n else np.empty(0, self.dtype)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, labels):
+        return np.char.decode(self.ids[labels], "ascii")
+
+    def append(self, ids):
+        ids = np.asarray(ids, dtype=self.dtype)
+        with open(self.path, "ab") as f:
+            f.write(ids.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._map()
+
+    def truncate(self, n):
+        os.truncate(self.path, n * self.dtype.itemsize)
+        self._map()
+
+    def _sorted_ids(self):
+        # Sorted copy of the ids and their rows, built on the first lookup
+        if self._sorted is None:
+            order = np.argsort(self.ids, kind="stable")
+            self._sorted = (self.ids[order], order)
+        return self._sorted
+
+    def contains(self, ids):
+        sorted_ids, _ = self._sorted_ids()
+        ids = np.asarray(ids, dtype=self.dtype)
+        positions = np.searchsorted(sorted_ids, ids).clip(max=max(len(sorted_ids) - 1, 0))
+        return (sorted_ids[positions] == ids) if len(sorted_ids) else np.zeros(len(ids), bool)
+
+    def labels(self, ids):
+        """Returns the label of every id, -1 for the ids not in the table"""
+        sorted_ids, order = self._sorted_ids()
+        ids = np.asarray(ids, dtype=self.dtype)
+        found = self.contains(ids)
+        labels = np.full(len(ids), -1, dtype="int64")
+        labels[found] = order[np.searchsorted(sorted_ids, ids[found])]
+        return labels
@@ -0,0 +1,176 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import argparse
+import json
+from os.path import exists, join
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from tqdm import tqdm
+
+from config import data_dir
+from data_handling.id_table import IdTable
+from data_handling.papers import load_papers, parse_authors
+
+
+def metadata_path(testing=False):
+    return join(data_dir, f"metadata{'_test' if testing else ''}.arrow")
+
+
+class MetadataStore:
+    """Metadata of the papers displayed by the app, one row per faiss label, in a memory-mapped Arrow file.
+
+    Opening the store only maps the file, and the rows of the search results are fetched with one take, so neither
+    depends on the size of the corpus. The author lists and the categories are parsed when the store is built.
+    """
+
+    def __init__(self, path=metadata_path()):
+        self.table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        # All the distinct categories, for the filters of the app
+        self.categories = json.loads(self.table.schema.metadata[b"categories"])
+        # Built on the first filtered search
+        self._category_labels = None
+        self._dates = None
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def fetch(self, rows):
+        """Returns the metadata of the given rows (faiss labels) as dicts, skipping the missing results (-1)."""
+        rows = [int(row) for row in rows if row >= 0]
+        return self.table.take(pa.array(rows, type=pa.int64())).to_pylist()
+
+    @property
+    def category_labels(self):
+        """The labels of the papers of every category"""
+        if self._category_labels is None:
+            categories = self.table["categories"].combine_chunks()
+            labels = pd.Series(pc.list_parent_indices(categories).to_numpy())
+            groups = labels.groupby(pc.list_flatten(categories).to_numpy(zero_copy_only=False))
+            self._category_labels = {category: group.to_numpy() for category, group in groups}
+        return self._category_labels
+
+    @property
+    def dates(self):
+        """The update date of every paper, NaT for the missing ones"""
+        if self._dates is None:
+            self._dates = self.table["update_date"].to_numpy().astype("datetime64[D]")
+        return self._dates
+
+    def filter_mask(self, categories=None, start_date=None, end_date=None):
+        """Returns a boolean mask of the papers in any of the categories and updated between the dates (included), or
+        None without filters"""
+        if not categories and start_date is None and end_date is None:
+            return None
+
+        mask = np.ones(len(self), dtype=bool)
+        if categories:
+            mask[:] = False
+            for category in categories:
+                mask[self.category_labels.get(category, [])] = True
+        if start_date is not None:
+            mask &= self.dates >= np.datetime64(start_date, "D")
+        if end_date is not None:
+            mask &= self.dates <= np.datetime64(end_date, "D")
+        return mask
+
+    @staticmethod
+    def build(path, papers, ids=None):
+        """Writes the store of the papers, ordered like ids (the id table of the index) when given."""
+        if ids is not None:
+            # Row of every label in the papers, -1 for the papers no longer in the data
+            positions = pd.Index(papers["id"]).get_indexer(ids)
+            papers = papers.iloc[positions.clip(min=0)].reset_index(drop=True)
+            papers.loc[positions < 0, :] = None
+
+        table = papers_table(papers)
+        categories = {category for row in table["categories"].to_pylist() for category in row}
+        MetadataStore.write(path, [table], categories)
+
+    @staticmethod
+    def update(path, papers, labels, batch_size=100_000):
+        """Rewrites the store with the metadata of the papers at their labels: the rows of the updated papers are
+        replaced and the new papers are appended. The other rows are copied from the memory-mapped store in batches."""
+        store = MetadataStore(path)
+        new_table = papers_table(papers)
+        labels = np.asarray(labels, dtype="int64")
+        n = max(len(store), labels.max() + 1 if len(labels) else 0)
+
+        # Row of every label in the old and new rows, the labels missing from both are empty
+        rows = np.full(n, -1, dtype="int64")
+        rows[: len(store)] = np.arange(len(store))
+        rows[labels] = len(store) + np.arange(len(labels))
+        table = pa.concat_tables([store.table.replace_schema_metadata(None), new_table])
+
+        new_categories = {category for row in new_table["categories"].to_pylist() for category in row}
+        batches = (
+            table.take(pa.array(rows[i : i + batch_size], mask=rows[i : i + batch_size] < 0))
+            for i in range(0, n, batch_size)
+        )
+        MetadataStore.write(path, batches, set(store.categories) | new_categories)
+
+    @staticmethod
+    def write(path, tables, categories):
+        """Writes the tables to the store one at a time, with all their distinct categories in the schema metadata"""
+        metadata = {"categories": json.dumps(sorted(categories))}
+
+        # Written to a temporary file, so the app never maps a partial store
+        writer = None
+        n = 0
+        with pa.OSFile(path + ".tmp", "wb") as sink:
+            for table in tables:
+                table = table.replace_schema_metadata(metadata)
+                if writer is None:
+                    writer = pa.ipc.new_file(sink, table.schema)
+                writer.write_table(table)
+                n += table.num_rows
+            writer.close()
+        os.replace(path + ".tmp", path)
+
+        print(f"[+] Saved the metadata of {n} papers to {path}")
+
+
+def papers_table(papers):
+    # The author lists and the categories of the papers are parsed once, here
+    authors = [
+        [f"{author[1]} {author[0]}" for author in parse_authors(authors_parsed)] if authors_parsed is not None else []
+        for authors_parsed in tqdm(papers["authors_parsed"], desc="Parsing authors", unit="paper")
+    ]
+    categories = papers["categories"].astype("string").str.split()
+    return pa.table(
+        {
+            "id": pa.array(papers["id"], pa.string()),
+            "title": pa.array(papers["title"], pa.string()),
+            "abstract": pa.array(papers["abstract"], pa.string()),
+            "authors": pa.array(authors, pa.list_(pa.string())),
+            "categories": pa.array([list(c) if isinstance(c, list) else [] for c in categories], pa.list_(pa.string())),
+            "update_date": pa.array(papers["update_date"].astype("string"), pa.string()),
+        }
+    )
+
+
+def build_metadata_store(testing=False):
+    print("[+] Loading data")
+    papers = load_papers(["id", "title", "abstract", "authors_parsed", "categories", "update_date"], testing)
+
+    # The labels of the index are the rows of the id table, the test index follows the order of the test data
+    ids = None
+    if not testing and exists(join(data_dir, "ids.bin")):
+        id_table = IdTable(join(data_dir, "ids.bin"))
+        ids = id_table[:] if len(id_table) else None
+
+    MetadataStore.build(metadata_path(testing), papers, ids)
+
+
+# This will create the metadata store from the arxiv_processed.parquet (or .csv) file, in the order of the index
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the metadata store of the app")
+    parser.add_argument("--test", action="store_true", help="Use the test data")
+    args = parser.parse_args()
+
+    build_metadata_store(args.test)
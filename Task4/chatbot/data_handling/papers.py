@@ -0,0 +1,116 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import ast
+import io
+from os.path import exists, join
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from config import data_dir
+
+# Columns kept from the arXiv snapshot, categories are dictionary-encoded and update_date is a real date
+schema = pa.schema(
+    [
+        ("id", pa.string()),
+        ("abstract", pa.string()),
+        ("title", pa.string()),
+        ("doi", pa.string()),
+        ("categories", pa.dictionary(pa.int32(), pa.string())),
+        ("update_date", pa.date32()),
+        ("authors_parsed", pa.list_(pa.list_(pa.string()))),
+    ]
+)
+
+
+def papers_path(testing=False, extension="parquet"):
+    return join(data_dir, f"arxiv_processed{'_test' if testing else ''}.{extension}")
+
+
+def load_papers(columns=None, testing=False):
+    """Loads the processed papers, only reading the given columns.
+
+    The Parquet file is memory-mapped; the csv of older downloads (e.g. from download_checkpoint.py) is the fallback.
+    """
+    if exists(papers_path(testing)):
+        return pq.read_table(papers_path(testing), columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(papers_path(testing, "csv"), dtype=str, usecols=columns)
+
+
+def parse_authors(authors_parsed):
+    # Lists in the Parquet file, their repr in the csv
+    if isinstance(authors_parsed, str):
+        return ast.literal_eval(authors_parsed)
+    return authors_parsed
+
+
+def read_snapshot(path, block_size=64 << 20):
+    """Yields the papers of an arXiv metadata file (the Kaggle snapshot or a delta in the same JSON lines format) as
+    tables of the processed schema, parsed one block at a time by the multi-threaded Arrow json reader."""
+    # All the features:
+    # ['id', 'submitter', 'authors', 'title', 'comments', 'journal-ref', 'doi',
+    #'report-no', 'categories', 'license', 'abstract', 'versions',
+    # 'update_date', 'authors_parsed']
+    #
+    # But we only some (dates are read as strings, then cast)
+    json_schema = pa.schema(
+        [
+            pa.field(field.name, pa.string()) if field.name in ["categories", "update_date"] else field
+            for field in schema
+        ]
+    )
+    parse_options = pa_json.ParseOptions(explicit_schema=json_schema, unexpected_field_behavior="ignore")
+
+    progress = tqdm(total=os.path.getsize(path), desc="Processing data", unit="B", unit_scale=True)
+    with open(path, "rb") as f, progress:
+        rest = b""
+        while chunk := f.read(block_size):
+            progress.update(len(chunk))
+
+            # Parse whole lines only, the last partial line goes with the next block
+            block = rest + chunk
+            end = block.rfind(b"\n") + 1
+            block, rest = block[:end], block[end:]
+            if block:
+                yield process_block(block, parse_options)
+
+        if rest.strip():
+            yield process_block(rest, parse_options)
+
+
+def process_block(block, parse_options):
+    table = pa_json.read_json(io.BytesIO(block), parse_options=parse_options)
+
+    # Remove rows with empty abstracts, titles, or ids
+    keep = None
+    for column in ["abstract", "title", "id"]:
+        not_empty = pc.fill_null(pc.not_equal(table[column], ""), False)
+        keep = not_empty if keep is None else pc.and_(keep, not_empty)
+    table = table.filter(keep)
+
+    categories = pc.dictionary_encode(table["categories"])
+    table = table.set_column(table.schema.get_field_index("categories"), "categories", categories)
+    update_date = pc.cast(table["update_date"], pa.date32())
+    table = table.set_column(table.schema.get_field_index("update_date"), "update_date", update_date)
+    return table.select(schema.names).cast(schema)
+
+
+def update_papers(papers, testing=False, batch_size=100_000):
+    """Rewrites the processed papers with the given ones (a table of the processed schema) in place of their previous
+    versions, appended at the end. The other papers are copied in batches."""
+    path = papers_path(testing)
+    writer = pq.ParquetWriter(path + ".tmp", schema)
+    for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size):
+        table = pa.Table.from_batches([batch]).cast(schema)
+        writer.write_table(table.filter(pc.invert(pc.is_in(table["id"], value_set=papers["id"]))))
+    writer.write_table(papers)
+
+    writer.close()
+    os.replace(path + ".tmp", path)
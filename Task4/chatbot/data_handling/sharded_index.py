@@ -0,0 +1,414 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import argparse
+import json
+import time
+from os.path import exists, join
+
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+from config import data_dir, index_dir
+from data_handling.papers import load_papers
+
+
+def get_shard_keys(data, shard_by=None):
+    """Returns the shard of every paper: its update year, its archive (first category without the subject class,
+    e.g. cs or hep-th) or a single shard"""
+    if shard_by == "year":
+        # Dates in the Parquet file, strings in the csv
+        return data["update_date"].astype("string").str[:4].fillna("unknown").to_numpy(str)
+    if shard_by == "category":
+        archives = data["categories"].astype("string").str.split().str[0].str.split(".").str[0]
+        return archives.fillna("unknown").to_numpy(str)
+    return np.full(len(data), "all")
+
+
+def default_nlist(n):
+    # About 4 * sqrt(n) inverted lists, with at least 39 training points per list
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+class ShardedIndex:
+    """IVF-PQ index split in shards, each one written to its own file and memory-mapped when loaded.
+
+    Only the coarse quantizer and the PQ codebooks of a shard are read in memory; the inverted lists (the compressed
+    vectors and their ids) stay on disk and the OS pages in the lists probed by the queries. The ids stored in the
+    index are the positions of the papers in the flat index (and in arxiv_processed), so the results are used
+    like the ones of the flat index.
+
+    The full vectors are also written to a memory-mapped vectors.npy file: the rerank_factor * k best candidates of
+    the compressed search are re-ranked with their exact inner products, which recovers most of the recall lost by PQ
+    while reading only the pages of the candidates.
+    """
+
+    def __init__(self, index_dir=index_dir, nprobe=16, rerank_factor=4, shard_by=None):
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self.rerank_factor = rerank_factor
+        # How the papers were split (see get_shard_keys), so the new ones are added to the same shards
+        self.shard_by = shard_by
+        self.shards = {}
+        self.vectors = None
+
+    @property
+    def ntotal(self):
+        return sum(shard.ntotal for shard in self.shards.values())
+
+    @property
+    def d(self):
+        return next(iter(self.shards.values())).d
+
+    def build(
+        self,
+        flat_index,
+        shard_keys,
+        nlist=None,
+        m=64,
+        nbits=8,
+        hnsw_quantizer=False,
+        train_size=100_000,
+        batch_size=100_000,
+    ):
+        """Trains an IVF-PQ index per shard on a sample of its vectors and adds all the vectors of the flat index.
+
+        The vectors are read from the flat index in contiguous batches, so a memory-mapped flat index never has to
+        be fully in memory. Shards too small to train product quantization are kept as flat indexes.
+        """
+        d = flat_index.d
+        n = flat_index.ntotal
+        shard_keys = np.asarray(shard_keys)
+        if len(shard_keys) != n:
+            raise ValueError(f"Got {len(shard_keys)} shard keys for {n} vectors")
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.vectors = np.lib.format.open_memmap(join(self.index_dir, "vectors.npy"), "w+", "float32", (n, d))
+
+        # Pick the training sample of every shard
+        rng = np.random.default_rng(0)
+        train_positions = {}
+        for key in np.unique(shard_keys):
+            positions = np.flatnonzero(shard_keys == key)
+            train_positions[key] = np.sort(rng.choice(positions, min(len(positions), train_size), replace=False))
+
+        # Create and train the index of every shard
+        print(f"[+] Training {len(train_positions)} shards")
+        for key, positions in tqdm(train_positions.items(), desc="Training shards", unit="shard"):
+            # PQ needs 2^nbits training points per sub-quantizer, and IVF 39 per list
+            shard_size = int((shard_keys == key).sum())
+            if shard_size < max(2**nbits, 39) * 4:
+                self.shards[key] = faiss.IndexIDMap(faiss.IndexFlatIP(d))
+                continue
+
+            shard_nlist = nlist or default_nlist(shard_size)
+            description = f"IVF{shard_nlist}{'_HNSW32' if hnsw_quantizer else ''},PQ{m}x{nbits}"
+            index = faiss.index_factory(d, description, faiss.METRIC_INNER_PRODUCT)
+            index.train(self._reconstruct(flat_index, positions))
+            self.shards[key] = index
+
+        # Add all the vectors, routed to their shard, with their position as id
+        for start in tqdm(range(0, n, batch_size), desc="Adding vectors to shards", unit="batch"):
+            vectors = flat_index.reconstruct_n(start, min(batch_size, n - start))
+            self.vectors[start : start + len(vectors)] = vectors
+            keys = shard_keys[start : start + len(vectors)]
+            for key in np.unique(keys):
+                mask = keys == key
+                self.shards[key].add_with_ids(vectors[mask], np.flatnonzero(mask).astype("int64") + start)
+
+        self.vectors.flush()
+        self.save()
+
+    @staticmethod
+    def _reconstruct(flat_index, positions):
+        return np.vstack([flat_index.reconstruct(int(position)) for position in positions]).astype("float32")
+
+    def update(self, vectors, labels, shard_keys, batch_size=100_000):
+        """Replaces the vectors of the papers already in the index and adds the new ones, then saves the index.
+
+        An updated paper is removed from its shard and added to the one of its key, which may have changed (e.g. its
+        update year). The keys without a shard get a new flat shard. The new labels must follow the last row of
+        vectors.npy, like the ones appended to the flat index. The shards must be loaded without mmap.
+        """
+        vectors = np.asarray(vectors, dtype="float32")
+        labels = np.asarray(labels, dtype="int64")
+        shard_keys = np.asarray(shard_keys)
+        if self.vectors is None:
+            raise ValueError("The index has no vectors.npy, build it again")
+        n = len(self.vectors)
+        new_labels = np.sort(labels[labels >= n])
+        if not np.array_equal(new_labels, np.arange(n, n + len(new_labels))):
+            raise ValueError("The index is missing papers of the flat index, build it again")
+
+        replaced = labels[labels < n]
+        if len(replaced):
+            for index in self.shards.values():
+                index.remove_ids(replaced)
+
+        for key in np.unique(shard_keys):
+            if key not in self.shards:
+                self.shards[key] = faiss.IndexIDMap(faiss.IndexFlatIP(self.d))
+            mask = shard_keys == key
+            self.shards[key].add_with_ids(vectors[mask], labels[mask])
+
+        # The rows of the updated papers are written in place. With new papers the file is copied to a larger one,
+        # and the app keeps reading the one it mapped until it loads the new manifest
+        path = join(self.index_dir, "vectors.npy")
+        if len(new_labels):
+            rows = np.lib.format.open_memmap(path + ".tmp", "w+", "float32", (n + len(new_labels), self.d))
+            for start in range(0, n, batch_size):
+                end = min(start + batch_size, n)
+                rows[start:end] = self.vectors[start:end]
+        else:
+            rows = np.load(path, mmap_mode="r+")
+        rows[labels] = vectors
+        rows.flush()
+        del rows
+        if len(new_labels):
+            os.replace(path + ".tmp", path)
+        self.vectors = np.load(path, mmap_mode="r")
+
+        self.save()
+
+    def save(self):
+        manifest = {"shard_by": self.shard_by, "shards": {}}
+        for key, index in self.shards.items():
+            # Written to a temporary file, so the app never maps a partial shard
+            file_name = f"shard_{key}.faiss"
+            faiss.write_index(index, join(self.index_dir, file_name + ".tmp"))
+            os.replace(join(self.index_dir, file_name + ".tmp"), join(self.index_dir, file_name))
+            manifest["shards"][key] = {"file": file_name, "ntotal": int(index.ntotal)}
+
+        with open(join(self.index_dir, "manifest.json.tmp"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(join(self.index_dir, "manifest.json.tmp"), join(self.index_dir, "manifest.json"))
+
+        print(f"[+] Saved {len(self.shards)} shards with {self.ntotal} vectors to {self.index_dir}")
+
+    @classmethod
+    def exists(cls, index_dir=index_dir):
+        return exists(join(index_dir, "manifest.json"))
+
+    @classmethod
+    def load(cls, index_dir=index_dir, nprobe=16, rerank_factor=4, shards=None, mmap=True):
+        """Loads the shards of the index, memory-mapping their inverted lists unless mmap is False."""
+        with open(join(index_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        sharded_index = cls(index_dir, nprobe, rerank_factor, manifest.get("shard_by"))
+
+        for key, shard in manifest["shards"].items():
+            if shards is not None and key not in shards:
+                continue
+            flags = faiss.IO_FLAG_MMAP if mmap else 0
+            sharded_index.shards[key] = faiss.read_index(join(index_dir, shard["file"]), flags)
+
+        if exists(join(index_dir, "vectors.npy")):
+            sharded_index.vectors = np.load(join(index_dir, "vectors.npy"), mmap_mode="r")
+
+        sharded_index.set_nprobe(nprobe)
+        return sharded_index
+
+    def set_nprobe(self, nprobe):
+        self.nprobe = nprobe
+        for index in self.shards.values():
+            if (ivf := ivf_index(index)) is not None:
+                ivf.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        """The largest number of inverted lists of a shard, 0 if all the shards are flat"""
+        return max((shard.nlist for shard in map(ivf_index, self.shards.values()) if shard is not None), default=0)
+
+    def search(self, x, k, shards=None, selector=None, nprobe=None):
+        """Searches the shards and merges their results, like faiss.Index.search (distances are inner products).
+
+        Only the labels accepted by the faiss IDSelector selector are searched, when given. nprobe overrides the one
+        of the index for this search."""
+        x = np.asarray(x, dtype="float32").reshape(-1, self.d)
+        rerank = self.vectors is not None and self.rerank_factor > 1
+        scores, labels = self._search_shards(x, k * self.rerank_factor if rerank else k, shards, selector, nprobe)
+        if not rerank:
+            return scores, labels
+
+        # Re-rank the candidates with their exact vectors, read in order from the memory-mapped file
+        for row, (query, ids) in enumerate(zip(x, labels)):
+            candidates = np.sort(ids[ids >= 0])
+            scores[row, : len(candidates)] = self.vectors[candidates] @ query
+            labels[row, : len(candidates)] = candidates
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def _search_shards(self, x, k, shards=None, selector=None, nprobe=None):
+        distances, ids = [], []
+        for key, index in self.shards.items():
+            if shards is not None and key not in shards:
+                continue
+            if selector is None and nprobe is None:
+                shard_distances, shard_ids = index.search(x, k)
+            elif isinstance(index, faiss.IndexIDMap):
+                params = faiss.SearchParameters(sel=selector) if selector is not None else None
+                shard_distances, shard_ids = index.search(x, k, params=params)
+            else:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or self.nprobe)
+                shard_distances, shard_ids = index.search(x, k, params=params)
+            distances.append(shard_distances)
+            ids.append(shard_ids)
+
+        if not distances:
+            return np.full((len(x), k), -np.inf, dtype="float32"), np.full((len(x), k), -1, dtype="int64")
+
+        distances = np.hstack(distances)
+        ids = np.hstack(ids)
+        # Missing results (-1) have a distance of -inf for inner product indexes
+        distances[ids < 0] = -np.inf
+        order = np.argsort(-distances, axis=1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def ivf_index(index):
+    """Returns the IVF index of a shard, None for a flat shard"""
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+# Masks of at most this many labels are searched exactly, by scoring their vectors
+EXACT_SEARCH_LABELS = 10_000
+# Results fetched at most by the search without IDSelector of older faiss versions
+MAX_FALLBACK_FETCH = 4096
+
+
+def id_selector(mask):
+    """Returns an IDSelector of the labels set in the boolean mask, or None if faiss can't search with one (< 1.7.4)
+
+    The labels past the end of the mask, e.g. the ones added to the index after the metadata was built, are rejected.
+    """
+    if not hasattr(faiss, "IDSelectorTranslated"):
+        return None
+    # The padding bits of the last byte are 0, and faiss rejects the labels past the last byte
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(bitmap.nbytes, faiss.swig_ptr(bitmap))
+    # The selector doesn't own the bitmap
+    selector.referenced_objects = [bitmap]
+    return selector
+
+
+def exact_search(index, x, k, labels):
+    """Searches the given labels of a flat or sharded index by scoring their exact vectors, or returns None if the
+    sharded index has no vectors.npy"""
+    vectors = reconstruct(index, labels)
+    if vectors is None:
+        return None
+
+    x = np.asarray(x, dtype="float32").reshape(-1, index.d)
+    scores = np.full((len(x), k), -np.inf, dtype="float32")
+    result_labels = np.full((len(x), k), -1, dtype="int64")
+    if len(labels):
+        all_scores = x @ vectors.T
+        order = np.argsort(-all_scores, axis=1)[:, :k]
+        scores[:, : order.shape[1]] = np.take_along_axis(all_scores, order, axis=1)
+        result_labels[:, : order.shape[1]] = labels[order]
+    return scores, result_labels
+
+
+def filtered_search(index, x, k, mask=None):
+    """Searches a flat or sharded index for the k nearest neighbours among the labels set in the boolean mask.
+
+    Masks of few labels are searched exactly. Otherwise the mask is applied inside the search with an IDSelector, and
+    the sharded index probes more inverted lists until k results (or all the labels of the mask) are found. With older
+    faiss versions, the search of the (single) query fetches 4 times more results until k of them are in the mask, up
+    to MAX_FALLBACK_FETCH results.
+    """
+    if mask is None:
+        return index.search(x, k)
+
+    # The labels of the flat and sharded indexes are 0 to ntotal - 1
+    mask = np.asarray(mask, dtype=bool)[: index.ntotal]
+    num_labels = int(mask.sum())
+    if num_labels <= EXACT_SEARCH_LABELS:
+        results = exact_search(index, x, k, np.flatnonzero(mask))
+        if results is not None:
+            return results
+
+    selector = id_selector(mask)
+    if selector is not None:
+        if not isinstance(index, ShardedIndex):
+            return index.search(x, k, params=faiss.SearchParameters(sel=selector))
+
+        nprobe = index.nprobe
+        while True:
+            scores, labels = index.search(x, k, selector=selector, nprobe=nprobe)
+            if (labels >= 0).sum(axis=1).min() >= min(k, num_labels) or nprobe >= index.nlist:
+                return scores, labels
+            nprobe = min(nprobe * 4, index.nlist)
+
+    x = np.asarray(x, dtype="float32").reshape(1, -1)
+    n = min(index.ntotal, MAX_FALLBACK_FETCH)
+    fetch = min(k, n)
+    while True:
+        scores, labels = index.search(x, fetch)
+        keep = (labels[0] >= 0) & (labels[0] < len(mask)) & mask[labels[0].clip(min=0, max=len(mask) - 1)]
+        if keep.sum() >= k or fetch >= n:
+            break
+        fetch = min(fetch * 4, n)
+
+    scores, labels = scores[0][keep][:k], labels[0][keep][:k]
+    missing = k - len(labels)
+    return (
+        np.pad(scores, (0, missing), constant_values=-np.inf)[None],
+        np.pad(labels, (0, missing), constant_values=-1)[None],
+    )
+
+
+def reconstruct(index, labels):
+    """Returns the vectors of the labels stored by a flat or sharded index, or None if the sharded index has no
+    vectors.npy"""
+    labels = np.asarray(labels, dtype="int64")
+    if isinstance(index, ShardedIndex):
+        return None if index.vectors is None else np.asarray(index.vectors[labels])
+    if not len(labels):
+        return np.empty((0, index.d), dtype="float32")
+    return np.vstack([index.reconstruct(int(label)) for label in labels])
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Builds a sharded IVF-PQ index from the flat index")
+    parser.add_argument("--shard-by", choices=["year", "category"], default=None, help="Defaults to a single shard")
+    parser.add_argument("--nlist", type=int, default=None, help="Inverted lists per shard. Defaults to 4 * sqrt(n)")
+    parser.add_argument("--m", type=int, default=64, help="PQ sub-quantizers, must divide 768. Defaults to 64")
+    parser.add_argument("--nbits", type=int, default=8, help="Bits per PQ code. Defaults to 8")
+    parser.add_argument("--hnsw-quantizer", action="store_true", help="Use an HNSW coarse quantizer (HNSW+PQ)")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="Vectors read from the flat index at once")
+    parser.add_argument("--train-size", type=int, default=100_000, help="Training vectors per shard")
+    parser.add_argument("--test", action="store_true", help="Use the test index and data")
+    return parser.parse_args()
+
+
+# This will create the sharded index from the flat index.faiss and the arxiv_processed.parquet (or .csv) file
+if __name__ == "__main__":
+    args = get_args()
+    suffix = "_test" if args.test else ""
+
+    print("[+] Loading flat index")
+    id_map = faiss.read_index(join(data_dir, f"index{suffix}.faiss"), faiss.IO_FLAG_MMAP)
+    # The labels of the IndexIDMap2 built by create_index.py are the rows of the flat index
+    flat_index = faiss.downcast_index(id_map.index) if isinstance(id_map, faiss.IndexIDMap2) else id_map
+
+    print("[+] Loading data")
+    data = load_papers(["update_date", "categories"], args.test)
+
+    start_time = time.time()
+    ShardedIndex(index_dir=index_dir + suffix, shard_by=args.shard_by).build(
+        flat_index,
+        get_shard_keys(data, args.shard_by)[: flat_index.ntotal],
+        nlist=args.nlist,
+        m=args.m,
+        nbits=args.nbits,
+        hnsw_quantizer=args.hnsw_quantizer,
+        train_size=args.train_size,
+        batch_size=args.batch_size,
+    )
+    print(f"[+] Built the sharded index in {time.time() - start_time:.0f} seconds")
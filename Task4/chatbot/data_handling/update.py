@@ -0,0 +1,126 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import argparse
+import time
+from os.path import exists, join
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from config import data_dir, index_dir
+from data_handling.id_table import IdTable
+from data_handling.metadata_store import MetadataStore, metadata_path
+from data_handling.papers import papers_path, read_snapshot, schema, update_papers
+from data_handling.sharded_index import ShardedIndex, get_shard_keys, reconstruct
+
+
+def read_delta(path, since=None):
+    """Returns the papers of the metadata file updated on or after since, the last version of every paper only"""
+    tables = []
+    for table in read_snapshot(path):
+        if since is not None:
+            updated = pc.greater_equal(table["update_date"], pa.scalar(since, pa.date32()))
+            table = table.filter(pc.fill_null(updated, False))
+        tables.append(table)
+    papers = pa.concat_tables(tables).unify_dictionaries().combine_chunks().to_pandas()
+
+    # A delta file can have several versions of a paper
+    return papers.drop_duplicates("id", keep="last").reset_index(drop=True)
+
+
+def changed_papers(papers, id_table, store):
+    """Returns the mask of the papers that are new or whose update date differs from the one in the metadata store"""
+    labels = id_table.labels(papers["id"].values)
+    # Papers added to the index by an interrupted update aren't in the store yet
+    in_store = (labels >= 0) & (labels < len(store))
+    changed = ~in_store
+    stored_dates = store.dates[labels[in_store]]
+    changed[in_store] = stored_dates != papers["update_date"].values[in_store].astype("datetime64[D]")
+    return changed
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Adds the new and updated papers to the index and the metadata store")
+    parser.add_argument(
+        "--source",
+        default=join(data_dir, "arxiv.json"),
+        help="arXiv metadata file (a snapshot or a delta, in JSON lines). Defaults to data/arxiv.json",
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Only read the papers updated on or after this date (YYYY-MM-DD). Defaults to the last update date of "
+        "the metadata store",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Encoding processes. Defaults to 1")
+    parser.add_argument("--batch-size", type=int, default=64, help="Documents encoded at once. Defaults to 64")
+    return parser.parse_args()
+
+
+# This will add the papers of an arXiv metadata file that are new or were updated since the index was built: only
+# they are embedded, the vectors of the updated papers are replaced and the new ones are appended to the index, the
+# processed data and the metadata store
+if __name__ == "__main__":
+    args = get_args()
+
+    if not exists(join(data_dir, "index.faiss")) or not exists(metadata_path()) or not exists(papers_path()):
+        print("[!] Index, metadata store or processed data not found. Run make download and make create_index first")
+        exit()
+    if not exists(args.source):
+        print(f"[!] File {args.source} not found")
+        exit()
+
+    start_time = time.time()
+    id_table = IdTable(join(data_dir, "ids.bin"))
+    store = MetadataStore(metadata_path())
+
+    since = args.since
+    if since is None:
+        dates = store.dates[~np.isnat(store.dates)]
+        since = dates.max().astype(object) if len(dates) else None
+
+    print(f"[+] Reading the papers updated since {since} from {args.source}")
+    papers = read_delta(args.source, since)
+    papers = papers[changed_papers(papers, id_table, store)].reset_index(drop=True)
+    if not len(papers):
+        print("[+] No new or updated papers")
+        exit()
+    n_updated = int(id_table.contains(papers["id"].values).sum())
+    print(f"[+] {len(papers) - n_updated} new and {n_updated} updated papers")
+
+    # Imported here, so a run without changes doesn't load the model
+    from data_handling.create_index import FaissIdx
+
+    index = FaissIdx(use_gpu=False)
+    index.load_index(data_dir)
+
+    data = papers[["id"]].copy()
+    data["text"] = papers["title"] + "\n " + papers["abstract"]
+
+    # Updated papers keep their labels, new ones are appended with a single checkpoint
+    index.replace_doc(data, batch_size=args.batch_size)
+    new = ~index.id_table.contains(data["id"].values)
+    if new.any():
+        # A single chunk, saved by add_doc
+        save_every = len(data) // args.batch_size + 1
+        index.add_doc(data, batch_size=args.batch_size, save_every=save_every, num_workers=args.workers)
+
+    print("[+] Updating processed data")
+    update_papers(pa.Table.from_pandas(papers, schema=schema, preserve_index=False))
+
+    labels = index.id_table.labels(papers["id"].values)
+    print("[+] Updating metadata store")
+    MetadataStore.update(metadata_path(), papers, labels)
+
+    if ShardedIndex.exists(index_dir):
+        # The vectors embedded above are read back from the flat index
+        print("[+] Updating sharded index")
+        sharded_index = ShardedIndex.load(index_dir, mmap=False)
+        sharded_index.update(reconstruct(index.index, labels), labels, get_shard_keys(papers, sharded_index.shard_by))
+
+    elapsed = time.time() - start_time
+    print(f"[+] Added {int(new.sum())} and replaced {len(papers) - int(new.sum())} papers in {elapsed:.0f} seconds")
@@ -0,0 +1,92 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from config import encoder_backend, encoder_threads
+
+model_name = "all-mpnet-base-v2"
+
+
+def load_encoder(backend=encoder_backend, threads=encoder_threads):
+    """Loads the encoder of the queries, with the same model as the index.
+
+    Backends: "cuda" (the original model on the GPU), "cpu" (the original model), "int8" (the linear layers, most of
+    the compute, dynamically quantized to int8 on the CPU) and "auto" (cuda if available, int8 otherwise).
+    """
+    if backend == "auto":
+        backend = "cuda" if torch.cuda.is_available() else "int8"
+    if backend == "cuda":
+        return SentenceTransformer(model_name, device="cuda")
+    if backend not in ["cpu", "int8"]:
+        raise ValueError(f"Unknown encoder backend {backend}")
+
+    # Pin the number of torch threads: a single query doesn't scale past a few, and they would compete with the
+    # other threads of the app
+    torch.set_num_threads(threads or max(1, min(4, os.cpu_count())))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already set, it can only be set before the first parallel work
+        pass
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def cosine_agreement(embeddings, reference_embeddings):
+    """Returns the cosine similarity of every embedding to the reference one of the same text"""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    reference_embeddings = reference_embeddings / np.linalg.norm(reference_embeddings, axis=1, keepdims=True)
+    return (embeddings * reference_embeddings).sum(axis=1)
+
+
+def single_query_latency(model, queries):
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        model.encode(query)
+        latencies.append(time.perf_counter() - start_time)
+    return np.median(latencies) * 1000
+
+
+# This will compare the CPU encoders to the original model: the cosine similarity of their embeddings (which must stay
+# close to 1 to search the existing index) and their single-query latency
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the CPU encoders to the original model")
+    parser.add_argument("--threads", type=int, default=encoder_threads, help="Torch threads. Defaults to up to 4")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Minimum cosine similarity. Defaults to 0.99")
+    args = parser.parse_args()
+
+    queries = [
+        "graph neural networks for molecule property prediction",
+        "dark matter detection with liquid xenon",
+        "Attention is all you need",
+        "convergence of stochastic gradient descent for non-convex objectives",
+        "black hole information paradox",
+        "sparse mixture of experts language models",
+        "quantum error correction with surface codes",
+        "Bayesian optimization of hyperparameters",
+    ]
+    # Papers are encoded as title + abstract, like in the index
+    documents = [f"{query}\n {' '.join([query] * 20)}" for query in queries]
+
+    reference = load_encoder("cpu", args.threads)
+    reference_embeddings = reference.encode(queries + documents)
+    print(f"[+] cpu  latency={single_query_latency(reference, queries):.1f} ms")
+
+    int8 = load_encoder("int8", args.threads)
+    agreement = cosine_agreement(int8.encode(queries + documents), reference_embeddings)
+    print(
+        f"[+] int8 latency={single_query_latency(int8, queries):.1f} ms "
+        f"cosine min={agreement.min():.4f} mean={agreement.mean():.4f}"
+    )
+
+    if agreement.min() < args.min_cosine:
+        print(f"[!] The int8 embeddings are too far from the original ones (< {args.min_cosine})")
+        exit(1)
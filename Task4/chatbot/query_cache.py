@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+
+
+class QueryCache:
+    """Bounded LRU cache of search results, shared by all the sessions of the app.
+
+    Identical queries computed at the same time are coalesced: the first one computes the results and the others wait
+    for them (single-flight). The cache is cleared when the version of the index changes.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        # Futures of the results being computed, by key
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def check_version(self, version):
+        """Clears the cache if the version of the index changed, and returns whether it did"""
+        with self.lock:
+            if version == self.version:
+                return False
+            self.version = version
+            self.results.clear()
+            # The queries computed with the previous index aren't coalesced with the new ones
+            self.in_flight.clear()
+            return True
+
+    def get(self, key, compute):
+        """Returns the cached results of key, computing them with compute() on a miss"""
+        while True:
+            with self.lock:
+                if key in self.results:
+                    self.hits += 1
+                    self.results.move_to_end(key)
+                    return self.results[key]
+
+                future = self.in_flight.get(key)
+                owner = future is None
+                if owner:
+                    self.misses += 1
+                    future = self.in_flight[key] = Future()
+                    version = self.version
+                else:
+                    self.coalesced += 1
+
+            if owner:
+                break
+
+            # Another session is computing the same results
+            try:
+                return future.result()
+            except CancelledError:
+                # It was interrupted, the results are computed again
+                continue
+
+        try:
+            results = compute()
+        except BaseException as e:
+            with self.lock:
+                self._done(key, future)
+            # An interruption of this session (e.g. a Streamlit rerun or stop) isn't raised in the waiting ones
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+
+        with self.lock:
+            self._done(key, future)
+            # Results of an index replaced during the computation aren't cached
+            if version == self.version:
+                self.results[key] = results
+                if len(self.results) > self.max_size:
+                    self.results.popitem(last=False)
+        future.set_result(results)
+        return results
+
+    def _done(self, key, future):
+        # The key may be computed again with a new index already
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / requests if requests else 0.0
+
+    def __len__(self):
+        return len(self.results)
+
+    def __str__(self):
+        return (
+            f"{self.hit_rate:.0%} hit rate ({self.hits} hits, {self.coalesced} coalesced, {self.misses} misses, "
+            f"{len(self)}/{self.max_size} cached)"
+        )
@@ -0,0 +1,174 @@
+import argparse
+import json
+import time
+from os.path import join
+
+import faiss
+import numpy as np
+
+from config import data_dir, index_dir
+from data_handling.id_table import IdTable
+from data_handling.sharded_index import ShardedIndex, reconstruct
+
+
+def load_index():
+    # The sharded index when it was built, the flat index otherwise (like the app). Its labels are the rows of the
+    # id table
+    if ShardedIndex.exists(index_dir):
+        return ShardedIndex.load(index_dir)
+    return faiss.read_index(join(data_dir, "index.faiss"))
+
+
+def tag_centroid(model, user_tags):
+    """Returns the mean of the normalized embeddings of the user tags (key + values, as in tags.json)"""
+    texts = [f"{key} - {','.join(value)}" for key, value in user_tags.items()]
+    embeddings = model.encode(texts).reshape(len(user_tags), -1)
+    return normalize(embeddings).mean(axis=0)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class Recommender:
+    """Recommends the papers closest to the ones liked by every user, for many users at once.
+
+    A user is a dict with the arXiv ids of their papers ("papers"), optionally the centroid of their user tags
+    ("tag_centroid", see tag_centroid) and the arXiv ids to exclude, e.g. the ones already recommended ("exclude").
+    The vectors of the papers are read from the index instead of being encoded again, and the queries of a batch of
+    users are searched with a single index.search.
+    """
+
+    def __init__(self, index, id_table, tag_weight=0.5, batch_size=1024):
+        self.index = index
+        self.id_table = id_table
+        # Weight of the tag centroid in the query of a user with papers and tags
+        self.tag_weight = tag_weight
+        self.batch_size = batch_size
+
+    def queries(self, users):
+        """Returns the query of every user (zeros for the users without known papers nor tags) and the labels of
+        their papers"""
+        seeds = [self.id_table.labels(user.get("papers", [])) for user in users]
+        seeds = [labels[labels >= 0] for labels in seeds]
+
+        # The vectors of all the papers of the batch, reconstructed once
+        all_labels, inverse = np.unique(np.concatenate(seeds + [np.empty(0, "int64")]), return_inverse=True)
+        vectors = reconstruct(self.index, all_labels)
+        if vectors is None:
+            raise ValueError("The index doesn't store its vectors, build the sharded index again or use the flat index")
+        vectors = normalize(vectors)
+
+        queries = np.zeros((len(users), vectors.shape[1]), dtype="float32")
+        offsets = np.cumsum([0] + [len(labels) for labels in seeds])
+        for i, user in enumerate(users):
+            if len(seeds[i]):
+                queries[i] = vectors[inverse[offsets[i] : offsets[i + 1]]].mean(axis=0)
+            if user.get("tag_centroid") is not None:
+                tags = normalize(np.asarray(user["tag_centroid"], dtype="float32"))
+                if len(seeds[i]):
+                    queries[i] = (1 - self.tag_weight) * normalize(queries[i]) + self.tag_weight * tags
+                else:
+                    queries[i] = tags
+        return normalize(queries), seeds
+
+    def recommend(self, users, k=10):
+        """Returns the k recommended (arxiv id, score) of every user, best first"""
+        recommendations = []
+        for start in range(0, len(users), self.batch_size):
+            recommendations.extend(self._recommend_batch(users[start : start + self.batch_size], k))
+        return recommendations
+
+    def _recommend_batch(self, users, k):
+        queries, seeds = self.queries(users)
+        excluded = [
+            np.concatenate([labels, self.id_table.labels(user.get("exclude", []))])
+            for labels, user in zip(seeds, users)
+        ]
+        excluded = [labels[labels >= 0] for labels in excluded]
+        counts = np.array([len(labels) for labels in excluded])
+
+        # The batch is searched with enough results for the median user to keep k after the exclusions. The users
+        # left with fewer are searched again, grouped by the next power of 2 of their number of exclusions, so the few
+        # users excluding many papers don't enlarge the search of all the others
+        fetch = k + int(np.median(counts))
+        scores, labels = self._search(queries, excluded, k, fetch)
+        short = np.flatnonzero(((labels >= 0).sum(axis=1) < k) & (counts > fetch - k))
+        buckets = 2 ** np.ceil(np.log2(counts[short])).astype("int64")
+        for bucket in np.unique(buckets):
+            rows = short[buckets == bucket]
+            scores[rows], labels[rows] = self._search(
+                queries[rows], [excluded[row] for row in rows], k, k + int(bucket)
+            )
+
+        recommendations = []
+        for i, user in enumerate(users):
+            if not len(seeds[i]) and user.get("tag_centroid") is None:
+                recommendations.append([])
+                continue
+            keep = labels[i] >= 0
+            recommendations.append(list(zip(self.id_table[labels[i][keep]].tolist(), scores[i][keep].tolist())))
+        return recommendations
+
+    def _search(self, queries, excluded, k, fetch):
+        """Returns the k best results of every query that aren't excluded, searching fetch results (-1 for the
+        missing ones)"""
+        scores, labels = self.index.search(queries, fetch)
+
+        # Excluded (user, label) pairs, encoded as a single integer to be looked up at once
+        n = max(len(self.id_table), self.index.ntotal) + 1
+        excluded_keys = np.concatenate(
+            [row * n + user_labels for row, user_labels in enumerate(excluded)] + [np.empty(0, "int64")]
+        )
+        keys = np.arange(len(queries))[:, None] * n + labels
+        drop = (labels < 0) | np.isin(keys, excluded_keys)
+
+        # The first k results kept by every user, in the order of the search
+        order = np.argsort(drop, axis=1, kind="stable")[:, :k]
+        scores, labels, drop = (np.take_along_axis(array, order, axis=1) for array in (scores, labels, drop))
+        labels[drop] = -1
+        return scores, labels
+
+
+# This will compute the recommendations of many users at once, e.g. for nightly digests. The users file is a json of
+# {user: {"papers": [arxiv ids], "tags": {tag: [values]}, "exclude": [arxiv ids]}}, all the keys being optional
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommends papers similar to the ones of every user")
+    parser.add_argument("users", help="Json file of the users")
+    parser.add_argument("--output", default="recommendations.json", help="Defaults to recommendations.json")
+    parser.add_argument("--k", type=int, default=10, help="Recommendations per user. Defaults to 10")
+    parser.add_argument("--tag-weight", type=float, default=0.5, help="Weight of the user tags. Defaults to 0.5")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Users searched at once. Defaults to 1024")
+    args = parser.parse_args()
+
+    with open(args.users) as f:
+        users = json.load(f)
+
+    print("[+] Loading index")
+    recommender = Recommender(load_index(), IdTable(join(data_dir, "ids.bin")), args.tag_weight, args.batch_size)
+
+    # Only the user tags are encoded, the model is loaded if any user has some
+    if any(user.get("tags") for user in users.values()):
+        from encoder import load_encoder
+
+        model = load_encoder()
+        for user in users.values():
+            if user.get("tags"):
+                user["tag_centroid"] = tag_centroid(model, user["tags"])
+
+    start_time = time.time()
+    recommendations = recommender.recommend(list(users.values()), args.k)
+    elapsed = time.time() - start_time
+    print(
+        f"[+] Recommended papers to {len(users)} users in {elapsed:.1f} seconds "
+        f"({len(users) / max(elapsed, 1e-9):.0f} users/s)"
+    )
+
+    with open(args.output, "w") as f:
+        recommendations = {
+            name: [{"id": arxiv_id, "score": score} for arxiv_id, score in user]
+            for name, user in zip(users, recommendations)
+        }
+        json.dump(recommendations, f, indent=2)
+    print(f"[+] Saved the recommendations to {args.output}")
@@ -0,0 +1,20 @@
+import pytest
+from bot.client.batch_generator import group_sequences
+
+
+def test_group_sequences_respects_max_sequences():
+    assert group_sequences([10, 10, 10, 10, 10], max_new_tokens=10, n_ctx=1000, n_seq_max=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_group_sequences_respects_context_window():
+    # Each prompt needs its tokens plus the tokens of its answer.
+    assert group_sequences([100, 200, 50, 200], max_new_tokens=100, n_ctx=500, n_seq_max=4) == [[0, 1], [2, 3]]
+
+
+def test_group_sequences_caps_answers_to_context_window():
+    assert group_sequences([400, 400], max_new_tokens=512, n_ctx=512, n_seq_max=4) == [[0], [1]]
+
+
+def test_group_sequences_with_prompt_exceeding_context_window():
+    with pytest.raises(ValueError):
+        group_sequences([10, 512], max_new_tokens=10, n_ctx=512, n_seq_max=4)
@@ -0,0 +1,55 @@
+import itertools
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from bot.client.draft_model import SpeculativeDraftModel, merge_stats
+
+
+class CountingLlama:
+    """
+    Stand-in for the draft `Llama` that proposes 100, 101, 102, ... after any input.
+    """
+
+    _model = type("Model", (), {"vocab": None})()
+
+    def generate(self, tokens, **kwargs):
+        return itertools.count(100)
+
+
+@pytest.fixture
+def draft_model():
+    with patch("bot.client.draft_model.llama_cpp.llama_vocab_is_eog", return_value=False):
+        yield SpeculativeDraftModel(CountingLlama(), num_draft_tokens=4)
+
+
+def test_draft_proposes_num_draft_tokens(draft_model):
+    draft = draft_model(np.array([1, 2, 3], dtype=np.intc))
+    assert draft.tolist() == [100, 101, 102, 103]
+
+
+def test_acceptance_rate(draft_model):
+    draft_model(np.array([1, 2, 3], dtype=np.intc))
+    # The main model accepted the first two drafted tokens, then sampled 7.
+    draft_model(np.array([1, 2, 3, 100, 101, 7], dtype=np.intc))
+    # It accepted the whole draft, then sampled 8.
+    draft_model(np.array([1, 2, 3, 100, 101, 7, 100, 101, 102, 103, 8], dtype=np.intc))
+    assert draft_model.stats() == {"drafted": 8, "accepted": 6, "acceptance_rate": 0.75}
+
+
+def test_new_completion_is_not_counted(draft_model):
+    draft_model(np.array([1, 2, 3], dtype=np.intc))
+    draft_model(np.array([4, 5], dtype=np.intc))
+    assert draft_model.stats() == {"drafted": 0, "accepted": 0, "acceptance_rate": 0.0}
+
+
+def test_merge_stats(draft_model):
+    other_draft_model = SpeculativeDraftModel(CountingLlama(), num_draft_tokens=4)
+    draft_model.drafted, draft_model.accepted = 8, 6
+    other_draft_model.drafted, other_draft_model.accepted = 4, 0
+    assert merge_stats([draft_model, other_draft_model]) == {"drafted": 12, "accepted": 6, "acceptance_rate": 0.5}
+
+
+def test_invalid_num_draft_tokens():
+    with pytest.raises(ValueError):
+        SpeculativeDraftModel(CountingLlama(), num_draft_tokens=0)
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from unittest.mock import patch
 
 import pytest
@@ -22,6 +23,25 @@ def model_settings():
     return model_setting
 
 
+class SlowLlama:
+    """
+    Stand-in for `Llama` whose completions take a fixed time, releasing the GIL like llama.cpp does.
+    """
+
+    metadata = {}
+    chat_handler = None
+
+    def __init__(self, model_path: str, **kwargs):
+        self.config = kwargs
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def create_chat_completion(self, messages, max_tokens, **kwargs):
+        time.sleep(0.2)
+        return {"choices": [{"message": {"content": messages[-1]["content"]}}]}
+
+
 @pytest.fixture
 def lamacpp_client(mock_models_folder, model_settings, cpu_config):
     with patch.object(model_settings, "config", cpu_config):
@@ -34,6 +54,22 @@ def test_generate_answer(lamacpp_client):
     assert "rome" in generated_answer.lower()
 
 
+def test_prompt_cache_reuses_shared_prefix(lamacpp_client):
+    lamacpp_client.generate_answer(lamacpp_client.generate_ctx_prompt("What is Rome?", "Rome is in Italy."), 5)
+    lamacpp_client.generate_answer(lamacpp_client.generate_qa_prompt("What is the capital city of Italy?"), 5)
+    lamacpp_client.generate_answer(lamacpp_client.generate_ctx_prompt("What is Milan?", "Milan is in Italy."), 5)
+    stats = lamacpp_client.prompt_cache.stats()
+    assert stats["hits"] >= 1
+    assert 0 < stats["size_bytes"] <= lamacpp_client.prompt_cache.capacity_bytes
+
+
+def test_generate_answers_batch(lamacpp_client):
+    prompts = ["What is the capital city of Italy?", "Which city is the capital of Italy?", "Italy's capital is?"]
+    generated_answers = lamacpp_client.generate_answers_batch(prompts, max_new_tokens=10)
+    assert len(generated_answers) == len(prompts)
+    assert all("rome" in answer.lower() for answer in generated_answers)
+
+
 def test_generate_stream_answer(lamacpp_client):
     prompt = "What is the capital city of Italy?"
     generated_answer = lamacpp_client.stream_answer(prompt, max_new_tokens=10)
@@ -75,3 +111,39 @@ async def test_async_start_answer_iterator_streamer(lamacpp_client):
     for output in stream[0]:
         generated_answer += output["choices"][0]["delta"].get("content", "")
     assert "rome" in generated_answer.lower()
+
+
+@pytest.mark.asyncio
+async def test_async_generate_answer_runs_concurrently(mock_models_folder, model_settings, cpu_config):
+    with (
+        patch.object(model_settings, "config", cpu_config),
+        patch.object(LamaCppClient, "_auto_download"),
+        patch("bot.client.lama_cpp_client.Llama", SlowLlama),
+    ):
+        client = LamaCppClient(mock_models_folder, model_settings, parallelism=4)
+
+    start_time = time.perf_counter()
+    answers = await asyncio.gather(*[client.async_generate_answer(f"prompt {idx}") for idx in range(4)])
+    took = time.perf_counter() - start_time
+
+    assert answers == [f"prompt {idx}" for idx in range(4)]
+    assert took < 0.4
+    assert client._llm_pool.qsize() == 4
+    assert client.llm.config["n_threads"] == 1
+
+
+def test_invalid_parallelism(mock_models_folder, model_settings):
+    with pytest.raises(ValueError):
+        LamaCppClient(mock_models_folder, model_settings, parallelism=0)
+
+
+def test_generate_answers_batch_falls_back_without_chat_template(mock_models_folder, model_settings, cpu_config):
+    with (
+        patch.object(model_settings, "config", cpu_config),
+        patch.object(LamaCppClient, "_auto_download"),
+        patch("bot.client.lama_cpp_client.Llama", SlowLlama),
+    ):
+        client = LamaCppClient(mock_models_folder, model_settings)
+
+    assert client.generate_answers_batch(["prompt 0", "prompt 1"]) == ["prompt 0", "prompt 1"]
+    assert not client._batch_generator.is_supported
@@ -0,0 +1,119 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+from bot.client.model_pool import ModelPool
+from bot.model.model_registry import Model, get_model_settings
+
+
+class FakeClient:
+    """
+    Stand-in for `LamaCppClient` that doesn't load any weights.
+    """
+
+    def __init__(self, model_folder, model_settings, **kwargs):
+        self.model_path = model_folder / model_settings.file_name
+        self.draft_model_settings = None
+        self.llm_instances = [object()]
+        self.kwargs = kwargs
+
+    def draft_stats(self):
+        return {"drafted": 8, "accepted": 6, "acceptance_rate": 0.75} if "draft_model_settings" in self.kwargs else None
+
+
+@pytest.fixture
+def model_pool(mock_models_folder):
+    # Every model has 100 bytes of weights and 10 bytes of context buffers.
+    for model in Model:
+        (mock_models_folder / get_model_settings(model.value).file_name).write_bytes(b"0" * 100)
+    with (
+        patch("bot.client.model_pool.LamaCppClient", FakeClient),
+        patch("bot.client.model_pool.estimate_context_bytes", return_value=10),
+    ):
+        yield ModelPool(mock_models_folder, capacity_bytes=250, parallelism=2)
+
+
+def test_get_loads_model_once(model_pool):
+    client = model_pool.get(Model.LLAMA_3_2_one)
+    assert model_pool.get(Model.LLAMA_3_2_one.value) is client
+    assert client.kwargs == {"parallelism": 2}
+    stats = model_pool.stats()[Model.LLAMA_3_2_one.value]
+    assert stats["hits"] == 2
+    assert stats["resident_bytes"] == 110
+
+
+def test_stats_include_draft_stats(model_pool):
+    model_pool.get(Model.LLAMA_3_2_one)
+    model_pool.get(Model.LLAMA_3_2_three, draft_model_settings=get_model_settings(Model.LLAMA_3_2_one.value))
+    stats = model_pool.stats()
+    assert "acceptance_rate" not in stats[Model.LLAMA_3_2_one.value]
+    assert stats[Model.LLAMA_3_2_three.value]["acceptance_rate"] == 0.75
+
+
+def test_get_with_other_client_kwargs(model_pool):
+    model_pool.get(Model.LLAMA_3_2_three)
+    with pytest.raises(ValueError):
+        model_pool.get(Model.LLAMA_3_2_three, draft_model_settings=get_model_settings(Model.LLAMA_3_2_one.value))
+
+
+def test_load_does_not_block_other_models(model_pool):
+    model_pool.get(Model.LLAMA_3_2_one)
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    class SlowClient(FakeClient):
+        def __init__(self, *args, **kwargs):
+            loads.append(1)
+            started.set()
+            release.wait(10)
+            super().__init__(*args, **kwargs)
+
+    with patch("bot.client.model_pool.LamaCppClient", SlowClient):
+        clients = []
+        sessions = [
+            threading.Thread(target=lambda: clients.append(model_pool.get(Model.LLAMA_3_2_three)), daemon=True)
+            for _ in range(2)
+        ]
+        sessions[0].start()
+        started.wait(10)
+        sessions[1].start()
+
+        # A loaded model is served while the other one is loading.
+        other_session = threading.Thread(target=model_pool.get, args=(Model.LLAMA_3_2_one,), daemon=True)
+        other_session.start()
+        other_session.join(5)
+        assert not other_session.is_alive()
+        release.set()
+        for session in sessions:
+            session.join(10)
+
+    # The sessions asking for the same model shared its load.
+    assert loads == [1]
+    assert len(clients) == 2 and clients[0] is clients[1]
+
+
+def test_get_evicts_least_recently_used_model(model_pool):
+    model_pool.get(Model.LLAMA_3_2_one)
+    model_pool.get(Model.LLAMA_3_2_three)
+    model_pool.get(Model.LLAMA_3_2_one)
+    model_pool.get(Model.QWEN_2_5_THREE)
+    assert list(model_pool.stats()) == [Model.LLAMA_3_2_one.value, Model.QWEN_2_5_THREE.value]
+    assert model_pool.resident_bytes <= model_pool.capacity_bytes
+
+
+def test_get_loads_model_larger_than_capacity_alone(model_pool):
+    model_pool.capacity_bytes = 50
+    model_pool.get(Model.LLAMA_3_2_one)
+    model_pool.get(Model.LLAMA_3_2_three)
+    assert list(model_pool.stats()) == [Model.LLAMA_3_2_three.value]
+
+
+def test_evict(model_pool):
+    model_pool.get(Model.LLAMA_3_2_one)
+    model_pool.evict(Model.LLAMA_3_2_one)
+    assert model_pool.stats() == {}
+
+
+def test_get_unsupported_model(model_pool):
+    with pytest.raises(ValueError):
+        model_pool.get("gpt-2")
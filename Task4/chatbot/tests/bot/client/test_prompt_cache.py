@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from bot.client.prompt_cache import PromptCache
+from llama_cpp import LlamaState
+
+
+def make_state(tokens: list[int], state_size: int = 100) -> LlamaState:
+    return LlamaState(
+        input_ids=np.array(tokens, dtype=np.intc),
+        scores=np.zeros((1, 4), dtype=np.single),
+        n_tokens=len(tokens),
+        llama_state=bytes(state_size),
+        llama_state_size=state_size,
+        seed=0,
+    )
+
+
+def test_longest_prefix_lookup():
+    cache = PromptCache(capacity_bytes=10_000)
+    cache[[1, 2, 3, 4]] = make_state([1, 2, 3, 4])
+    cache[[1, 2, 9]] = make_state([1, 2, 9])
+
+    state = cache[[1, 2, 3, 7, 8]]
+    assert state.input_ids.tolist() == [1, 2, 3, 4]
+    assert cache.hits == 1
+
+
+def test_miss_is_counted():
+    cache = PromptCache(capacity_bytes=10_000)
+    cache[[1, 2, 3]] = make_state([1, 2, 3])
+
+    with pytest.raises(KeyError):
+        cache[[5, 6]]
+    assert cache.misses == 1
+    assert cache.stats()["hit_rate"] == 0.0
+
+
+def test_lru_eviction_accounts_for_scores():
+    state_bytes = PromptCache.state_size(make_state([1, 2]))
+    cache = PromptCache(capacity_bytes=2 * state_bytes)
+    cache[[1, 2]] = make_state([1, 2])
+    cache[[3, 4]] = make_state([3, 4])
+    # Touch the first state, so the second one becomes the least recently used.
+    cache[[1, 2]]
+    cache[[5, 6]] = make_state([5, 6])
+
+    assert cache.stats()["states"] == 2
+    assert [5, 6] in cache
+    assert [1, 2] in cache
+    assert [3, 4] not in cache
+    assert cache.cache_size <= cache.capacity_bytes
+
+
+def test_state_larger_than_capacity_is_skipped():
+    cache = PromptCache(capacity_bytes=10)
+    cache[[1, 2]] = make_state([1, 2])
+    assert cache.stats()["states"] == 0
+    # An empty cache must stay truthy, otherwise llama-cpp never saves a state into it.
+    assert cache
@@ -0,0 +1,89 @@
+import pytest
+from bot.conversation.answer_cache import AnswerCache, replay_stream
+from entities.document import Document
+
+
+class FakeEmbedder:
+    """
+    Stand-in for `Embedder` mapping a few questions to fixed embeddings.
+    """
+
+    EMBEDDINGS = {
+        "What is the Blendle Social Code?": [1.0, 0.0, 0.0],
+        "What's the Blendle Social Code?": [0.99, 0.1, 0.0],
+        "Who founded Blendle?": [0.0, 1.0, 0.0],
+    }
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self.EMBEDDINGS[text]
+
+
+@pytest.fixture
+def retrieved_contents():
+    return [
+        Document(page_content="The Social Code describes how we work.", metadata={"source": "social_code.md"}),
+        Document(page_content="It was written by the founders.", metadata={"source": "social_code.md"}),
+    ]
+
+
+@pytest.fixture
+def answer_cache():
+    return AnswerCache(FakeEmbedder(), threshold=0.95, ttl=60, max_size=2)
+
+
+def test_lookup_similar_question(answer_cache, retrieved_contents):
+    context_key = answer_cache.context_key(retrieved_contents, model="llama")
+    assert answer_cache.lookup("What is the Blendle Social Code?", context_key) is None
+    answer_cache.store("What is the Blendle Social Code?", context_key, "A set of guidelines.")
+
+    assert answer_cache.lookup("What's the Blendle Social Code?", context_key) == "A set of guidelines."
+    assert answer_cache.lookup("Who founded Blendle?", context_key) is None
+    assert answer_cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "answers": 1}
+    # The embedding computed by the first lookup is reused to store the answer.
+    assert answer_cache.embedding.calls == 3
+
+
+def test_lookup_with_other_context(answer_cache, retrieved_contents):
+    answer_cache.store(
+        "What is the Blendle Social Code?", answer_cache.context_key(retrieved_contents), "A set of guidelines."
+    )
+    assert (
+        answer_cache.lookup("What is the Blendle Social Code?", answer_cache.context_key(retrieved_contents[:1]))
+        is None
+    )
+    assert (
+        answer_cache.lookup("What is the Blendle Social Code?", answer_cache.context_key(retrieved_contents, k=3))
+        is None
+    )
+
+
+def test_expired_answers_are_not_reused(answer_cache, retrieved_contents):
+    context_key = answer_cache.context_key(retrieved_contents)
+    answer_cache.store("What is the Blendle Social Code?", context_key, "A set of guidelines.")
+    answer_cache.ttl = 0
+    assert answer_cache.lookup("What is the Blendle Social Code?", context_key) is None
+    assert answer_cache.stats()["answers"] == 0
+
+
+def test_least_recently_used_answer_is_evicted(answer_cache, retrieved_contents):
+    first_key = answer_cache.context_key(retrieved_contents[:1])
+    second_key = answer_cache.context_key(retrieved_contents[1:])
+    answer_cache.store("What is the Blendle Social Code?", first_key, "first")
+    answer_cache.store("What is the Blendle Social Code?", second_key, "second")
+    assert answer_cache.lookup("What is the Blendle Social Code?", first_key) == "first"
+    answer_cache.store("Who founded Blendle?", first_key, "third")
+
+    assert answer_cache.lookup("What is the Blendle Social Code?", first_key) == "first"
+    assert answer_cache.lookup("What is the Blendle Social Code?", second_key) is None
+
+
+def test_record_stream_caches_final_text(answer_cache, retrieved_contents):
+    context_key = answer_cache.context_key(retrieved_contents)
+    streamed = list(answer_cache.record_stream("Who founded Blendle?", context_key, replay_stream("The founders.")))
+
+    assert "".join(token["choices"][0]["delta"]["content"] for token in streamed) == "The founders."
+    assert answer_cache.lookup("Who founded Blendle?", context_key) == "The founders."
@@ -0,0 +1,89 @@
+from bot.conversation.chat_history import ChatHistory
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_evicts_oldest_messages_beyond_total_length():
+    chat_history = ChatHistory(["one", "two", "three"], total_length=2)
+
+    assert chat_history == ["two", "three"]
+    assert str(chat_history) == "two\nthree"
+
+
+def test_evicts_oldest_messages_beyond_token_budget():
+    chat_history = ChatHistory(max_tokens=5, token_counter=count_words)
+    chat_history.append("a b")
+    chat_history.append("c d")
+    assert chat_history.num_tokens == 4
+
+    chat_history.append("e f g")
+
+    assert chat_history == ["c d", "e f g"]
+    assert chat_history.num_tokens == 5
+    assert str(chat_history) == "c d\ne f g"
+
+
+def test_truncates_the_last_message_over_the_token_budget():
+    chat_history = ChatHistory(["a b"], max_tokens=2, token_counter=count_words)
+
+    chat_history.append("c d e f")
+
+    assert chat_history == ["c d "]
+    assert chat_history.num_tokens == 2
+    assert str(chat_history) == "c d "
+
+
+def test_truncates_the_summary_to_the_tokens_left():
+    chat_history = ChatHistory(
+        ["a b", "c d e"],
+        max_tokens=4,
+        token_counter=count_words,
+        summarizer=lambda summary, message: f"{summary} {message}".strip(),
+    )
+
+    assert chat_history == ["c d e"]
+    assert chat_history.summary == "a "
+    assert chat_history.num_tokens == 4
+
+
+def test_counts_the_tokens_of_each_message_once():
+    counted = []
+
+    def token_counter(text: str) -> int:
+        counted.append(text)
+        return count_words(text)
+
+    chat_history = ChatHistory(["a", "b", "c"], total_length=2, token_counter=token_counter)
+    str(chat_history)
+    chat_history.num_tokens
+
+    assert counted == ["a", "b", "c"]
+
+
+def test_summarizes_evicted_messages():
+    summarized = []
+
+    def summarizer(summary: str, message: str) -> str:
+        summarized.append((summary, message))
+        return f"{summary} {message}".strip()
+
+    chat_history = ChatHistory(["one", "two", "three"], total_length=1, summarizer=summarizer)
+
+    assert summarized == [("", "one"), ("one", "two")]
+    assert chat_history.summary == "one two"
+    assert chat_history == ["three"]
+    assert str(chat_history) == "summary: one two\nthree"
+
+
+def test_clear_removes_messages_and_summary():
+    chat_history = ChatHistory(["one", "two"], total_length=1, summarizer=lambda summary, message: message)
+
+    chat_history.clear()
+
+    assert len(chat_history) == 0
+    assert chat_history.num_tokens == 0
+    assert str(chat_history) == ""
+    chat_history.append("three")
+    assert str(chat_history) == "three"
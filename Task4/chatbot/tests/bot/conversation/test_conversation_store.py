@@ -0,0 +1,116 @@
+import pytest
+from bot.conversation.conversation_store import ConversationStore
+
+
+class FakeEmbedder:
+    """
+    Stand-in for `Embedder` embedding texts by the topics they mention.
+    """
+
+    TOPICS = ["social code", "founders", "holidays"]
+
+    def embed_query(self, text):
+        return [float(topic in text.lower()) for topic in self.TOPICS]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "conversations" / "chatbot.db"
+
+
+def test_sessions_have_their_own_history(db_path):
+    conversation_store = ConversationStore(db_path, total_length=2)
+
+    conversation_store.append("alice", "question: a, answer: 1")
+    conversation_store.append("bob", "question: b, answer: 2")
+
+    assert conversation_store.get("alice") == ["question: a, answer: 1"]
+    assert conversation_store.get("bob") == ["question: b, answer: 2"]
+
+
+def test_history_survives_restarts(db_path):
+    conversation_store = ConversationStore(db_path, total_length=2)
+    for i in range(3):
+        conversation_store.append("alice", f"question: {i}, answer: {i}")
+    conversation_store.close()
+
+    conversation_store = ConversationStore(db_path, total_length=2)
+
+    assert conversation_store.get("alice") == ["question: 1, answer: 1", "question: 2, answer: 2"]
+
+
+def test_turns(db_path):
+    conversation_store = ConversationStore(db_path, total_length=1)
+    conversation_store.append("alice", "question: a, answer: 1, then 2")
+    conversation_store.append("alice", "question: b, answer: 3")
+    conversation_store.append("alice", "summary")
+    conversation_store.close()
+
+    conversation_store = ConversationStore(db_path, total_length=1)
+
+    assert conversation_store.turns("alice") == [("a", "1, then 2"), ("b", "3"), ("", "summary")]
+    assert conversation_store.turns("bob") == []
+
+
+def test_least_recently_used_sessions_are_reloaded(db_path):
+    conversation_store = ConversationStore(db_path, max_sessions=1, total_length=2)
+    conversation_store.append("alice", "question: a, answer: 1")
+    conversation_store.append("bob", "question: b, answer: 2")
+
+    assert list(conversation_store.sessions) == ["bob"]
+    assert conversation_store.get("alice") == ["question: a, answer: 1"]
+    assert list(conversation_store.sessions) == ["alice"]
+
+
+def test_summary_survives_restarts(db_path):
+    conversation_store = ConversationStore(
+        db_path, total_length=1, summarizer=lambda summary, message: f"{summary} {message}".strip()
+    )
+    conversation_store.append("alice", "one")
+    conversation_store.append("alice", "two")
+    conversation_store.close()
+
+    conversation_store = ConversationStore(db_path, total_length=1)
+
+    assert str(conversation_store.get("alice")) == "summary: one\ntwo"
+
+
+def test_recall_returns_related_older_turns(db_path):
+    conversation_store = ConversationStore(db_path, embedding=FakeEmbedder(), total_length=1)
+    conversation_store.append("alice", "question: What is the Social Code?, answer: A set of guidelines.")
+    conversation_store.append("alice", "question: How many holidays?, answer: 25 days.")
+    conversation_store.append("alice", "question: Who are the founders?, answer: Two journalists.")
+
+    assert conversation_store.recall("alice", "Who wrote the social code?") == [
+        "question: What is the Social Code?, answer: A set of guidelines."
+    ]
+    # The turns in the chat history aren't recalled.
+    assert conversation_store.recall("alice", "Where did the founders work?") == []
+    assert conversation_store.recall("bob", "Who wrote the social code?") == []
+
+
+def test_prompt_history_puts_recalled_turns_first(db_path):
+    conversation_store = ConversationStore(db_path, embedding=FakeEmbedder(), total_length=1)
+    conversation_store.append("alice", "question: What is the Social Code?, answer: A set of guidelines.")
+    conversation_store.append("alice", "question: How many holidays?, answer: 25 days.")
+
+    prompt_history = conversation_store.prompt_history("alice", "Who wrote the social code?")
+
+    assert prompt_history == [
+        "question: What is the Social Code?, answer: A set of guidelines.",
+        "question: How many holidays?, answer: 25 days.",
+    ]
+    assert conversation_store.get("alice") == ["question: How many holidays?, answer: 25 days."]
+
+
+def test_clear_removes_the_session(db_path):
+    conversation_store = ConversationStore(db_path, total_length=2)
+    conversation_store.append("alice", "question: a, answer: 1")
+    conversation_store.append("bob", "question: b, answer: 2")
+
+    conversation_store.clear("alice")
+    conversation_store.close()
+    conversation_store = ConversationStore(db_path, total_length=2)
+
+    assert len(conversation_store.get("alice")) == 0
+    assert conversation_store.get("bob") == ["question: b, answer: 2"]
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+from bot.conversation.chat_history import ChatHistory
+from bot.conversation.question_rewriter import QuestionRewriter, RewriteMode, follow_up_score
+
+
+class FakeEmbedder:
+    """
+    Stand-in for `Embedder` embedding texts by the topics they mention.
+    """
+
+    TOPICS = ["social code", "founders", "holidays"]
+
+    def embed_documents(self, texts):
+        return [[float(topic in text.lower()) for topic in self.TOPICS] for text in texts]
+
+
+@pytest.fixture
+def question_rewriter():
+    return QuestionRewriter(FakeEmbedder())
+
+
+@pytest.fixture
+def chat_history():
+    return ChatHistory(
+        [
+            "question: How many holidays do employees get?, answer: 25 days.",
+            "question: What is the Blendle Social Code?, answer: A set of guidelines.",
+        ],
+        total_length=2,
+    )
+
+
+@pytest.mark.parametrize(
+    "question, expected",
+    [
+        ("What is the Blendle Social Code?", 0.0),
+        ("Who wrote it?", 0.8),
+        ("And the founders?", 0.6),
+        ("Can you explain the details of this process for new employees?", 0.3),
+    ],
+)
+def test_follow_up_score(question, expected):
+    assert follow_up_score(question) == pytest.approx(expected)
+
+
+def test_rewrite_standalone_question(question_rewriter, chat_history):
+    question = "How many holidays do new employees get during the first year?"
+    assert question_rewriter.rewrite(question, chat_history) == (RewriteMode.STANDALONE, question)
+
+
+def test_rewrite_without_history(question_rewriter):
+    assert question_rewriter.rewrite("Who wrote it?", ChatHistory()) == (RewriteMode.STANDALONE, "Who wrote it?")
+
+
+def test_rewrite_follow_up_with_most_recent_question(question_rewriter, chat_history):
+    mode, refined_question = question_rewriter.rewrite("Who wrote it?", chat_history)
+    assert mode == RewriteMode.FUSION
+    assert refined_question == "What is the Blendle Social Code? Who wrote it?"
+
+
+def test_rewrite_follow_up_with_most_related_question(question_rewriter, chat_history):
+    mode, refined_question = question_rewriter.rewrite("And the holidays for them?", chat_history)
+    assert mode == RewriteMode.FUSION
+    assert refined_question == "How many holidays do employees get? And the holidays for them?"
+
+
+def test_rewrite_uncertain_question(question_rewriter, chat_history):
+    question = "Can you explain the details of this process for new employees?"
+    assert question_rewriter.rewrite(question, chat_history) == (RewriteMode.LLM, None)
+
+
+def test_metrics(question_rewriter):
+    question_rewriter.record_latency(RewriteMode.FUSION, 0.002)
+    question_rewriter.record_retrieval(RewriteMode.FUSION, hit=True)
+    question_rewriter.record_latency(RewriteMode.FUSION, 0.004)
+    question_rewriter.record_retrieval(RewriteMode.FUSION, hit=False)
+    stats = question_rewriter.stats()
+    assert stats["fusion"] == {"count": 2, "mean_latency": pytest.approx(0.003), "retrieval_hit_rate": 0.5}
+    assert stats["llm"]["count"] == 0
+
+
+def test_concurrent_metrics(question_rewriter):
+    def record(mode):
+        for _ in range(1000):
+            question_rewriter.record_latency(mode, 0.001)
+            question_rewriter.record_retrieval(mode, hit=True)
+
+    threads = [threading.Thread(target=record, args=(mode,)) for mode in [RewriteMode.FUSION, RewriteMode.LLM] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = question_rewriter.stats()
+    assert stats["fusion"]["count"] == stats["llm"]["count"] == 4000
+    assert stats["fusion"]["retrieval_hit_rate"] == stats["llm"]["retrieval_hit_rate"] == 1.0
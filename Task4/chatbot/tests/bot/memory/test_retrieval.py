@@ -0,0 +1,57 @@
+from bot.memory.retrieval import cap_context_tokens, filter_by_score_gap, merge_adjacent_chunks
+from entities.document import Document
+
+
+def chunk(content, source="doc.md", start_index=None):
+    metadata = {"source": source}
+    if start_index is not None:
+        metadata["start_index"] = start_index
+    return Document(page_content=content, metadata=metadata)
+
+
+def test_filter_by_score_gap_drops_chunks_far_below_the_best():
+    docs_and_scores = [(chunk("a"), 0.8), (chunk("b"), 0.7), (chunk("c"), 0.4)]
+
+    filtered = filter_by_score_gap(docs_and_scores, relative_gap=0.25)
+
+    assert [doc.page_content for doc, _ in filtered] == ["a", "b"]
+    assert filter_by_score_gap(docs_and_scores, relative_gap=1) == docs_and_scores
+    assert filter_by_score_gap([], relative_gap=0.25) == []
+
+
+def test_merge_adjacent_chunks_of_the_same_source():
+    docs_and_scores = [
+        (chunk("world. How are you?", start_index=7), 0.9),
+        (chunk("Hello, world.", start_index=0), 0.6),
+        (chunk("Hello, world.", source="other.md", start_index=0), 0.5),
+        (chunk("Far away.", start_index=100), 0.4),
+    ]
+
+    merged = merge_adjacent_chunks(docs_and_scores)
+
+    assert [(doc.page_content, doc.metadata["source"], score) for doc, score in merged] == [
+        ("Hello, world. How are you?", "doc.md", 0.9),
+        ("Hello, world.", "other.md", 0.5),
+        ("Far away.", "doc.md", 0.4),
+    ]
+
+
+def test_merge_adjacent_chunks_keeps_chunks_without_start_index():
+    docs_and_scores = [(chunk("a"), 0.9), (chunk("b"), 0.8)]
+
+    assert merge_adjacent_chunks(docs_and_scores) == docs_and_scores
+
+
+def test_cap_context_tokens_keeps_most_relevant_chunks_within_budget():
+    docs_and_scores = [(chunk("a b c"), 0.9), (chunk("d e"), 0.8), (chunk("f"), 0.7)]
+
+    kept, num_tokens = cap_context_tokens(docs_and_scores, max_tokens=5, token_counter=lambda text: len(text.split()))
+
+    assert [doc.page_content for doc, _ in kept] == ["a b c", "d e"]
+    assert num_tokens == 5
+
+
+def test_cap_context_tokens_always_keeps_the_best_chunk():
+    kept, _ = cap_context_tokens([(chunk("a b c"), 0.9)], max_tokens=1, token_counter=lambda text: len(text.split()))
+
+    assert len(kept) == 1
@@ -1,6 +1,10 @@
+import chromadb
+import numpy as np
 import pytest
 from bot.memory.embedder import Embedder
-from bot.memory.vector_database.chroma import Chroma
+from bot.memory.vector_database.chroma import Chroma, hnsw_collection_metadata
+from bot.memory.vector_database.distance_metric import DistanceMetric
+from bot.memory.vector_database.quantized_index import QuantizationType, QuantizedIndex
 from entities.document import Document
 
 
@@ -22,6 +26,13 @@ def test_add_texts(chroma_instance):
     assert len(ids) == 1
 
 
+def test_from_chunks_in_batches(chroma_instance):
+    chunks = (Document(page_content=f"This is test document {idx}.", metadata={"source": "test"}) for idx in range(5))
+    num_of_chunks = chroma_instance.from_chunks(chunks, batch_size=2)
+    assert num_of_chunks == 5
+    assert chroma_instance.collection.count() == 5
+
+
 def test_similarity_search(chroma_instance):
     texts = ["This is a test document."]
     metadatas = [{"source": "test_source"}]
@@ -65,3 +76,107 @@ def test_similarity_search_with_relevance_scores(chroma_instance):
     assert isinstance(results[0][0], Document)
     assert isinstance(results[0][1], float)
     assert 0.0 <= results[0][1] <= 1.0
+
+
+def test_adaptive_similarity_search(chroma_instance):
+    texts = ["This is a test document.", "Completely unrelated sentence about cooking pasta."]
+    metadatas = [{"source": "test_source"}, {"source": "other_source"}]
+    chroma_instance.add_texts(texts, metadatas)
+
+    results, sources, report = chroma_instance.adaptive_similarity_search("test document", k=2, threshold=0.0)
+    assert report.fetched == 2
+    assert report.used == len(results) == len(sources)
+    assert results[0].page_content == "This is a test document."
+
+
+def test_collection_with_hnsw_settings(tmp_path):
+    collection_metadata = hnsw_collection_metadata(DistanceMetric.COSINE, m=32, ef_construction=200, ef_search=50)
+    assert collection_metadata == {
+        "hnsw:space": "cosine",
+        "hnsw:M": 32,
+        "hnsw:construction_ef": 200,
+        "hnsw:search_ef": 50,
+    }
+
+    chroma = Chroma(embedding=Embedder(), persist_directory=str(tmp_path), collection_metadata=collection_metadata)
+    chroma.add_texts(["This is a test document."], [{"source": "test_source"}])
+
+    results = chroma.similarity_search_with_relevance_scores("This is a test document.", k=1)
+    # The cosine distance of identical texts is 0, so their relevance score is 1.
+    assert results[0][1] == pytest.approx(1.0, abs=1e-3)
+
+
+def test_quantized_index(tmp_path):
+    chroma = Chroma(embedding=Embedder(), persist_directory=str(tmp_path))
+    texts = ["This is a test document.", "Completely unrelated sentence about cooking pasta."]
+    chroma.add_texts(texts, [{"source": "test_source"}, {"source": "other_source"}])
+    expected = chroma.similarity_search_with_score("test document", k=2)
+
+    chroma.build_quantized_index(QuantizationType.INT8)
+    # A new instance loads the quantized index saved with the collection.
+    reopened = Chroma(embedding=Embedder(), persist_directory=str(tmp_path))
+    results = reopened.similarity_search_with_score("test document", k=2)
+
+    assert reopened.quantized_index is not None
+    assert [doc.page_content for doc, _ in results] == [doc.page_content for doc, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-4)
+
+    reopened.remove_quantized_index()
+    assert Chroma(embedding=Embedder(), persist_directory=str(tmp_path)).quantized_index is None
+
+
+def add_random_embeddings(chroma: Chroma, num_embeddings: int = 50, dimension: int = 16) -> None:
+    embeddings = np.random.default_rng(0).standard_normal((num_embeddings, dimension)).astype(np.float32)
+    chroma.collection.add(
+        ids=[f"id{idx:02d}" for idx in range(num_embeddings)],
+        embeddings=embeddings.tolist(),
+        documents=[f"Document {idx}." for idx in range(num_embeddings)],
+        metadatas=[{"source": "test"}] * num_embeddings,
+    )
+
+
+@pytest.mark.parametrize("quantization", list(QuantizationType))
+def test_build_quantized_index_in_batches(tmp_path, quantization):
+    chroma = Chroma(
+        persist_directory=str(tmp_path), collection_metadata=hnsw_collection_metadata(DistanceMetric.COSINE)
+    )
+    add_random_embeddings(chroma)
+
+    # The collection is read in several batches, the last one partial.
+    quantized_index = chroma.build_quantized_index(quantization, num_subvectors=4, batch_size=16)
+
+    collection = chroma.collection.get(include=["embeddings"])
+    expected = QuantizedIndex(quantization, DistanceMetric.COSINE, num_subvectors=4)
+    expected.build(collection["ids"], collection["embeddings"])
+    assert quantized_index.ids == expected.ids
+    np.testing.assert_array_equal(quantized_index.codes, expected.codes)
+    np.testing.assert_allclose(quantized_index.vectors, expected.vectors)
+    assert isinstance(quantized_index.vectors, np.memmap)
+    assert chroma.quantized_index_directory.exists()
+
+    chroma.remove_quantized_index()
+    assert chroma.quantized_index is None
+    assert not chroma.quantized_index_directory.exists()
+    assert Chroma(persist_directory=str(tmp_path)).quantized_index is None
+
+
+def test_build_quantized_index_in_memory():
+    chroma = Chroma(client=chromadb.EphemeralClient(), collection_name="in_memory", is_persistent=False)
+    add_random_embeddings(chroma)
+
+    quantized_index = chroma.build_quantized_index(QuantizationType.INT8, batch_size=16)
+
+    # Without a persist directory the full vectors stay in memory.
+    assert chroma.quantized_index is quantized_index
+    assert len(quantized_index.ids) == 50
+    assert not isinstance(quantized_index.vectors, np.memmap)
+    query = np.asarray(chroma.collection.get(ids=["id07"], include=["embeddings"])["embeddings"][0])
+    assert quantized_index.search(query, k=1)[0][0] == "id07"
+
+    chroma.remove_quantized_index()
+    assert chroma.quantized_index is None
+
+
+def test_build_quantized_index_of_empty_collection(tmp_path):
+    with pytest.raises(ValueError):
+        Chroma(persist_directory=str(tmp_path)).build_quantized_index(QuantizationType.INT8)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from bot.memory.vector_database.distance_metric import DistanceMetric
+from bot.memory.vector_database.quantized_index import QuantizationType, QuantizedIndex, kmeans
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(8, 16))
+    return (centers[rng.integers(0, 8, 500)] + 0.1 * rng.normal(size=(500, 16))).astype(np.float32)
+
+
+def exact_neighbours(embeddings, query, distance_metric, k):
+    if distance_metric == DistanceMetric.L2:
+        distances = ((embeddings - query) ** 2).sum(axis=1)
+    elif distance_metric == DistanceMetric.IP:
+        distances = 1 - embeddings @ query
+    else:
+        normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        distances = 1 - normalized @ (query / np.linalg.norm(query))
+    order = np.argsort(distances)[:k]
+    return [str(i) for i in order], distances[order]
+
+
+def test_kmeans_finds_separated_clusters():
+    vectors = np.array([[0.0, 0.0], [0.1, 0.0], [10.0, 10.0], [10.1, 10.0]], dtype=np.float32)
+
+    centroids = kmeans(vectors, num_centroids=2)
+
+    assert sorted(centroids[:, 0].tolist()) == pytest.approx([0.05, 10.05])
+
+
+@pytest.mark.parametrize("quantization", list(QuantizationType))
+@pytest.mark.parametrize("distance_metric", list(DistanceMetric))
+def test_search_with_rerank_matches_exact_search(embeddings, quantization, distance_metric, tmp_path):
+    index = QuantizedIndex(quantization, distance_metric, num_subvectors=4, num_centroids=64, rerank_factor=16)
+    index.build([str(i) for i in range(len(embeddings))], embeddings, vectors_path=tmp_path / "vectors.npy")
+    query = embeddings[42] + 0.01
+
+    results = index.search(query, k=5)
+
+    expected_ids, expected_distances = exact_neighbours(embeddings, query, distance_metric, k=5)
+    assert [id for id, _ in results] == expected_ids
+    assert [distance for _, distance in results] == pytest.approx(expected_distances.tolist(), abs=1e-4)
+
+
+def test_int8_search_without_rerank_is_close(embeddings):
+    index = QuantizedIndex(QuantizationType.INT8, DistanceMetric.COSINE)
+    index.build([str(i) for i in range(len(embeddings))], embeddings)
+
+    results = index.search(embeddings[7], k=1, rerank=False)
+
+    assert results[0][0] == "7"
+    assert results[0][1] == pytest.approx(0.0, abs=1e-2)
+
+
+def test_compressed_vectors_are_smaller(embeddings, tmp_path):
+    int8_index = QuantizedIndex(QuantizationType.INT8)
+    int8_index.build([str(i) for i in range(len(embeddings))], embeddings, vectors_path=tmp_path / "int8.npy")
+    pq_index = QuantizedIndex(QuantizationType.PQ, num_subvectors=4, num_centroids=16)
+    pq_index.build([str(i) for i in range(len(embeddings))], embeddings, vectors_path=tmp_path / "pq.npy")
+
+    assert int8_index.codes.nbytes == embeddings.nbytes // 4
+    assert pq_index.codes.nbytes == embeddings.nbytes // 16
+    assert pq_index.memory_bytes < int8_index.memory_bytes < embeddings.nbytes
+
+
+def test_build_rejects_mismatched_ids(embeddings):
+    with pytest.raises(ValueError):
+        QuantizedIndex().build(["0"], embeddings)
+
+
+@pytest.mark.parametrize("quantization", list(QuantizationType))
+def test_save_and_load(embeddings, quantization, tmp_path):
+    index = QuantizedIndex(quantization, DistanceMetric.L2, num_subvectors=4, num_centroids=64)
+    index.build([str(i) for i in range(len(embeddings))], embeddings)
+    assert not QuantizedIndex.exists(tmp_path / "index")
+
+    index.save(tmp_path / "index")
+    loaded = QuantizedIndex.load(tmp_path / "index")
+
+    assert QuantizedIndex.exists(tmp_path / "index")
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.memory_bytes == index.memory_bytes
+    assert loaded.search(embeddings[42], k=5) == index.search(embeddings[42], k=5)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import re
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from bot.model.downloader import ChecksumError, ModelDownloader
+
+CONTENT = bytes(range(256)) * 4096
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves `CONTENT`, honoring single range requests if `accept_ranges` is set.
+    """
+
+    def __init__(self, *args, accept_ranges: bool, served: list, linked_etag: str | None = None, **kwargs):
+        self.accept_ranges = accept_ranges
+        self.served = served
+        self.linked_etag = linked_etag
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        if self.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if self.linked_etag:
+            self.send_header("X-Linked-Etag", f'"{self.linked_etag}"')
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if self.accept_ranges and match:
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(CONTENT)}")
+        else:
+            start, end = 0, len(CONTENT)
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:end])
+        self.served.append(end - start)
+
+
+def serve(handler):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+
+@pytest.fixture(params=[True, False], ids=["ranges", "no-ranges"])
+def server(request):
+    served = []
+    httpd = serve(partial(RangeRequestHandler, accept_ranges=request.param, served=served))
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/model.gguf", served, request.param
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(params=[hashlib.sha256(CONTENT).hexdigest(), "0" * 64], ids=["right-etag", "wrong-etag"])
+def lfs_server(request):
+    httpd = serve(partial(RangeRequestHandler, accept_ranges=True, served=[], linked_etag=request.param))
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/model.gguf", request.param == hashlib.sha256(CONTENT).hexdigest()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def downloader():
+    return ModelDownloader(num_segments=4, chunk_size=64 * 1024, timeout=5, show_progress=False)
+
+
+def test_download(server, downloader, tmp_path):
+    url, served, _ = server
+    destination = downloader.download(url, tmp_path / "model.gguf", sha256=hashlib.sha256(CONTENT).hexdigest())
+    assert destination.read_bytes() == CONTENT
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["model.gguf"]
+
+
+def test_download_skips_existing_file(server, downloader, tmp_path):
+    url, served, _ = server
+    (tmp_path / "model.gguf").write_bytes(b"model")
+    downloader.download(url, tmp_path / "model.gguf")
+    assert served == []
+
+
+def test_download_with_wrong_checksum(server, downloader, tmp_path):
+    url, _, _ = server
+    with pytest.raises(ChecksumError):
+        downloader.download(url, tmp_path / "model.gguf", sha256="0" * 64)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_verifies_linked_etag(lfs_server, downloader, tmp_path):
+    url, right_etag = lfs_server
+    if right_etag:
+        assert downloader.download(url, tmp_path / "model.gguf").read_bytes() == CONTENT
+    else:
+        with pytest.raises(ChecksumError):
+            downloader.download(url, tmp_path / "model.gguf")
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_download_resumes_partial_file(server, downloader, tmp_path):
+    url, served, accept_ranges = server
+    if not accept_ranges:
+        pytest.skip("Resuming requires range requests")
+
+    # Simulate an interrupted download: the first segment is complete, the others are half written.
+    segment_size = len(CONTENT) // 4
+    part = bytearray(len(CONTENT))
+    segments = []
+    for start in range(0, len(CONTENT), segment_size):
+        written = segment_size if start == 0 else segment_size // 2
+        part[start : start + written] = CONTENT[start : start + written]
+        segments.append([start, start + segment_size, written])
+    (tmp_path / "model.gguf.part").write_bytes(part)
+    (tmp_path / "model.gguf.part.json").write_text(json.dumps({"size": len(CONTENT), "segments": segments}))
+
+    destination = downloader.download(url, tmp_path / "model.gguf", sha256=hashlib.sha256(CONTENT).hexdigest())
+
+    assert destination.read_bytes() == CONTENT
+    assert sum(served) == 3 * segment_size // 2
@@ -1,5 +1,6 @@
 from document_loader.format import Format
 from document_loader.text_splitter import RecursiveCharacterTextSplitter, create_recursive_text_splitter
+from entities.document import Document
 
 
 def test_recursive_character_text_splitter_keep_separators() -> None:
@@ -118,3 +119,32 @@ b = 2
     code = "harry\n***\nbabylon is"
     chunks = splitter.split_text(code)
     assert chunks == ["harry\n***", "babylon is"]
+
+
+def test_iter_split_is_lazy() -> None:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=10, chunk_overlap=0)
+    consumed = []
+
+    def documents():
+        for idx, text in enumerate(["Apple banana", "orange tomato"]):
+            consumed.append(idx)
+            yield Document(page_content=text, metadata={"source": f"doc-{idx}"})
+
+    chunks = splitter.iter_split(documents())
+    first_chunk = next(chunks)
+    assert consumed == [0]
+    assert first_chunk.page_content == "Apple"
+    assert first_chunk.metadata == {"source": "doc-0"}
+
+    remaining_chunks = list(chunks)
+    assert consumed == [0, 1]
+    assert [chunk.page_content for chunk in remaining_chunks] == ["banana", "orange", "tomato"]
+
+
+def test_iter_split_matches_split_documents() -> None:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=10, chunk_overlap=0, add_start_index=True)
+    documents = [
+        Document(page_content="Apple banana apple", metadata={"source": "a"}),
+        Document(page_content="orange tomato", metadata={"source": "b"}),
+    ]
+    assert list(splitter.iter_split(documents)) == splitter.split_documents(documents)
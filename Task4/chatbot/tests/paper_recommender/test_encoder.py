@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from encoder import cosine_agreement, load_encoder  # noqa: E402
+
+QUERIES = [
+    "graph neural networks for molecule property prediction",
+    "dark matter detection with liquid xenon",
+    "Attention is all you need",
+    "black hole information paradox",
+    "quantum error correction with surface codes",
+]
+
+
+def test_cosine_agreement():
+    embeddings = np.array([[1.0, 0.0], [1.0, 1.0]])
+    reference_embeddings = np.array([[2.0, 0.0], [1.0, 0.0]])
+
+    assert cosine_agreement(embeddings, reference_embeddings) == pytest.approx([1.0, np.sqrt(0.5)])
+
+
+def test_int8_embeddings_match_the_original_ones():
+    # Papers are encoded as title + abstract, like in the index
+    texts = QUERIES + [f"{query}\n {' '.join([query] * 20)}" for query in QUERIES]
+
+    reference_embeddings = load_encoder("cpu").encode(texts)
+    embeddings = load_encoder("int8").encode(texts)
+
+    assert cosine_agreement(embeddings, reference_embeddings).min() >= 0.99
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        load_encoder("tpu")
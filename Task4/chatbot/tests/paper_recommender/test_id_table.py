@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from data_handling.id_table import IdTable
+
+
+@pytest.fixture
+def id_table(tmp_path):
+    return IdTable(str(tmp_path / "ids.bin"))
+
+
+def test_empty_table(id_table):
+    assert len(id_table) == 0
+    assert id_table.contains(["2101.00001"]).tolist() == [False]
+    assert id_table.labels(["2101.00001"]).tolist() == [-1]
+
+
+def test_append(id_table):
+    id_table.append(["2101.00001", "2101.00002"])
+    id_table.append(["hep-th/9901001"])
+
+    assert len(id_table) == 3
+    assert id_table[np.arange(3)].tolist() == ["2101.00001", "2101.00002", "hep-th/9901001"]
+    # The records are persisted, a new table reads them back
+    assert IdTable(id_table.path)[2] == "hep-th/9901001"
+
+
+def test_truncate(id_table):
+    id_table.append(["2101.00001", "2101.00002", "2101.00003"])
+
+    id_table.truncate(1)
+
+    assert len(id_table) == 1
+    assert id_table.labels(["2101.00001", "2101.00002"]).tolist() == [0, -1]
+
+
+def test_partial_record_is_ignored(id_table):
+    id_table.append(["2101.00001"])
+    # A checkpoint interrupted while writing a record
+    with open(id_table.path, "ab") as f:
+        f.write(b"2101.")
+
+    id_table = IdTable(id_table.path)
+    assert len(id_table) == 1
+
+    # The next records are appended after the whole ones
+    id_table.append(["2101.00002"])
+    assert id_table[np.arange(2)].tolist() == ["2101.00001", "2101.00002"]
+    assert id_table.labels(["2101.00002"]).tolist() == [1]
+
+
+def test_labels(id_table):
+    id_table.append(["2101.00003", "2101.00001", "2101.00002"])
+
+    labels = id_table.labels(["2101.00002", "9999.99999", "2101.00003", "2101.00001"])
+
+    assert labels.tolist() == [2, -1, 0, 1]
+    assert id_table.contains(["2101.00002", "9999.99999"]).tolist() == [True, False]
+    # The lookup is updated after an append
+    id_table.append(["9999.99999"])
+    assert id_table.labels(["9999.99999"]).tolist() == [3]
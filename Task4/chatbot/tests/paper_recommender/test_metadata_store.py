@@ -0,0 +1,80 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from data_handling.metadata_store import MetadataStore  # noqa: E402
+
+
+def make_papers(ids, categories, dates):
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "title": [f"Title {id}" for id in ids],
+            "abstract": [f"Abstract {id}" for id in ids],
+            "authors_parsed": [[["Doe", "Jane", ""], ["Roe", "Rick", ""]] for _ in ids],
+            "categories": categories,
+            "update_date": pd.to_datetime(dates).date,
+        }
+    )
+
+
+@pytest.fixture
+def papers():
+    return make_papers(
+        ["2101.00001", "2101.00002", "2101.00003"],
+        ["cs.LG stat.ML", "hep-th", "cs.CV cs.LG"],
+        ["2021-01-01", "2021-06-01", "2022-01-01"],
+    )
+
+
+@pytest.fixture
+def store_path(tmp_path, papers):
+    path = str(tmp_path / "metadata.arrow")
+    # In the order of the id table, whose second id is no longer in the data
+    MetadataStore.build(path, papers, ids=["2101.00003", "1999.99999", "2101.00001"])
+    return path
+
+
+def test_build(store_path):
+    store = MetadataStore(store_path)
+
+    assert len(store) == 3
+    assert store.categories == ["cs.CV", "cs.LG", "stat.ML"]
+
+
+def test_fetch(store_path):
+    rows = MetadataStore(store_path).fetch(np.array([2, -1, 0, 1]))
+
+    assert [row["id"] for row in rows] == ["2101.00001", "2101.00003", None]
+    assert rows[0]["authors"] == ["Jane Doe", "Rick Roe"]
+    assert rows[0]["categories"] == ["cs.LG", "stat.ML"]
+    assert rows[0]["update_date"] == "2021-01-01"
+
+
+def test_filter_mask(store_path):
+    store = MetadataStore(store_path)
+
+    assert store.filter_mask() is None
+    assert store.filter_mask(["cs.LG"]).tolist() == [True, False, True]
+    assert store.filter_mask(["cs.CV", "stat.ML"]).tolist() == [True, False, True]
+    assert store.filter_mask(["unknown"]).tolist() == [False, False, False]
+    assert store.filter_mask(start_date=datetime.date(2021, 6, 1)).tolist() == [True, False, False]
+    assert store.filter_mask(["cs.LG"], end_date=datetime.date(2021, 12, 31)).tolist() == [False, False, True]
+
+
+def test_update(store_path):
+    # The paper at label 0 is updated and a new paper is appended at label 3
+    papers = make_papers(["2101.00003", "2102.00004"], ["math.AG", "cs.LG"], ["2023-01-01", "2021-02-01"])
+
+    MetadataStore.update(store_path, papers, [0, 3])
+
+    store = MetadataStore(store_path)
+    assert len(store) == 4
+    assert [row["id"] for row in store.fetch(range(4))] == ["2101.00003", None, "2101.00001", "2102.00004"]
+    assert store.fetch([0])[0]["categories"] == ["math.AG"]
+    assert store.categories == ["cs.CV", "cs.LG", "math.AG", "stat.ML"]
+    assert store.filter_mask(["cs.LG"]).tolist() == [False, False, True, True]
@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from query_cache import QueryCache
+
+
+def test_hit_and_miss():
+    cache = QueryCache()
+    calls = []
+
+    assert cache.get("query", lambda: calls.append(1) or "results") == "results"
+    assert cache.get("query", lambda: calls.append(1) or "other results") == "results"
+
+    assert calls == [1]
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 1, 0)
+    assert cache.hit_rate == 0.5
+
+
+def test_lru_eviction():
+    cache = QueryCache(max_size=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 1)
+
+    cache.get("c", lambda: 3)
+
+    assert len(cache) == 2
+    assert set(cache.results) == {"a", "c"}
+
+
+def test_concurrent_queries_are_coalesced():
+    cache = QueryCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return "results"
+
+    owner = threading.Thread(target=cache.get, args=("query", compute))
+    owner.start()
+    started.wait(10)
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(cache.get("query", compute))) for _ in range(4)]
+    for waiter in waiters:
+        waiter.start()
+    while cache.coalesced < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [owner, *waiters]:
+        thread.join(10)
+
+    assert calls == [1]
+    assert results == ["results"] * 4
+    assert (cache.misses, cache.coalesced) == (1, 4)
+
+
+def test_failure_is_shared_and_not_cached():
+    cache = QueryCache()
+
+    def compute():
+        raise RuntimeError("search failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get("query", compute)
+
+    assert cache.get("query", lambda: "results") == "results"
+
+
+def test_version_change_invalidates_the_cache():
+    cache = QueryCache()
+    assert cache.check_version(1)
+    cache.get("query", lambda: "old results")
+
+    assert not cache.check_version(1)
+    assert cache.get("query", lambda: "new results") == "old results"
+    assert cache.check_version(2)
+    assert len(cache) == 0
+    assert cache.get("query", lambda: "new results") == "new results"
+
+
+def test_results_of_a_replaced_index_are_not_reused():
+    cache = QueryCache()
+    cache.check_version(1)
+    started, release = threading.Event(), threading.Event()
+
+    def compute_old():
+        started.set()
+        release.wait(10)
+        return "old results"
+
+    owner = threading.Thread(target=cache.get, args=("query", compute_old))
+    owner.start()
+    started.wait(10)
+
+    # The index is replaced while the query is computed: new queries don't wait for the old computation
+    cache.check_version(2)
+    assert cache.get("query", lambda: "new results") == "new results"
+    release.set()
+    owner.join(10)
+
+    assert cache.get("query", lambda: "newer results") == "new results"
+
+
+class Interrupted(BaseException):
+    """Like the exceptions Streamlit raises to stop or rerun a script"""
+
+
+def test_interrupted_computation_is_computed_again():
+    cache = QueryCache()
+    started, release = threading.Event(), threading.Event()
+
+    def compute_interrupted():
+        started.set()
+        release.wait(10)
+        raise Interrupted()
+
+    def interrupted_session():
+        with pytest.raises(Interrupted):
+            cache.get("query", compute_interrupted)
+
+    owner = threading.Thread(target=interrupted_session)
+    owner.start()
+    started.wait(10)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get("query", lambda: "results")), daemon=True)
+    waiter.start()
+    while cache.coalesced < 1:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [owner, waiter]:
+        thread.join(10)
+
+    # The waiting session computes the results instead of raising the interruption of the other one
+    assert not waiter.is_alive()
+    assert results == ["results"]
+    assert cache.in_flight == {}
+    assert cache.get("query", lambda: "other results") == "results"
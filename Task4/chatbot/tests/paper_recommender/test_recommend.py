@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from data_handling.id_table import IdTable  # noqa: E402
+from recommend import Recommender, normalize  # noqa: E402
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return normalize(rng.standard_normal((2000, 32)).astype("float32"))
+
+
+@pytest.fixture
+def ids(vectors):
+    return [f"2101.{label:05d}" for label in range(len(vectors))]
+
+
+@pytest.fixture
+def recommender(tmp_path, vectors, ids):
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    index.add_with_ids(vectors, np.arange(len(vectors)))
+    id_table = IdTable(str(tmp_path / "ids.bin"))
+    id_table.append(ids)
+    # Small batches, so the users are split across several of them
+    return Recommender(index, id_table, batch_size=3)
+
+
+def brute_force(vectors, ids, user, k, tag_weight=0.5):
+    """The k best papers of the user, scoring every paper"""
+    labels = [ids.index(arxiv_id) for arxiv_id in user.get("papers", [])]
+    query = vectors[labels].mean(axis=0) if labels else None
+    if user.get("tag_centroid") is not None:
+        tags = normalize(user["tag_centroid"])
+        query = (1 - tag_weight) * normalize(query) + tag_weight * tags if labels else tags
+    scores = vectors @ normalize(query)
+
+    excluded = set(labels) | {ids.index(arxiv_id) for arxiv_id in user.get("exclude", [])}
+    best = [label for label in np.argsort(-scores, kind="stable") if label not in excluded][:k]
+    return [ids[label] for label in best], scores[best]
+
+
+def test_recommend_matches_brute_force(recommender, vectors, ids):
+    rng = np.random.default_rng(1)
+    users = [{"papers": [ids[label] for label in rng.choice(len(ids), 5, replace=False)]} for _ in range(6)]
+    # Users whose best papers are excluded, more of them than the median user excludes
+    for user, num_excluded in zip(users[:3], [3, 40, 300]):
+        best, _ = brute_force(vectors, ids, user, num_excluded)
+        user["exclude"] = best
+    users.append({"tag_centroid": rng.standard_normal(32).astype("float32")})
+    users.append({"papers": [ids[0]], "tag_centroid": rng.standard_normal(32).astype("float32")})
+
+    k = 10
+    recommendations = recommender.recommend(users, k)
+
+    assert len(recommendations) == len(users)
+    for user, results in zip(users, recommendations):
+        expected_ids, expected_scores = brute_force(vectors, ids, user, k)
+        assert [arxiv_id for arxiv_id, _ in results] == expected_ids
+        np.testing.assert_allclose([score for _, score in results], expected_scores, rtol=1e-4, atol=1e-5)
+
+
+def test_recommend_excluding_almost_everything(recommender, vectors, ids):
+    user = {"papers": [ids[0]], "exclude": ids[1:-3]}
+
+    [results] = recommender.recommend([user], k=10)
+
+    # Only the papers left are recommended
+    assert sorted(arxiv_id for arxiv_id, _ in results) == sorted(ids[-3:])
+
+
+def test_user_without_papers(recommender):
+    users = [{}, {"papers": ["unknown"]}, {"papers": ["2101.00000"]}]
+
+    recommendations = recommender.recommend(users, k=5)
+
+    assert recommendations[:2] == [[], []]
+    assert len(recommendations[2]) == 5
+    assert "2101.00000" not in [arxiv_id for arxiv_id, _ in recommendations[2]]
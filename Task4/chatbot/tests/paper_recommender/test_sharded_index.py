@@ -0,0 +1,165 @@
+import shutil
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("pyarrow")
+
+from data_handling import sharded_index as sharded_index_module  # noqa: E402
+from data_handling.sharded_index import ShardedIndex, filtered_search, id_selector  # noqa: E402
+
+
+def recall_at_k(labels, ground_truth):
+    return np.mean([len(set(result) & set(truth)) / len(truth) for result, truth in zip(labels, ground_truth)])
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(50, 32))
+    vectors = centers[rng.integers(0, 50, 6000)] + 0.3 * rng.normal(size=(6000, 32))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+@pytest.fixture(scope="module")
+def flat_index(vectors):
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+
+@pytest.fixture(scope="module")
+def index_dir(flat_index, tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("index_ivfpq"))
+    # A large shard trained with IVF-PQ and a small one kept flat
+    shard_keys = np.where(np.arange(flat_index.ntotal) < 5900, "large", "small")
+    ShardedIndex(index_dir).build(flat_index, shard_keys, m=16, nbits=4)
+    return index_dir
+
+
+@pytest.fixture
+def sharded_index(index_dir):
+    return ShardedIndex.load(index_dir)
+
+
+@pytest.fixture(scope="module")
+def queries(vectors):
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), 100, replace=False)] + 0.01 * rng.normal(size=(100, vectors.shape[1]))
+    return queries.astype("float32")
+
+
+def test_shards(sharded_index, flat_index):
+    assert set(sharded_index.shards) == {"large", "small"}
+    assert isinstance(sharded_index.shards["small"], faiss.IndexIDMap)
+    assert sharded_index.ntotal == flat_index.ntotal
+
+
+# The re-ranking recovers the recall lost by the compression
+@pytest.mark.parametrize("rerank_factor, min_recall", [(1, 0.4), (8, 0.95)])
+def test_recall_at_k(index_dir, flat_index, queries, rerank_factor, min_recall):
+    _, ground_truth = flat_index.search(queries, 10)
+
+    scores, labels = ShardedIndex.load(index_dir, rerank_factor=rerank_factor).search(queries, 10)
+
+    assert labels.shape == (len(queries), 10)
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+    assert recall_at_k(labels, ground_truth) >= min_recall
+
+
+@pytest.fixture
+def mask(vectors):
+    # About 5% of the papers, a few per inverted list
+    return np.random.default_rng(2).random(len(vectors)) < 0.05
+
+
+def exact_filtered_search(vectors, queries, k, mask):
+    labels = np.flatnonzero(mask)
+    scores = queries @ vectors[labels].T
+    return labels[np.argsort(-scores, axis=1)[:, :k]]
+
+
+def test_id_selector_rejects_labels_past_the_mask():
+    mask = np.zeros(10, dtype=bool)
+    mask[[3, 9]] = True
+
+    selector = id_selector(mask)
+
+    assert [label for label in range(100) if selector.is_member(label)] == [3, 9]
+
+
+def test_small_mask_is_searched_exactly(sharded_index, vectors, queries, mask):
+    scores, labels = filtered_search(sharded_index, queries, 10, mask)
+
+    assert labels.tolist() == exact_filtered_search(vectors, queries, 10, mask).tolist()
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+
+
+def test_filtered_search_returns_k_results_in_the_mask(sharded_index, queries, mask, monkeypatch):
+    monkeypatch.setattr(sharded_index_module, "EXACT_SEARCH_LABELS", 0)
+    # A single inverted list holds fewer than k papers of the mask, more lists are probed
+    sharded_index.set_nprobe(1)
+
+    _, labels = filtered_search(sharded_index, queries, 10, mask)
+
+    assert np.all(labels >= 0)
+    assert np.all(mask[labels])
+
+
+def test_filtered_search_without_id_selector(sharded_index, queries, monkeypatch):
+    monkeypatch.setattr(sharded_index_module, "EXACT_SEARCH_LABELS", 0)
+    monkeypatch.setattr(sharded_index_module, "id_selector", lambda mask: None)
+    mask = np.random.default_rng(3).random(sharded_index.ntotal) < 0.5
+
+    _, labels = filtered_search(sharded_index, queries[:1], 10, mask)
+
+    assert labels.shape == (1, 10)
+    assert np.all(mask[labels])
+    # The fetched results are capped, so a mask of a single paper far from the query may return fewer than k
+    _, labels = filtered_search(sharded_index, queries[:1], 10, np.arange(sharded_index.ntotal) == 0)
+    assert set(labels[0].tolist()) <= {0, -1}
+
+
+def test_filtered_search_of_the_flat_index(flat_index, vectors, queries, mask):
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    index.add_with_ids(vectors, np.arange(len(vectors)))
+    # Longer than the index, like the metadata of papers not indexed yet
+    longer_mask = np.concatenate([mask, np.ones(10, dtype=bool)])
+
+    _, labels = filtered_search(index, queries, 10, longer_mask)
+
+    assert labels.tolist() == exact_filtered_search(vectors, queries, 10, mask).tolist()
+
+
+def test_update(index_dir, vectors, tmp_path):
+    shutil.copytree(index_dir, tmp_path / "index", dirs_exist_ok=True)
+    sharded_index = ShardedIndex.load(str(tmp_path / "index"), mmap=False)
+    rng = np.random.default_rng(4)
+    new_vectors = rng.normal(size=(3, vectors.shape[1])).astype("float32")
+    new_vectors /= np.linalg.norm(new_vectors, axis=1, keepdims=True)
+    # Paper 10 is replaced and moves to a new shard, 6000 and 6001 are appended to the large shard
+    labels = np.array([10, len(vectors), len(vectors) + 1])
+
+    sharded_index.update(new_vectors, labels, ["new", "large", "large"])
+
+    updated_index = ShardedIndex.load(str(tmp_path / "index"))
+    assert updated_index.ntotal == len(vectors) + 2
+    assert isinstance(updated_index.shards["new"], faiss.IndexIDMap)
+    assert updated_index.vectors.shape == (len(vectors) + 2, vectors.shape[1])
+    assert np.allclose(updated_index.vectors[labels], new_vectors)
+    for query, label in zip(new_vectors, labels):
+        _, results = updated_index.search(query, 5)
+        assert results[0, 0] == label
+        assert np.count_nonzero(results == label) == 1
+    # The previous vector of paper 10 is no longer found
+    _, results = updated_index.search(vectors[10], 5)
+    assert 10 not in results
+
+
+def test_update_rejects_missing_papers(index_dir, vectors, tmp_path):
+    shutil.copytree(index_dir, tmp_path / "index", dirs_exist_ok=True)
+    sharded_index = ShardedIndex.load(str(tmp_path / "index"), mmap=False)
+
+    with pytest.raises(ValueError):
+        sharded_index.update(vectors[:1], [len(vectors) + 1], ["large"])
@@ -0,0 +1,105 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("pdf2image")
+Image = pytest.importorskip("PIL.Image")
+
+import utils  # noqa: E402
+from thumbnail_service import ThumbnailService  # noqa: E402
+
+
+class PdfServer(ThreadingHTTPServer):
+    """Serves a pdf at /pdf/<arxiv id>, 404 for the ids starting with "missing". The requests of the ids starting with
+    "slow" wait for the release event."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), PdfHandler)
+        self.requests = []
+        self.release = threading.Event()
+
+    def url(self, arxiv_id):
+        return f"http://127.0.0.1:{self.server_port}/abs/{arxiv_id}"
+
+
+class PdfHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        arxiv_id = self.path.split("/pdf/")[-1]
+        self.server.requests.append(arxiv_id)
+        if arxiv_id.startswith("slow"):
+            self.server.release.wait(10)
+        if arxiv_id.startswith("missing"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.end_headers()
+        self.wfile.write(b"%PDF-1.4")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def pdf_server():
+    server = PdfServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def thumbnail_service(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "thumbnail_dir", str(tmp_path))
+    # Two white pages instead of the rasterization by poppler
+    monkeypatch.setattr(utils, "convert_from_path", lambda path, **kwargs: [Image.new("RGB", (20, 28), "white")] * 2)
+    service = ThumbnailService()
+    yield service
+    service.shutdown(wait=False)
+
+
+def test_thumbnail(thumbnail_service, pdf_server):
+    path = thumbnail_service.submit(pdf_server.url("2101.00001")).result(10)
+
+    assert path == utils.get_thumbnail_path(pdf_server.url("2101.00001"))
+    with Image.open(path) as image:
+        assert image.format == "WEBP"
+        assert image.size == (40, 28)
+
+
+def test_requests_are_deduplicated(thumbnail_service, pdf_server):
+    futures = [thumbnail_service.submit(pdf_server.url("slow.00001")) for _ in range(3)]
+    pdf_server.release.set()
+
+    assert futures[0] is futures[1] is futures[2]
+    assert futures[0].result(10) is not None
+    assert pdf_server.requests == ["slow.00001"]
+
+
+def test_thumbnails_are_cached_on_disk(thumbnail_service, pdf_server):
+    path = thumbnail_service.submit(pdf_server.url("2101.00001")).result(10)
+
+    future = ThumbnailService().submit(pdf_server.url("2101.00001"))
+
+    assert future.done()
+    assert future.result() == path
+    assert pdf_server.requests == ["2101.00001"]
+
+
+def test_missing_pdf(thumbnail_service, pdf_server):
+    assert thumbnail_service.submit(pdf_server.url("missing.00001")).result(10) is None
+
+
+def test_displayed_paper_skips_the_prefetch_queue(thumbnail_service, pdf_server):
+    # The prefetch worker is busy, the second prefetch waits for it
+    thumbnail_service.prefetch([pdf_server.url("slow.00001"), pdf_server.url("2101.00002")])
+
+    future = thumbnail_service.submit(pdf_server.url("2101.00002"))
+
+    assert future.result(10) is not None
+    assert "slow.00001" in pdf_server.requests
+    assert not thumbnail_service.submit(pdf_server.url("slow.00001")).done()
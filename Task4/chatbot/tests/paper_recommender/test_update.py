@@ -0,0 +1,74 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("pyarrow")
+
+from data_handling.id_table import IdTable  # noqa: E402
+from data_handling.metadata_store import MetadataStore  # noqa: E402
+from data_handling.update import changed_papers, read_delta  # noqa: E402
+
+
+def paper(arxiv_id, update_date, title="Title"):
+    return {
+        "id": arxiv_id,
+        "title": title,
+        "abstract": f"Abstract of {arxiv_id}",
+        "doi": None,
+        "categories": "cs.LG",
+        "update_date": update_date,
+        "authors_parsed": [["Doe", "Jane", ""]],
+        "submitter": "Jane Doe",
+    }
+
+
+@pytest.fixture
+def delta_path(tmp_path):
+    path = tmp_path / "arxiv.json"
+    papers = [
+        paper("2101.00001", "2021-01-01"),
+        paper("2101.00002", "2021-03-01", title="First version"),
+        paper("2101.00003", "2021-03-02"),
+        # A later version of the same paper, in the same delta
+        paper("2101.00002", "2021-03-05", title="Second version"),
+    ]
+    path.write_text("".join(json.dumps(paper) + "\n" for paper in papers))
+    return str(path)
+
+
+def test_read_delta(delta_path):
+    papers = read_delta(delta_path)
+
+    assert papers["id"].tolist() == ["2101.00001", "2101.00003", "2101.00002"]
+    assert papers.loc[papers["id"] == "2101.00002", "title"].item() == "Second version"
+
+
+def test_read_delta_since(delta_path):
+    papers = read_delta(delta_path, since=datetime.date(2021, 3, 2))
+
+    assert papers["id"].tolist() == ["2101.00003", "2101.00002"]
+
+
+def test_changed_papers(tmp_path):
+    id_table = IdTable(str(tmp_path / "ids.bin"))
+    # The last paper was added to the index by an interrupted update, it isn't in the store
+    id_table.append(["2101.00001", "2101.00002", "2101.00004"])
+    stored = pd.DataFrame([paper("2101.00001", "2021-01-01"), paper("2101.00002", "2021-03-01")])
+    stored["categories"] = "cs.LG"
+    MetadataStore.build(str(tmp_path / "metadata.arrow"), stored)
+    store = MetadataStore(str(tmp_path / "metadata.arrow"))
+
+    delta = pd.DataFrame(
+        {
+            "id": ["2101.00001", "2101.00002", "2101.00003", "2101.00004"],
+            "update_date": [datetime.date(2021, 1, 1), datetime.date(2021, 3, 5), datetime.date(2021, 3, 2), None],
+        }
+    )
+
+    # Unchanged, replaced (a new date), appended (new) and appended (missing from the store)
+    assert changed_papers(delta, id_table, store).tolist() == [False, True, True, True]
+    assert np.array_equal(id_table.labels(delta["id"].values), [0, 1, -1, 2])
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from utils import get_cached_thumbnail, get_thumbnail
+
+
+class ThumbnailService:
+    """Long-lived pool generating the thumbnails of the papers in the background.
+
+    The thumbnails are generated by a bounded number of threads (the rasterization runs in poppler processes), and a
+    paper requested again while its thumbnail is generated gets the same future instead of a new download. Prefetched
+    thumbnails have their own worker, so they never delay the ones of the displayed results, and a prefetch still
+    waiting for that worker when its paper is displayed moves to the main pool. The thumbnails are cached on disk, in
+    the thumbnail directory shared by all the sessions.
+    """
+
+    def __init__(self, max_workers=4, max_prefetch_workers=1, thumbnail=get_thumbnail, **thumbnail_kwargs):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="thumbnail")
+        self.prefetch_executor = ThreadPoolExecutor(max_prefetch_workers, thread_name_prefix="thumbnail-prefetch")
+        # thumbnail generates the thumbnail of an arxiv url, and can be replaced in tests
+        self.thumbnail = thumbnail
+        self.thumbnail_kwargs = thumbnail_kwargs
+
+        # Futures of the thumbnails being generated and whether they were prefetched, by arxiv url
+        self.in_flight = {}
+        self.lock = threading.RLock()
+
+    def submit(self, arxiv_url, prefetch=False):
+        """Returns a future of the path of the thumbnail of the given arxiv url (None if it couldn't be generated)"""
+        cached_thumbnail = get_cached_thumbnail(arxiv_url)
+        if cached_thumbnail:
+            future = Future()
+            future.set_result(cached_thumbnail)
+            return future
+
+        with self.lock:
+            future, prefetched = self.in_flight.get(arxiv_url, (None, False))
+            # A prefetch not started yet would wait behind the other prefetches, it's generated by the main pool
+            # instead. A started one can't be cancelled and is shared
+            if future is not None and prefetched and not prefetch and future.cancel():
+                future = None
+            if future is None:
+                executor = self.prefetch_executor if prefetch else self.executor
+                future = executor.submit(self.thumbnail, arxiv_url, **self.thumbnail_kwargs)
+                self.in_flight[arxiv_url] = (future, prefetch)
+                future.add_done_callback(lambda future: self._done(arxiv_url, future))
+            return future
+
+    def _done(self, arxiv_url, future):
+        with self.lock:
+            # Only the current future of the url, a promoted prefetch has a new one
+            if self.in_flight.get(arxiv_url, (None, False))[0] is future:
+                del self.in_flight[arxiv_url]
+
+    def prefetch(self, arxiv_urls):
+        """Generates the thumbnails of the given arxiv urls in the background"""
+        for arxiv_url in arxiv_urls:
+            self.submit(arxiv_url, prefetch=True)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        self.prefetch_executor.shutdown(wait=wait)
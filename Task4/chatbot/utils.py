@@ -1,5 +1,6 @@
 from config import thumbnail_dir
-import urllib
+import urllib.request
+import tempfile
 from pdf2image import convert_from_path
 from PIL import Image
 from os.path import join, basename, exists
@@ -29,38 +30,50 @@ def get_url(arxiv_id):
     return "https://arxiv.org/abs/" + first_part + "." + second_part
 
 
-def get_thumbnail(arxiv_url):
-    """Generate a thumbnail for the given arxiv url"""
+def get_thumbnail_path(arxiv_url):
+    # Old-style ids (quant-ph/0207118) keep their archive, so they don't collide with new-style ones
+    arxiv_id = arxiv_url.split("/abs/")[-1].replace("/", "_")
+    return join(thumbnail_dir, arxiv_id + ".webp")
+
+
+def get_cached_thumbnail(arxiv_url):
+    """Returns the path of the thumbnail of the given arxiv url if it was already generated, None otherwise"""
+    thumbnail_path = get_thumbnail_path(arxiv_url)
+    # Thumbnails generated before the WebP ones are png
+    for path in [thumbnail_path, thumbnail_path[: -len(".webp")] + ".png"]:
+        if exists(path):
+            return path
+    return None
 
-    # Get the Paths
-    arxiv_id = arxiv_url.split("/")[-1]
-    pdf_path = join(thumbnail_dir, arxiv_id + ".pdf")
-    thumbnail_path = join(thumbnail_dir, arxiv_id + ".png")
+
+def get_thumbnail(arxiv_url, max_pages=4, dpi=30, quality=60):
+    """Generate a thumbnail for the given arxiv url: its first max_pages pages side by side, in a small WebP image"""
 
     # If thumbnail already exists, return
-    if exists(thumbnail_path):
-        return thumbnail_path
+    cached_thumbnail = get_cached_thumbnail(arxiv_url)
+    if cached_thumbnail:
+        return cached_thumbnail
+
+    # Get the Paths
+    thumbnail_path = get_thumbnail_path(arxiv_url)
+    arxiv_id = basename(thumbnail_path)[: -len(".webp")]
 
     # Get the thumbnail url
     # NOTE: There is also an e-print url, which contains the latex source code. This could be used to do some cool stuff
-    thumbnail_url = arxiv_url.replace("abs", "pdf")
-
-    # Download pdf, concatenate the pages horizontally and convert to png
-    try:
-        urllib.request.urlretrieve(thumbnail_url, join(thumbnail_dir, arxiv_id + ".pdf"))
+    thumbnail_url = arxiv_url.replace("/abs/", "/pdf/")
 
-        # Read pdf
-        images = convert_from_path(pdf_path)
-    except Exception as e:
-        print(f"[-] Couldn't download pdf for {arxiv_id}")
-        print("URL: " + thumbnail_url)
-        print(e)
-        return None
+    # Download pdf and rasterize only the first pages, at a low resolution
+    with tempfile.NamedTemporaryFile(dir=thumbnail_dir, prefix=arxiv_id, suffix=".pdf") as pdf_file:
+        try:
+            urllib.request.urlretrieve(thumbnail_url, pdf_file.name)
 
-    # Generate thumbnail by concatenating the pdf pages horizontally and converting to png
-
-    if len(images) > 8:
-        images = images[:8]
+            # Read pdf
+            images = convert_from_path(pdf_file.name, dpi=dpi, first_page=1, last_page=max_pages)
+        except Exception as e:
+            print(f"[-] Couldn't download pdf for {arxiv_id}")
+            print("URL: " + thumbnail_url)
+            print(e)
+            return None
 
     # Concatenate the pages horizontally
     width, height = images[0].size
@@ -68,11 +81,9 @@ def get_thumbnail(arxiv_url):
     for i, im in enumerate(images):
         new_im.paste(im, (i * width, 0))
 
-    # Save the image with less quality
-    new_im.save(thumbnail_path, dpi=(100, 100))
-
-    # Delete the pdf
-    os.remove(pdf_path)
+    # Save the image with less quality, renamed once written so a partial thumbnail is never served
+    new_im.save(thumbnail_path + ".tmp", format="WEBP", quality=quality)
+    os.replace(thumbnail_path + ".tmp", thumbnail_path)
 
     print(f"[+] Generated thumbnail for {arxiv_id}")
 
@@ -7,22 +7,27 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.
 import streamlit as st
 import faiss
 import numpy as np
-import pandas as pd
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import gc
 import time
-from os.path import join
+from os.path import join, exists
 import pickle
 import json
 import multiprocessing
-from multiprocessing import Pool
 
 
-from config import data_dir, thumbnail_dir, testing
-from utils import get_thumbnail, get_url
+from config import data_dir, thumbnail_dir, index_dir, testing
+from utils import get_url
+from thumbnail_service import ThumbnailService
+from query_cache import QueryCache
+from encoder import load_encoder
+from data_handling.sharded_index import ShardedIndex, filtered_search, reconstruct
+from data_handling.metadata_store import MetadataStore, build_metadata_store, metadata_path
 
 
+# Results after the k displayed ones whose thumbnails are prefetched
+PREFETCH_RESULTS = 5
+
 # Explicitly set the environment variable TOKENIZERS_PARALLELISM to false
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -42,35 +47,66 @@ st.set_page_config(
 if not hasattr(st.session_state, "selected_categories"):
     st.session_state.selected_categories = []
 
+if not hasattr(st.session_state, "date_range"):
+    st.session_state.date_range = (None, None)
+
 @st.experimental_singleton
-def load_data():
-    print("Loading data!")
-    if testing:
-        data = pd.read_csv(join(data_dir, "arxiv_processed_test.csv"), dtype=str)
-    else:
-        data = pd.read_csv(join(data_dir, "arxiv_processed.csv"), dtype=str)
-    return data
+def load_metadata():
+    print("Loading metadata!")
+    # Built once from the processed data, in the order of the index
+    if not exists(metadata_path(testing)):
+        build_metadata_store(testing)
+
+    return MetadataStore(metadata_path(testing))
 
 
 @st.experimental_singleton
 def load_model():
     print("Loading model!")
-    model = SentenceTransformer("all-mpnet-base-v2", device="cuda")
+    # The backend is set in config.py, the default runs on CPU-only hosts too
+    model = load_encoder()
     return model
 
 
+sharded_index_dir = index_dir + "_test" if testing else index_dir
+flat_index_path = join(data_dir, "index_test.faiss" if testing else "index.faiss")
+
+
 @st.experimental_singleton
 def load_index():
     print("Loading index!")
 
-    if testing:
-        index = faiss.read_index(join(data_dir, "index_test.faiss"))
-    else:
-        index = faiss.read_index(join(data_dir, "index.faiss"))
+    # Prefer the memory-mapped sharded index, built with data_handling/sharded_index.py
+    if ShardedIndex.exists(sharded_index_dir):
+        return ShardedIndex.load(sharded_index_dir)
+
+    index = faiss.read_index(flat_index_path)
 
     return index
 
 
+def index_version():
+    # Changes when the index or the metadata built with it is replaced, e.g. by create_index.py
+    if ShardedIndex.exists(sharded_index_dir):
+        paths = [join(sharded_index_dir, "manifest.json"), metadata_path(testing)]
+    else:
+        paths = [flat_index_path, metadata_path(testing)]
+
+    return tuple((os.stat(path).st_mtime_ns, os.stat(path).st_size) if exists(path) else None for path in paths)
+
+
+@st.experimental_singleton
+def load_thumbnail_service():
+    print("Starting thumbnail service!")
+    return ThumbnailService()
+
+
+@st.experimental_singleton
+def load_query_cache():
+    print("Starting query cache!")
+    return QueryCache()
+
+
 def load_user_tags():
     print("Loading user tags!")
     with open("tags.json", "r") as f:
@@ -79,35 +115,77 @@ def load_user_tags():
     return user_tags
 
 
-def get_user_tags_from_query(query, user_tag_keys, model):
-    # This will embedd the query and then compare it to the user tags (key + values)
+@st.experimental_memo
+def encode_user_tags(to_encode):
+    # Cached by the tag texts, so the tags are encoded again only when tags.json changes
+    print("Encoding user tags!")
+    return model.encode(list(to_encode)).reshape(len(to_encode), -1)
+
+
+def get_paper_embeddings(rows):
+    # The embeddings stored by the index, so the papers aren't encoded again
+    vectors = reconstruct(index, [row["label"] for row in rows])
+    if vectors is not None:
+        return vectors
+
+    return model.encode([row["title"] + "\n " + row["abstract"] for row in rows])
+
 
-    # Get the embeddings of the query
-    query_embedding = model.encode(query, convert_to_tensor=True).cpu()
+def get_user_tags_from_rows(rows, user_tags):
+    # This will compare the embeddings of the papers to the ones of the user tags (key + values)
+    if not rows or not user_tags:
+        return [[] for _ in rows]
 
     # Get the embeddings of the user tags
-    to_encode = [f"{key} - {','.join(value)}" for key, value in load_user_tags().items() if key in user_tag_keys]
-    user_tags_embeddings = model.encode(to_encode, convert_to_tensor=True).cpu()
+    to_encode = tuple(f"{key} - {','.join(value)}" for key, value in user_tags.items())
+    user_tags_embeddings = encode_user_tags(to_encode)
 
-    # Compute the dot product
-    dot_product = np.dot(query_embedding, user_tags_embeddings.T)
+    # Compute the dot products of all the papers and tags at once
+    dot_product = get_paper_embeddings(rows) @ user_tags_embeddings.T
 
-    # Get the tags and probabilities
-    return [(tag, prob) for tag, prob in zip(user_tag_keys, dot_product)]
+    # Get the tags and probabilities of every paper
+    return [[(tag, prob) for tag, prob in zip(user_tags, row)] for row in dot_product]
 
 
+query_cache = load_query_cache()
+# A new index invalidates the cached results, and is loaded again with its metadata
+if query_cache.check_version(index_version()):
+    load_index.clear()
+    load_metadata.clear()
+
 model = load_model()
-data = load_data()
+metadata = load_metadata()
 index = load_index()
+thumbnail_service = load_thumbnail_service()
 user_tags = load_user_tags()
 
 
+def search(query, k, categories, date_range):
+    """Returns the metadata of the k results of the query and of the next ones, whose thumbnails are prefetched.
+
+    The results are cached and shared by all the sessions, so they must not be modified.
+    """
+    # The filters are applied inside the search, so it still returns k results
+    mask = metadata.filter_mask(categories, *date_range)
+    D, I = filtered_search(index, model.encode(query).reshape(1, -1), k + PREFETCH_RESULTS, mask)
+
+    # Metadata of the k results, fetched at once
+    rows = metadata.fetch(I[0])
+    for row, score, label in zip(rows, D[0][I[0] >= 0], I[0][I[0] >= 0]):
+        row["score"] = score
+        row["label"] = int(label)
+
+    # Papers removed from the data since the index was built have no metadata
+    rows = [row for row in rows if row["id"] is not None]
+    return rows[:k], rows[k:]
+
+
 def draw_sidebar():
     """Should include dynamically generated filters"""
 
     with st.sidebar:
         # Filter by category of our data
-        categories = data["categories"].unique()
+        categories = metadata.categories
 
         # Sidebar
         st.sidebar.header("Filters")
@@ -116,9 +194,19 @@ def draw_sidebar():
         # multiselect
         selected_categories = st.sidebar.multiselect("Select categories", categories)
 
+        # Date range, all the papers by default
+        st.sidebar.subheader("By Date")
+        dates = metadata.dates[~np.isnat(metadata.dates)]
+        first_date, last_date = dates.min().astype(object), dates.max().astype(object)
+        date_range = st.sidebar.date_input("Updated between", (first_date, last_date), first_date, last_date)
+
         # Add a button to apply the filters
         if st.sidebar.button("Apply filters"):
             st.session_state.selected_categories = selected_categories
+            if len(date_range) == 2 and tuple(date_range) != (first_date, last_date):
+                st.session_state.date_range = tuple(date_range)
+            else:
+                st.session_state.date_range = (None, None)
 
             # Reload the page
             st.experimental_rerun()
@@ -182,50 +270,34 @@ def main():
 
     if query:
         start_time = time.time()
-        D, I = index.search(model.encode(query).reshape(1, -1), k)
+        categories = tuple(sorted(st.session_state.selected_categories))
+        date_range = tuple(st.session_state.date_range)
+        # Identical queries, from any session, are searched once
+        rows, next_rows = query_cache.get(
+            (query, k, categories, date_range), lambda: search(query, k, categories, date_range)
+        )
         end_time = time.time()
 
-        df = pd.DataFrame()
-        for idx, score in zip(I[0], D[0]):
-            to_add = data.iloc[idx]
+        # rows keys - # ['id', 'title', 'abstract', 'authors', 'categories', 'update_date', 'score', 'label']
 
-            # Add score
-            to_add["score"] = score
-
-            df = pd.concat([df, to_add], axis=1)
-
-        df = df.T
-
-        # df.columns - # ['id', 'abstract', 'title', 'doi', 'categories', 'update_date', 'authors_parsed', 'score']
+        # User tags of all the results
+        user_tag_lists = get_user_tags_from_rows(rows, user_tags)
 
         ##########################################
         # Show results
         ##########################################
 
-        # Iterate over rows to multiprocess the get_thumbnail function
-        pool = Pool(len(df))
-        processes = []
-        for _, row in df.iterrows():
-            processes.append(pool.apply_async(get_thumbnail, (get_url(row["id"]),)))
-        pool.close()  # no more tasks
+        # Generate the thumbnails in the background, while the results are shown
+        thumbnails = [thumbnail_service.submit(get_url(row["id"])) for row in rows]
+        thumbnail_service.prefetch([get_url(row["id"]) for row in next_rows])
 
-        i = 0
-        for _, row in df.iterrows():
+        for row, thumbnail, user_tag_list in zip(rows, thumbnails, user_tag_lists):
 
             title = row["title"].replace("\n", " ").replace("\t", " ").replace("[", " ").replace("]", " ").replace("'", " ")
             url = get_url(row["id"])
-            authors = eval(row["authors_parsed"])
-            authors = [x[1] + " " + x[0] for x in authors]
-
-            # If category not in st.session_state.selected_categories
-            categories = row["categories"].split()
-            if len(st.session_state.selected_categories) > 0:
-                c = True
-                for cat in categories:
-                    if cat in st.session_state.selected_categories:
-                        c = False
-                if c:
-                    continue
+            authors = row["authors"]
+
+            categories = row["categories"]
 
             if len(authors) > 3:
                 authors = ", ".join(authors[:3]) + " et al."
@@ -239,13 +311,12 @@ def main():
             html = f"""
                 ### [**{round(row['score']*100)}**] - :red[[{title}]({url})]  
                 <font size="5"> *{authors}*  <br>
-                {row['update_date']} - :blue[{row['categories'].replace(' ', ', ')}]"""
+                {row['update_date']} - :blue[{', '.join(categories)}]"""
 
             ###################
             #### User Tags ####
             ###################
 
-            user_tag_list = get_user_tags_from_query(row["title"] + " " + row["abstract"], user_tags, model)
             if any([prob > 0.5 for tag, prob in user_tag_list]):
                 html += f"""<br> <font size="4"> User Tags: """
                 for tag, prob in user_tag_list:
@@ -261,8 +332,7 @@ def main():
             #### Thumbnail ####
             ###################
 
-            thumbnail = processes[i].get()  # get the result from the process
-            i += 1
+            thumbnail = thumbnail.result()  # wait for the thumbnail
 
             # Add thumbnail
             if thumbnail:
@@ -284,7 +354,10 @@ def main():
             st.markdown("---")
 
         # Show sucessful query message and tell how many documents we passed
-        st.success(f"Found {len(I[0])} results in {end_time - start_time:.2f} seconds on database of {len(data)} papers.")
+        st.success(
+            f"Found {len(rows)} results in {end_time - start_time:.2f} seconds on database of {len(metadata)} papers."
+        )
+        st.caption(f"Query cache: {query_cache}")
 
 
 if __name__ == "__main__":